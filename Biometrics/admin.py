@@ -7,4 +7,14 @@ class KnownFaceAdmin(admin.ModelAdmin):
 
 @admin.register(CameraDevice)
 class CameraDevicesAdmin(admin.ModelAdmin):
-    list_display = ('name', "ip_address", "role", )
\ No newline at end of file
+    list_display = ('name', "ip_address", "role", )
+
+@admin.register(RecognitionCommand)
+class RecognitionCommandAdmin(admin.ModelAdmin):
+    list_display = ('action', 'key', 'status', 'created_at', 'handled_at', )
+    list_filter = ('action', 'status', )
+
+@admin.register(RecognitionWorker)
+class RecognitionWorkerAdmin(admin.ModelAdmin):
+    list_display = ('key', 'state', 'pid', 'frames', 'matches', 'restarts', 'heartbeat_at', )
+    list_filter = ('state', )
@@ -11,7 +11,6 @@ from datetime import datetime
 from django.core.files.uploadedfile import InMemoryUploadedFile # type: ignore
 
 # Face Recognition Modules
-import threading
 import cv2 #type: ignore
 import numpy as np #type: ignore
 import face_recognition #type: ignore
@@ -27,6 +26,7 @@ os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
 
 from .models import KnownFace #type: ignore
+from .face_cache import get_class_index
  
 from Core.models import Institution, Class, Classroom, Department, Course, Term
 from Students.models import Allocate_Student, Student 
@@ -34,11 +34,6 @@ from Staff.models import Staff
 from Attendance.models import StudentRegister, StaffRegister 
 from Timetable.models import Timetable, TableSetup
 
-# Dictionary to track running threads for each classroom
-running_threads: dict[str, threading.Thread] = {}
-stop_events: dict[str, threading.Event] = {}
-thread_lock = threading.Lock()  # prevent races on dicts
-
 context = {}
 
 THRESHOLD = 0.6
@@ -91,74 +86,6 @@ def stop_cleanup(classroom_name):
     cameras = CameraDevice.objects.filter(classroom__name = classroom_name)
     
 
-# THREADS
-def start_face_recognition_thread(key: str, timetable_id: int, camera_url: str):
-    with thread_lock:
-        if key in running_threads:
-            print(f"[INFO] Thread for {key} already running")
-            return False
-
-        ev = threading.Event()
-        stop_events[key] = ev
-
-        t = threading.Thread(
-            target=recognize_faces,
-            args=(timetable_id, camera_url, key, ev),
-            name=f"face-rec-{key}",
-            daemon=True,
-        )
-        running_threads[key] = t
-        t.start()
-        print(f"[INFO] Started recognition thread for {key}")
-        return True
-
-def stop_face_recognition_thread(key: str):
-    with thread_lock:
-        ev = stop_events.get(key, None)
-        t = running_threads.pop(key, None)
-
-    if not ev or not t:
-        print(f"[INFO] No running thread for {key}")
-        return False
-
-    ev.set()
-    print(f"[INFO] Stop signal set for {key}")
-    return True
-
-# FACE RECOGNITION
-def start_face_recognition(request, timetable_id):
-    tt = Timetable.objects.filter(id=timetable_id).select_related("classroom").first()
-    if not tt:
-        messages.error(request, "Timetable not found")
-        return redirect("view_attendance")
-
-    classroom = tt.classroom
-    key_front = f"{classroom.name}_Front"
-    key_aux   = f"{classroom.name}_Aux"
-
-    # Example: read camera URLs from classroom model fields
-    cam_front = classroom.front_cam_url  # adapt to your field
-    cam_aux   = classroom.aux_cam_url
-
-    started_any = False
-    if cam_front:
-        started_any |= start_face_recognition_thread(key_front, tt.id, cam_front)
-        classroom.front_activated = True
-        classroom.state = "Active"
-    if cam_aux:
-        started_any |= start_face_recognition_thread(key_aux, tt.id, cam_aux)
-        classroom.aux_activated = True
-        classroom.state = "Active"
-
-    classroom.save()
-
-    if started_any:
-        messages.success(request, "Recognition started")
-    else:
-        messages.info(request, "Recognition was already running")
-
-    return redirect("view_attendance")
-
 def stop_face_recognition(timetable_id):
     """Stops the face recognition process for a class."""
     tt = Timetable.objects.filter(id=timetable_id).select_related("classroom").first()
@@ -199,9 +126,16 @@ def stop_face_recognition(timetable_id):
     return {"info": f"Marked {student_count} Students Absent"}
 
 # RECOGNIZE
-def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event: threading.Event):
+def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event, report=None):
+    """
+    Marks attendance for the faces recognised on a camera until `stop_event` is set or the
+    stream ends. Runs in a thread of the recognition_supervisor worker process shared by
+    the cameras of the lesson. `report`, when given, is called after every frame with the
+    running frames/faces/matches counts.
+    """
     cap = None
     classroom = None
+    frames = faces = recognised = 0
     try:
         cap = cv2.VideoCapture(int(camera_url) if str(camera_url).isdigit() else camera_url)
         if not cap or not cap.isOpened():
@@ -222,24 +156,14 @@ def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event: th
             print("[ERROR] Trainer not found for unit", flush=True)
             return
 
-        # Preload known encodings
-        students_qs = Allocate_Student.objects.select_related("studentno").filter(Class=timetable.Class, term = timetable.term)
-        student_regnos = {s.studentno.regno for s in students_qs}
+        # Known faces of the class, loaded once for the lesson
+        face_index = get_class_index(timetable.Class_id, timetable.term_id)
 
-        known_faces_qs = KnownFace.objects.filter(regno__in=student_regnos.union({trainer_regno}))
-        known_encodings, known_names = [], []
-        for face in known_faces_qs:
-            try:
-                known_encodings.append(face.get_encoding())
-                known_names.append(face.regno)
-            except Exception as e:
-                print(f"[WARN] Failed to decode encoding for {face.regno}: {e}", flush=True)
-
-        if not known_encodings:
+        if not len(face_index):
             print("[INFO] No known encodings available", flush=True)
             return
 
-        print(f"[INFO] Recognition started for {classroom.name} ({key}) with {len(known_encodings)} faces")
+        print(f"[INFO] Recognition started for {classroom.name} ({key}) with {len(face_index)} faces")
 
         while not stop_event.is_set():
             ret, frame = cap.read()
@@ -253,13 +177,17 @@ def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event: th
 
             print("[INFO]: ", encs, flush=True)
 
-            for (top, right, bottom, left), enc in zip(locs, encs):
-                matches = face_recognition.compare_faces(known_encodings, enc, tolerance=THRESHOLD)  # you can add tolerance=
+            # Picks up faces enrolled while the lesson runs
+            face_index = get_class_index(timetable.Class_id, timetable.term_id)
+
+            # Nearest known face of every face in the frame, in one pass over the index
+            matches = face_index.match(encs, tolerance=THRESHOLD) if encs else []
+
+            for (top, right, bottom, left), match in zip(locs, matches):
                 name = "Unknown"
 
-                if True in matches:
-                    idx = matches.index(True)
-                    regno = known_names[idx]
+                if match:
+                    regno = match.regno
                     name = regno
 
                     now = datetime.now()
@@ -296,7 +224,13 @@ def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event: th
                 cv2.rectangle(frame, (left, top), (right, bottom), (0,255,0), 2)
                 cv2.putText(frame, name, (left, top-10), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255,255,255), 2)
 
-        print(f"[INFO] Stopping recognition thread: {key}", flush=True)
+            frames += 1
+            faces += len(encs)
+            recognised += sum(1 for match in matches if match)
+            if report:
+                report(frames=frames, faces=faces, matches=recognised)
+
+        print(f"[INFO] Stopping recognition: {key}", flush=True)
 
     except Exception as e:
         print(f"[EXCEPTION] in recognize_faces({key}): {e}", flush=True)
@@ -312,11 +246,6 @@ def recognize_faces(timetable_id: int, camera_url: str, key: str, stop_event: th
         if classroom:
             stop_cleanup(classroom.name)
 
-        # remove from registries
-        with thread_lock:
-            running_threads.pop(key, None)
-            stop_events.pop(key, None)
-
         channel_layer = get_channel_layer()
         if timetable_id:
             async_to_sync(channel_layer.group_send)(
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BiometricsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Biometrics'
+
+    def ready(self):
+        import Biometrics.signals
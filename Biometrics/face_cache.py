@@ -0,0 +1,143 @@
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, FrozenSet, Optional, Tuple
+
+from django.utils import timezone #type: ignore
+
+from Students.models import Allocate_Student
+from Staff.models import StaffWorkload
+
+from .models import KnownFace
+from .face_encoding import decode_encoding
+from .face_index import FaceIndex, build_face_index
+
+# KnownFace saves update cached classes in place; the timeout picks up allocation changes
+# and enrolments made in other processes
+ENCODING_TTL = 15 * 60
+
+# Processes that do not save KnownFace themselves (the recognition workers) look for rows
+# updated since their last check this often
+CHANGE_CHECK_INTERVAL = 30
+
+ClassKey = Tuple[int, int] # (class_id, term_id)
+
+class ClassFaces:
+    """
+    Known faces of a class in a term: its allocated students and the staff teaching it.
+    `members` holds every member's regno, enrolled or not, so a later enrolment can be
+    added to the index without reloading the class.
+    """
+
+    def __init__(self, members: FrozenSet[str], index: FaceIndex):
+        self.members = members
+        self.index = index
+        self.loaded_at = time.monotonic()
+        self.checked_at = timezone.now()
+
+    def expired(self) -> bool:
+        return time.monotonic() - self.loaded_at > ENCODING_TTL
+
+    def check_due(self) -> bool:
+        return (timezone.now() - self.checked_at).total_seconds() > CHANGE_CHECK_INTERVAL
+
+# Shared by the camera threads of a recognition worker process, which runs every camera
+# of a lesson. Entries are only replaced or have their index swapped for a new one under
+# _lock, so readers never need the lock.
+_classes: Dict[ClassKey, ClassFaces] = {}
+_loading: Dict[ClassKey, threading.Lock] = {}
+_lock = threading.Lock()
+_version = 0 # bumped by every KnownFace change, to detect one racing a load
+
+def load_class_faces(key: ClassKey) -> ClassFaces:
+    class_id, term_id = key
+    members = set(Allocate_Student.objects.filter(Class_id=class_id, term_id=term_id).values_list("studentno__regno", flat=True))
+    members.update(StaffWorkload.objects.filter(Class_id=class_id, term_id=term_id).values_list("regno__regno", flat=True))
+    members.discard(None)
+
+    known_faces = KnownFace.objects.filter(regno__in=members).only("regno", "encoding")
+    return ClassFaces(frozenset(members), build_face_index(known_faces))
+
+def get_class_faces(class_id, term_id) -> ClassFaces:
+    """
+    The cached known faces of a class in a term, loaded on first use and kept up to date
+    with enrolments for the rest of the lesson. Cameras of the lesson starting together
+    wait for a single load rather than each running it.
+    """
+    key = (int(class_id), int(term_id))
+    entry = _classes.get(key)
+    if entry and not entry.expired():
+        if entry.check_due():
+            apply_recent_changes(entry)
+        return entry
+
+    with _lock:
+        loading = _loading.setdefault(key, threading.Lock())
+
+    with loading:
+        entry = _classes.get(key)
+        if entry and not entry.expired():
+            return entry
+
+        # Reload if an enrolment lands while reading, as it may have been missed
+        while True:
+            version = _version
+            entry = load_class_faces(key)
+            with _lock:
+                if version == _version:
+                    _classes[key] = entry
+                    return entry
+
+def apply_recent_changes(entry: ClassFaces) -> None:
+    """
+    Applies enrolments of the class's members saved since the last check, possibly by
+    another process. Checks overlap by one interval so rows committed late are not missed;
+    applying a change twice is harmless. Deletions wait for the entry to expire.
+    """
+    with _lock:
+        if not entry.check_due():
+            return
+        since = entry.checked_at - timedelta(seconds=CHANGE_CHECK_INTERVAL)
+        entry.checked_at = timezone.now()
+
+    changed = KnownFace.objects.filter(regno__in=entry.members, updated_at__gte=since).values_list("regno", "encoding")
+    for regno, data in changed:
+        try:
+            encoding = decode_encoding(data) if data else None
+        except ValueError as e:
+            print(f"[WARN] Failed to decode encoding for {regno}: {e}", flush=True)
+            encoding = None
+        update_known_face(regno, encoding)
+
+def get_class_index(class_id, term_id) -> FaceIndex:
+    return get_class_faces(class_id, term_id).index
+
+def update_known_face(regno: str, encoding=None) -> None:
+    """
+    Adds, replaces or (without an encoding) removes `regno`'s face in every cached class
+    they belong to.
+    """
+    global _version
+    with _lock:
+        _version += 1
+        for entry in _classes.values():
+            if regno not in entry.members:
+                continue
+            try:
+                entry.index = entry.index.without_face(regno) if encoding is None else entry.index.with_face(regno, encoding)
+            except ValueError as e:
+                print(f"[WARN] Face of {regno} not cached: {e}", flush=True)
+                entry.index = entry.index.without_face(regno)
+
+def invalidate_class_faces(class_id: Optional[int] = None, term_id: Optional[int] = None) -> None:
+    """
+    Drops the cached faces of a class in a term, or of every class; they are reloaded on
+    next use.
+    """
+    global _version
+    with _lock:
+        _version += 1
+        if class_id is None:
+            _classes.clear()
+        else:
+            _classes.pop((int(class_id), int(term_id)), None)
@@ -0,0 +1,171 @@
+import struct
+from typing import NamedTuple, Optional
+
+from django.conf import settings #type: ignore
+
+import numpy as np #type: ignore
+
+from .face_index import QUERY_BATCH, FaceIndex, euclidean
+
+# Stored encoding layout (little endian):
+#   magic "JFE", version u8, dtype u8, dimension u16, flags u8 (reserved, 0), model name length u8,
+#   model name (ascii), scale f32 (int8 only), then `dimension` values of `dtype`.
+# Rows written before the header existed are bare float64 values; they are still read.
+MAGIC = b"JFE"
+VERSION = 1
+HEADER = struct.Struct("<3sBBHBB")
+SCALE = struct.Struct("<f")
+
+DTYPES = {
+    "float64": (1, np.float64),
+    "float32": (2, np.float32),
+    "float16": (3, np.float16),
+    "int8": (4, np.int8),
+}
+DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+# face_recognition's encoder
+DEFAULT_MODEL = "dlib_face_recognition_resnet_model_v1"
+LEGACY_FORMAT = "legacy"
+
+class EncodingInfo(NamedTuple):
+    version: int # 0 for legacy rows
+    dtype: str
+    dim: int
+    model: Optional[str] # unknown for legacy rows
+    nbytes: int
+
+def get_format_settings() -> dict:
+    """
+    settings.FACE_ENCODING = {"DTYPE": ..., "MODEL": ...}, with defaults.
+    """
+    config = getattr(settings, "FACE_ENCODING", None) or {}
+    return {
+        "dtype": config.get("DTYPE", "float32"),
+        "model": config.get("MODEL", DEFAULT_MODEL),
+    }
+
+def encode_encoding(encoding, dtype: Optional[str] = None, model: Optional[str] = None) -> bytes:
+    """
+    Serializes a face encoding in the versioned format. Unset options come from
+    settings.FACE_ENCODING.
+
+    Parameters:
+        dtype: "float32" (default), "float64", "float16" or "int8"; int8 stores one scale
+            per encoding with the values rounded to -127..127 of it
+    """
+    defaults = get_format_settings()
+    dtype = dtype or defaults["dtype"]
+    model = model or defaults["model"]
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown encoding dtype {dtype}")
+
+    values = np.asarray(encoding, dtype=np.float64).ravel()
+
+    code, numpy_dtype = DTYPES[dtype]
+    name = model.encode("ascii")
+    parts = [HEADER.pack(MAGIC, VERSION, code, len(values), 0, len(name)), name]
+    if dtype == "int8":
+        limit = np.abs(values).max() if len(values) else 0.0
+        scale = float(limit / 127) if limit else 1.0
+        parts.append(SCALE.pack(scale))
+        values = np.clip(np.rint(values / scale), -127, 127)
+    parts.append(values.astype(numpy_dtype).tobytes())
+    return b"".join(parts)
+
+def read_header(data: bytes):
+    """
+    EncodingInfo and the offset of the values, or None when `data` is a legacy row.
+    """
+    if len(data) < HEADER.size or data[:len(MAGIC)] != MAGIC:
+        return None
+    magic, version, code, dim, _, name_length = HEADER.unpack_from(data)
+    if code not in DTYPE_NAMES:
+        return None
+
+    dtype = DTYPE_NAMES[code]
+    offset = HEADER.size + name_length + (SCALE.size if dtype == "int8" else 0)
+    # A legacy float64 row can start with the magic by chance, but not also have the
+    # length its header implies
+    if offset + dim * np.dtype(DTYPES[dtype][1]).itemsize != len(data):
+        return None
+
+    model = data[HEADER.size:HEADER.size + name_length].decode("ascii")
+    return EncodingInfo(version, dtype, dim, model, len(data)), offset
+
+def get_encoding_info(data) -> EncodingInfo:
+    data = bytes(data)
+    header = read_header(data)
+    if header is None:
+        if len(data) % 8:
+            raise ValueError(f"Not an encoding: {len(data)} bytes without a header")
+        return EncodingInfo(0, LEGACY_FORMAT, len(data) // 8, None, len(data))
+    return header[0]
+
+def decode_encoding(data) -> np.ndarray:
+    """
+    The encoding stored in `data`, as float32 (float64 for float64 and legacy rows).
+
+    Raises:
+        ValueError for data in neither format.
+    """
+    data = bytes(data)
+    header = read_header(data)
+    if header is None:
+        if len(data) % 8:
+            raise ValueError(f"Not an encoding: {len(data)} bytes without a header")
+        return np.frombuffer(data, dtype=np.float64)
+
+    info, offset = header
+    numpy_dtype = DTYPES[info.dtype][1]
+    if info.dtype == "int8":
+        (scale,) = SCALE.unpack_from(data, offset - SCALE.size)
+        return np.frombuffer(data, dtype=np.int8, offset=offset).astype(np.float32) * np.float32(scale)
+    values = np.frombuffer(data, dtype=numpy_dtype, offset=offset)
+    return values if info.dtype == "float64" else values.astype(np.float32)
+
+def validate_dtype(encodings: np.ndarray, dtype: str, tolerance: float, noise: float = 0.35, holdout: float = 0.1, seed: int = 0) -> dict:
+    """
+    How matching changes when `encodings` are stored as `dtype`, against float64 as the
+    reference.
+
+    A `holdout` share of the encodings is left out of the gallery to act as strangers.
+    Every encoding is then probed with noise of typical length `noise`: the probes of
+    gallery faces should match them, while the strangers' probes should match nobody.
+
+    Returns:
+        {"probes", "agreement": share of probes matched the same (or unmatched) as with
+         float64, "max_value_error", "max_distance_error", "bytes"}
+    """
+    rng = np.random.default_rng(seed)
+    encodings = np.asarray(encodings, dtype=np.float64)
+    count, dim = encodings.shape
+    stored = [encode_encoding(encoding, dtype=dtype) for encoding in encodings]
+    converted = np.stack([decode_encoding(data) for data in stored]).astype(np.float64)
+
+    strangers = rng.random(count) < holdout
+    gallery = np.flatnonzero(~strangers)
+    probes = encodings + rng.normal(scale=noise / np.sqrt(dim), size=encodings.shape)
+
+    # Reference: float64 distances to the original gallery
+    known = encodings[gallery]
+    sq_norms = np.einsum("ij,ij->i", known, known)
+    nearest = np.empty(count, dtype=np.int64)
+    reference_distances = np.empty(count)
+    for start in range(0, count, QUERY_BATCH):
+        block = euclidean(probes[start:start + QUERY_BATCH], known, sq_norms)
+        nearest[start:start + QUERY_BATCH] = block.argmin(axis=1)
+        reference_distances[start:start + QUERY_BATCH] = block[np.arange(len(block)), nearest[start:start + QUERY_BATCH]]
+    reference = np.where(reference_distances <= tolerance, gallery[nearest], -1)
+
+    index = FaceIndex(converted[gallery], [str(row) for row in gallery])
+    rows, distances = index.nearest(probes, 1)
+    found = np.where(distances[:, 0] <= tolerance, gallery[rows[:, 0]], -1)
+
+    return {
+        "probes": count,
+        "agreement": float(np.mean(found == reference)),
+        "max_value_error": float(np.abs(converted - encodings).max()),
+        "max_distance_error": float(np.abs(distances[:, 0] - reference_distances).max()),
+        "bytes": sum(len(data) for data in stored),
+    }
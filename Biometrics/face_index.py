@@ -0,0 +1,307 @@
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings #type: ignore
+
+import numpy as np #type: ignore
+
+# Same default as face_recognition.compare_faces; lower is stricter
+DEFAULT_TOLERANCE = 0.6
+
+# Query encodings compared at a time, bounding the distance matrix to QUERY_BATCH x len(index)
+QUERY_BATCH = 256
+
+# IVF: inverted lists searched per query, and encodings sampled per list to train the centroids
+DEFAULT_NPROBE = 16
+TRAIN_SAMPLES_PER_LIST = 64
+
+def euclidean(queries: np.ndarray, matrix: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+    """
+    Distances between each row of `queries` and each row of `matrix`, given the squared
+    norms of the rows of `matrix`.
+    """
+    squared = queries @ matrix.T
+    squared *= -2
+    squared += sq_norms
+    squared += np.einsum("ij,ij->i", queries, queries)[:, np.newaxis]
+    np.maximum(squared, 0, out=squared) # rounding can leave identical faces slightly negative
+    return np.sqrt(squared, out=squared)
+
+def assign_lists(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Number of the nearest centroid of each row of `matrix`.
+    """
+    sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    lists = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), QUERY_BATCH * 16):
+        lists[start:start + QUERY_BATCH * 16] = euclidean(matrix[start:start + QUERY_BATCH * 16], centroids, sq_norms).argmin(axis=1)
+    return lists
+
+def train_centroids(matrix: np.ndarray, nlist: int, iterations: int, rng) -> np.ndarray:
+    """
+    k-means centroids of a sample of `matrix`; a list left empty is reseeded from the sample.
+    """
+    sample = matrix[rng.choice(len(matrix), min(len(matrix), nlist * TRAIN_SAMPLES_PER_LIST), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        lists = assign_lists(sample, centroids)
+        order = np.argsort(lists, kind="stable")
+        found, starts = np.unique(lists[order], return_index=True)
+        counts = np.diff(np.append(starts, len(order)))
+        centroids[found] = np.add.reduceat(sample[order], starts, axis=0) / counts[:, np.newaxis]
+
+        empty = np.setdiff1d(np.arange(nlist), found)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+def top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    """
+    Column numbers of the `k` smallest distances in each row, smallest first.
+    """
+    if k < distances.shape[1]:
+        found = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        found = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+    order = np.argsort(np.take_along_axis(distances, found, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(found, order, axis=1)
+
+class Match(NamedTuple):
+    regno: str
+    distance: float
+
+class FaceIndex:
+    """
+    Known face encodings held as one contiguous float32 matrix, one row per face, with the
+    regno of each row in `labels`.
+
+    Euclidean distances from a batch of query encodings to every known face are computed
+    with a single matrix product, using |q - k|^2 = |q|^2 + |k|^2 - 2 q.k with the squared
+    norms of the known faces computed once when the index is built.
+    """
+
+    def __init__(self, encodings: Sequence, labels: Sequence[str]):
+        matrix = np.ascontiguousarray(np.asarray(encodings, dtype=np.float32))
+        if matrix.ndim == 1 and matrix.size == 0:
+            matrix = matrix.reshape(0, 0)
+        if matrix.ndim != 2:
+            raise ValueError(f"Expected a 2-D array of encodings, got shape {matrix.shape}")
+        if len(labels) != matrix.shape[0]:
+            raise ValueError(f"{len(labels)} label(s) for {matrix.shape[0]} encoding(s)")
+
+        self.matrix = matrix
+        self.labels = np.asarray(labels, dtype=object)
+        self.sq_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self.options = {}
+
+    @classmethod
+    def from_known_faces(cls, known_faces: Iterable, **options) -> "FaceIndex":
+        """
+        Builds the index from KnownFace rows, skipping any whose encoding cannot be decoded
+        or does not match the dimension of the others.
+        """
+        encodings, labels = [], []
+        for face in known_faces:
+            try:
+                encoding = face.get_encoding()
+                if encodings and encoding.shape != encodings[0].shape:
+                    raise ValueError(f"dimension {encoding.shape[0]}, expected {encodings[0].shape[0]}")
+            except Exception as e:
+                print(f"[WARN] Failed to decode encoding for {face.regno}: {e}", flush=True)
+                continue
+            encodings.append(encoding)
+            labels.append(face.regno)
+
+        if not encodings:
+            return cls(np.empty((0, 0), dtype=np.float32), [], **options)
+        return cls(np.stack(encodings), labels, **options)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def with_face(self, regno: str, encoding) -> "FaceIndex":
+        """
+        A copy of the index with `regno`'s encoding added or replaced. The index itself is
+        never modified, so threads still searching it are unaffected.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).ravel()
+        if len(self) and encoding.shape[0] != self.dim:
+            raise ValueError(f"Expected an encoding of dimension {self.dim}, got {encoding.shape[0]}")
+
+        keep = self.labels != regno
+        matrix = np.vstack([self.matrix[keep], encoding]) if len(self) else encoding[np.newaxis, :]
+        return type(self)(matrix, list(self.labels[keep]) + [regno], **self.options)
+
+    def without_face(self, regno: str) -> "FaceIndex":
+        """
+        A copy of the index without `regno`, or the index itself when it does not hold them.
+        """
+        keep = self.labels != regno
+        if keep.all():
+            return self
+        return type(self)(self.matrix[keep], list(self.labels[keep]), **self.options)
+
+    def as_queries(self, encodings) -> np.ndarray:
+        queries = np.asarray(encodings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis, :]
+        if len(self) and len(queries) and queries.shape[1] != self.dim:
+            raise ValueError(f"Expected encodings of dimension {self.dim}, got {queries.shape[1]}")
+        return queries
+
+    def distances(self, encodings) -> np.ndarray:
+        """
+        Euclidean distances from each query encoding (rows) to each known face (columns).
+        """
+        queries = self.as_queries(encodings)
+        return euclidean(queries, self.matrix, self.sq_norms)
+
+    def nearest(self, encodings, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rows of the `k` nearest known faces of each query encoding and their distances,
+        nearest first, as two (queries, k) arrays. Where fewer than `k` faces were
+        considered the row is -1 and the distance inf.
+        """
+        queries = self.as_queries(encodings)
+        k = min(k, len(self))
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+
+        for start in range(0, len(queries), QUERY_BATCH):
+            block = self.distances(queries[start:start + QUERY_BATCH])
+            found = top_k(block, k)
+            rows[start:start + len(block)] = found
+            distances[start:start + len(block)] = np.take_along_axis(block, found, axis=1)
+        return rows, distances
+
+    def search(self, encodings, k: int = 1, tolerance: Optional[float] = None) -> List[List[Match]]:
+        """
+        The `k` nearest known faces of each query encoding.
+
+        Parameters:
+            encodings: one encoding or a batch of them
+            tolerance: drop matches further away than this
+
+        Returns:
+            [[Match(regno, distance)], ...] per query, nearest first
+        """
+        queries = self.as_queries(encodings)
+        if not len(self) or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        rows, distances = self.nearest(queries, k)
+        limit = np.inf if tolerance is None else tolerance
+        return [
+            [Match(self.labels[row], float(distance)) for row, distance in zip(found, found_distances) if row >= 0 and distance <= limit]
+            for found, found_distances in zip(rows, distances)
+        ]
+
+    def match(self, encodings, tolerance: float = DEFAULT_TOLERANCE) -> List[Optional[Match]]:
+        """
+        The nearest known face of each query encoding, or None when none is within
+        `tolerance`.
+        """
+        return [matches[0] if matches else None for matches in self.search(encodings, k=1, tolerance=tolerance)]
+
+class IVFFaceIndex(FaceIndex):
+    """
+    Approximate FaceIndex for institution-wide search (inverted file).
+
+    Known faces are clustered around `nlist` k-means centroids and stored grouped by
+    cluster. A query is compared only with the faces of its `nprobe` nearest clusters, so it
+    may miss its true nearest face when that face sits in another cluster. Distances that
+    are returned are exact. The exhaustive FaceIndex is the reference for its recall.
+
+    Parameters:
+        nlist: clusters (default: the square root of the number of faces)
+        nprobe: clusters searched per query; higher is slower and more accurate
+    """
+
+    def __init__(self, encodings: Sequence, labels: Sequence[str], nlist: Optional[int] = None,
+                 nprobe: int = DEFAULT_NPROBE, iterations: int = 10, seed: int = 0):
+        super().__init__(encodings, labels)
+        self.options = {"nlist": nlist, "nprobe": nprobe, "iterations": iterations, "seed": seed}
+        self.nlist = max(1, min(nlist or int(np.sqrt(len(self))), len(self)))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+
+        if not len(self):
+            self.centroids = np.empty((0, self.dim), dtype=np.float32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            return
+
+        self.centroids = train_centroids(self.matrix, self.nlist, iterations, np.random.default_rng(seed))
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+
+        # Store each cluster's faces contiguously; offsets[l]:offsets[l + 1] are cluster l's rows
+        lists = assign_lists(self.matrix, self.centroids)
+        order = np.argsort(lists, kind="stable")
+        self.matrix = np.ascontiguousarray(self.matrix[order])
+        self.labels = self.labels[order]
+        self.sq_norms = self.sq_norms[order]
+        self.offsets = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+
+    def nearest(self, encodings, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = self.as_queries(encodings)
+        k = min(k, len(self))
+        rows = np.full((len(queries), self.nprobe * k), -1, dtype=np.int64)
+        distances = np.full((len(queries), self.nprobe * k), np.inf, dtype=np.float32)
+        if not len(queries) or not k:
+            return rows[:, :k], distances[:, :k]
+
+        probes = top_k(euclidean(queries, self.centroids, self.centroid_norms), self.nprobe)
+
+        # A frame's few faces rarely share a cluster: gather each one's candidates instead
+        if len(queries) <= self.nprobe:
+            for number, (query, clusters) in enumerate(zip(queries, probes)):
+                candidates = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in clusters])
+                block = euclidean(query[np.newaxis, :], self.matrix[candidates], self.sq_norms[candidates])
+                columns = top_k(block, min(k, len(candidates)))[0]
+                rows[number, :len(columns)] = candidates[columns]
+                distances[number, :len(columns)] = block[0, columns]
+            return rows[:, :k], distances[:, :k]
+
+        # Compare every query probing a cluster with that cluster's faces in one product,
+        # keeping each query's k nearest from each probe
+        pairs = np.argsort(probes, axis=None, kind="stable")
+        probed = probes.ravel()[pairs]
+        found, starts = np.unique(probed, return_index=True)
+        for cluster, first, last in zip(found, starts, np.append(starts[1:], len(pairs))):
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            members = pairs[first:last]
+            query_rows, probe_numbers = np.divmod(members, self.nprobe)
+
+            block = euclidean(queries[query_rows], self.matrix[start:end], self.sq_norms[start:end])
+            keep = min(k, end - start)
+            columns = top_k(block, keep)
+            slots = probe_numbers[:, np.newaxis] * k + np.arange(keep)
+            rows[query_rows[:, np.newaxis], slots] = columns + start
+            distances[query_rows[:, np.newaxis], slots] = np.take_along_axis(block, columns, axis=1)
+
+        best = top_k(distances, k)
+        return np.take_along_axis(rows, best, axis=1), np.take_along_axis(distances, best, axis=1)
+
+FACE_INDEX_BACKENDS = {
+    "exact": FaceIndex,
+    "ivf": IVFFaceIndex,
+}
+
+def build_face_index(known_faces: Iterable, backend: Optional[str] = None, **options) -> FaceIndex:
+    """
+    Builds the configured FaceIndex backend over KnownFace rows.
+
+    settings.FACE_INDEX = {"BACKEND": "exact" | "ivf", "OPTIONS": {...}} picks the backend
+    and its options when `backend` is not given; the default is the exhaustive index.
+    """
+    config = getattr(settings, "FACE_INDEX", None) or {}
+    if backend is None:
+        backend = config.get("BACKEND", "exact")
+        options = {**config.get("OPTIONS", {}), **options}
+    if backend not in FACE_INDEX_BACKENDS:
+        raise ValueError(f"Unknown face index backend {backend}")
+    return FACE_INDEX_BACKENDS[backend].from_known_faces(known_faces, **options)
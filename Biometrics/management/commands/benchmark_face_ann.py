@@ -0,0 +1,72 @@
+import time
+from django.core.management.base import BaseCommand #type: ignore
+
+import numpy as np #type: ignore
+
+from Biometrics.face_index import DEFAULT_TOLERANCE, FaceIndex, IVFFaceIndex
+
+class Command(BaseCommand):
+    help = "Recall and latency of the approximate (IVF) face index against the exhaustive FaceIndex on synthetic encodings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000], help="Known faces per run")
+        parser.add_argument("--queries", type=int, default=1000, help="Faces to match per run")
+        parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16], help="Clusters searched per query")
+        parser.add_argument("--nlist", type=int, help="Clusters (default: square root of the size)")
+        parser.add_argument("--dim", type=int, default=128, help="Encoding dimension")
+        parser.add_argument("--noise", type=float, default=0.35, help="Typical distance of a query from its known face")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def timed(self, index, queries, k):
+        """
+        Milliseconds per query answering the whole batch at once, then one query at a time.
+        """
+        started = time.perf_counter()
+        result = index.nearest(queries, k)
+        batch = (time.perf_counter() - started) * 1000 / len(queries)
+
+        singles = queries[:min(len(queries), 200)]
+        started = time.perf_counter()
+        for encoding in singles:
+            index.nearest(encoding, k)
+        single = (time.perf_counter() - started) * 1000 / len(singles)
+        return result, batch, single
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        dim, k = options["dim"], 10
+
+        for size in options["sizes"]:
+            known = rng.normal(size=(size, dim)).astype(np.float32)
+            known /= np.linalg.norm(known, axis=1, keepdims=True)
+            labels = [f"REG/{i:06d}" for i in range(size)]
+            truth = rng.integers(0, size, size=options["queries"])
+            queries = known[truth] + rng.normal(scale=options["noise"] / np.sqrt(dim), size=(len(truth), dim)).astype(np.float32)
+
+            started = time.perf_counter()
+            exact = FaceIndex(known, labels)
+            build = time.perf_counter() - started
+            (rows, distances), batch, single = self.timed(exact, queries, k)
+            reference = exact.labels[rows]
+            matched = distances[:, 0] <= DEFAULT_TOLERANCE
+
+            self.stdout.write(f"\n{size:,} known faces, {len(queries)} queries")
+            self.stdout.write(f"  {'exact':<22} build {build:6.2f}s  batch {batch:7.3f}ms/q  single {single:7.3f}ms/q  recall@1 1.000  recall@{k} 1.000")
+
+            started = time.perf_counter()
+            approximate = IVFFaceIndex(known, labels, nlist=options["nlist"], seed=options["seed"])
+            build = time.perf_counter() - started
+
+            for nprobe in options["nprobe"]:
+                approximate.nprobe = max(1, min(nprobe, approximate.nlist))
+                (found, _), batch, single = self.timed(approximate, queries, k)
+                found = approximate.labels[found]
+
+                recall_1 = np.mean(found[:, 0] == reference[:, 0])
+                recall_k = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, reference)])
+                # Of the faces the exact index recognises, how many get the same regno
+                same_match = np.mean(found[matched, 0] == reference[matched, 0]) if matched.any() else 1.0
+                self.stdout.write(
+                    f"  {f'ivf {approximate.nlist}/{approximate.nprobe}':<22} build {build:6.2f}s  batch {batch:7.3f}ms/q  "
+                    f"single {single:7.3f}ms/q  recall@1 {recall_1:.3f}  recall@{k} {recall_k:.3f}  same match {same_match:.3f}"
+                )
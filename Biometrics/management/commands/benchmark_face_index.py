@@ -0,0 +1,71 @@
+import time
+from django.core.management.base import BaseCommand #type: ignore
+
+import numpy as np #type: ignore
+
+from Biometrics.face_index import DEFAULT_TOLERANCE, FaceIndex
+
+def compare_faces(known_encodings, encoding, tolerance):
+    """
+    What face_recognition.compare_faces does, inlined so the benchmark runs without the
+    dlib models installed.
+    """
+    return list(np.linalg.norm(known_encodings - encoding, axis=1) <= tolerance)
+
+class Command(BaseCommand):
+    help = "Compare face matching through FaceIndex with the per-face compare_faces loop on synthetic encodings"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--known", type=int, default=5000, help="Known faces in the index")
+        parser.add_argument("--queries", type=int, default=2000, help="Faces to match")
+        parser.add_argument("--dim", type=int, default=128, help="Encoding dimension")
+        parser.add_argument("--noise", type=float, default=0.35, help="Typical distance of a query from its known face")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        known, dim = options["known"], options["dim"]
+
+        # dlib encodings are roughly unit length, putting unrelated faces ~1.4 apart
+        known_encodings = rng.normal(size=(known, dim))
+        known_encodings /= np.linalg.norm(known_encodings, axis=1, keepdims=True)
+        labels = [f"REG/{i:06d}" for i in range(known)]
+
+        truth = rng.integers(0, known, size=options["queries"])
+        queries = known_encodings[truth] + rng.normal(scale=options["noise"] / np.sqrt(dim), size=(len(truth), dim))
+
+        # Current path: a Python list of float64 encodings, first match within tolerance
+        known_list = list(known_encodings)
+        started = time.perf_counter()
+        first = []
+        for encoding in queries:
+            matches = compare_faces(known_list, encoding, DEFAULT_TOLERANCE)
+            first.append(labels[matches.index(True)] if True in matches else None)
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index = FaceIndex(known_encodings, labels)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        nearest = index.match(queries, tolerance=DEFAULT_TOLERANCE)
+        index_seconds = time.perf_counter() - started
+
+        # The same index answering one face at a time, as a single-face frame would
+        started = time.perf_counter()
+        for encoding in queries[:min(len(queries), 500)]:
+            index.match(encoding, tolerance=DEFAULT_TOLERANCE)
+        single_seconds = (time.perf_counter() - started) / min(len(queries), 500) * len(queries)
+
+        expected = [labels[i] for i in truth]
+        legacy_correct = sum(found == label for found, label in zip(first, expected))
+        index_correct = sum(match is not None and match.regno == label for match, label in zip(nearest, expected))
+
+        self.stdout.write(f"{known} known faces, {len(queries)} queries, dim {dim}")
+        self.stdout.write(f"  compare_faces loop: {len(queries) / legacy_seconds:10,.0f} matches/s, {legacy_correct} correct")
+        self.stdout.write(f"  FaceIndex batch:    {len(queries) / index_seconds:10,.0f} matches/s, {index_correct} correct")
+        self.stdout.write(f"  FaceIndex single:   {len(queries) / single_seconds:10,.0f} matches/s")
+        self.stdout.write(
+            f"  index built in {build_seconds * 1000:.1f}ms, {index.matrix.nbytes / 1024 / 1024:.1f}MB "
+            f"(float64 list: {sum(e.nbytes for e in known_list) / 1024 / 1024:.1f}MB)"
+        )
@@ -0,0 +1,89 @@
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+from django.db import transaction #type: ignore
+from django.utils import timezone #type: ignore
+
+import numpy as np #type: ignore
+
+from Biometrics.models import KnownFace
+from Biometrics.face_encoding import DTYPES, VERSION, decode_encoding, encode_encoding, get_format_settings, validate_dtype
+from Biometrics.face_index import DEFAULT_TOLERANCE
+
+class Command(BaseCommand):
+    help = "Rewrite stored KnownFace encodings in the versioned format, after checking matching accuracy against float64"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dtype", choices=list(DTYPES), help="Storage dtype (default: settings.FACE_ENCODING)")
+        parser.add_argument("--batch-size", type=int, default=500, help="Rows rewritten per transaction")
+        parser.add_argument("--sample", type=int, default=5000, help="Stored encodings used to validate the dtype")
+        parser.add_argument("--min-agreement", type=float, default=0.999, help="Share of probes that must match as with float64")
+        parser.add_argument("--dry-run", action="store_true", help="Validate and count, but write nothing")
+
+    def handle(self, *args, **options):
+        defaults = get_format_settings()
+        dtype = options["dtype"] or defaults["dtype"]
+        batch_size = options["batch_size"]
+
+        formats = Counter()
+        sample = []
+        for data in KnownFace.objects.exclude(encoding__isnull=True).order_by("?").values_list("encoding", flat=True)[:options["sample"]]:
+            try:
+                sample.append(decode_encoding(data))
+            except ValueError:
+                pass
+        dims = Counter(len(encoding) for encoding in sample)
+        if not sample:
+            self.stdout.write("No stored encodings")
+            return
+
+        # Validate on the most common dimension; a mixed table is reported below
+        dim = dims.most_common(1)[0][0]
+        result = validate_dtype(np.stack([e for e in sample if len(e) == dim]), dtype, DEFAULT_TOLERANCE)
+        self.stdout.write(
+            f"{dtype}: {result['probes']} probes, {result['agreement']:.4%} matched as with float64, "
+            f"max value error {result['max_value_error']:.2e}, max distance error {result['max_distance_error']:.2e}"
+        )
+        if result["agreement"] < options["min_agreement"]:
+            raise CommandError(f"{dtype} changes too many matches (needs {options['min_agreement']:.2%}); nothing converted")
+
+        converted = skipped = failed = before = after = 0
+        last_id = 0
+        while True:
+            rows = list(
+                KnownFace.objects.filter(id__gt=last_id).exclude(encoding__isnull=True)
+                .order_by("id").only("id", "regno", "encoding", "updated_at")[:batch_size]
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            changed = []
+            now = timezone.now()
+            for face in rows:
+                try:
+                    info = face.get_encoding_info()
+                    formats[info.dtype] += 1
+                    if info.version == VERSION and info.dtype == dtype and info.model == defaults["model"]:
+                        skipped += 1
+                        continue
+                    data = encode_encoding(face.get_encoding(), dtype=dtype)
+                except ValueError as e:
+                    self.stderr.write(f"{face.regno}: {e}")
+                    failed += 1
+                    continue
+                before += info.nbytes
+                after += len(data)
+                face.encoding = data
+                face.updated_at = now # bulk_update skips auto_now; face caches look for changes by it
+                changed.append(face)
+
+            converted += len(changed)
+            if changed and not options["dry_run"]:
+                with transaction.atomic():
+                    KnownFace.objects.bulk_update(changed, ["encoding", "updated_at"], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would convert' if options['dry_run'] else 'Converted'} {converted} encoding(s) to {dtype} "
+            f"({before / 1024:.1f}KB -> {after / 1024:.1f}KB); {skipped} already current, {failed} unreadable. "
+            f"Found: " + ", ".join(f"{name} {count}" for name, count in formats.most_common())
+        ))
@@ -0,0 +1,67 @@
+import os, signal, time
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Timetable.models import Timetable
+from Biometrics.supervisor import (
+    HEARTBEAT_INTERVAL, MAX_RESTARTS, STOP_GRACE, RecognitionSupervisor, get_worker_health, queue_command,
+)
+
+class Command(BaseCommand):
+    help = "Run face recognition for active cameras in a pool of worker processes, one per lesson, driven by queued start/stop commands"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Cameras recognised at the same time")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks for commands")
+        parser.add_argument("--grace", type=float, default=STOP_GRACE, help="Seconds a camera has to stop before its worker is terminated")
+        parser.add_argument("--max-restarts", type=int, default=MAX_RESTARTS, help="Restarts of a crashing camera")
+        parser.add_argument("--heartbeat", type=float, default=HEARTBEAT_INTERVAL, help="Seconds between health writes")
+        # Harness: a local video file played as the camera of a lesson
+        parser.add_argument("--video", help="Recognise a local video file as the camera, then exit")
+        parser.add_argument("--timetable", type=int, help="Lesson the --video is recognised for")
+        parser.add_argument("--duration", type=float, help="Stop the --video worker after this many seconds")
+
+    def get_supervisor(self, options, keys=None) -> RecognitionSupervisor:
+        supervisor = RecognitionSupervisor(
+            options["workers"], grace=options["grace"], max_restarts=options["max_restarts"],
+            heartbeat=options["heartbeat"], keys=keys, log=self.stdout.write,
+        )
+        signal.signal(signal.SIGTERM, supervisor.request_shutdown)
+        return supervisor
+
+    def handle(self, *args, **options):
+        if not options["video"]:
+            supervisor = self.get_supervisor(options)
+            try:
+                supervisor.run(options["poll_interval"])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping, waiting for workers to finish...")
+            return
+
+        timetable = Timetable.objects.filter(id=options["timetable"]).first() if options["timetable"] else None
+        if not timetable:
+            raise CommandError("--video needs the --timetable of the lesson to recognise it for")
+        if not os.path.exists(options["video"]):
+            raise CommandError(f"{options['video']} not found")
+
+        key = f"video:{os.path.basename(options['video'])}"
+        queue_command("Start", key, timetable=timetable, stream_url=os.path.abspath(options["video"]))
+        supervisor = self.get_supervisor(options, keys=[key])
+
+        started, stop_queued = time.monotonic(), False
+        def stop_after_duration():
+            nonlocal stop_queued
+            if options["duration"] and not stop_queued and time.monotonic() - started > options["duration"]:
+                queue_command("Stop", key, timetable=timetable)
+                stop_queued = True
+
+        try:
+            supervisor.run(options["poll_interval"], until_idle=True, on_tick=stop_after_duration)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping, waiting for the worker to finish...")
+
+        for health in get_worker_health([key]):
+            self.stdout.write(self.style.SUCCESS(
+                f"{key}: {health['state']}, {health['frames']} frame(s), {health['faces']} face(s), "
+                f"{health['matches']} recognised, {health['restarts']} restart(s)"
+                + (f", error: {health['last_error']}" if health["last_error"] else "")
+            ))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Biometrics', '0003_cameradevice_is_activated'),
+        ('Timetable', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecognitionWorker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('stream_url', models.CharField(blank=True, max_length=500, null=True)),
+                ('state', models.CharField(choices=[('Starting', 'Starting'), ('Running', 'Running'), ('Stopping', 'Stopping'), ('Stopped', 'Stopped'), ('Ended', 'Ended'), ('Failed', 'Failed'), ('Interrupted', 'Interrupted')], default='Starting', max_length=20)),
+                ('pid', models.PositiveIntegerField(blank=True, null=True)),
+                ('supervisor', models.CharField(blank=True, max_length=100, null=True)),
+                ('restarts', models.PositiveIntegerField(default=0)),
+                ('frames', models.PositiveBigIntegerField(default=0)),
+                ('faces', models.PositiveBigIntegerField(default=0)),
+                ('matches', models.PositiveBigIntegerField(default=0)),
+                ('last_frame_at', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('stopped_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('camera', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Biometrics.cameradevice')),
+                ('timetable', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Timetable.timetable')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecognitionCommand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('Start', 'Start'), ('Stop', 'Stop')], max_length=10)),
+                ('key', models.CharField(max_length=255)),
+                ('stream_url', models.CharField(blank=True, max_length=500, null=True)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Done', 'Done'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('result', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('handled_at', models.DateTimeField(blank=True, null=True)),
+                ('camera', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Biometrics.cameradevice')),
+                ('timetable', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='Timetable.timetable')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='Biometrics__status_59305f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Biometrics', '0004_recognition_supervisor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knownface',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
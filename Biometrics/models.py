@@ -3,35 +3,28 @@ from __future__ import unicode_literals
 
 from django.db import models #type: ignore
 
-import numpy as np #type:ignore
+from .face_encoding import decode_encoding, encode_encoding, get_encoding_info
 
 # ==========================================================================================#
 # ========================              BIOMETRICS MODULE          =========================#
 class KnownFace(models.Model):
     regno = models.CharField(max_length=255, unique=True)
     image = models.ImageField(upload_to='face_images/')
-    encoding = models.BinaryField(null=True, blank=True)  # Store encoded face data as JSON
+    encoding = models.BinaryField(null=True, blank=True)  # Versioned binary encoding, see face_encoding
     created_at = models.DateTimeField(auto_now_add=True, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, blank=True, null=True)
 
-    def save_encoding(self, encoding_array):
-        """ Convert NumPy array to JSON and save it """
-        """ self.encoding = json.dumps(encoding_array.tolist()) """
-
-        """Save the encoding after serializing it."""
-        """ self.encoding = pickle.dumps(encoding_array) """
-        """ self.save() """
-
-        self.encoding = np.array(encoding_array).tobytes()
+    def save_encoding(self, encoding_array, **options):
+        """Serialize the encoding in the versioned format (see face_encoding.encode_encoding) and save it."""
+        self.encoding = encode_encoding(encoding_array, **options)
         self.save()
 
     def get_encoding(self):
-        """ Convert JSON string back to NumPy array """
-        """ return np.array(json.loads(self.encoding)) """
-    
-        """Deserialize the encoding when retrieving it."""
-        """ return pickle.loads(self.encoding) """
-    
-        return np.frombuffer(self.encoding)
+        """Deserialize the encoding, whichever format it was stored in."""
+        return decode_encoding(self.encoding)
+
+    def get_encoding_info(self):
+        return get_encoding_info(self.encoding)
 
     def __str__(self):
         return self.regno
@@ -61,3 +54,71 @@ class CameraDevice(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.role}) - {self.classroom.name}"
+
+RECOGNITION_ACTION_CHOICES = [
+    ("Start", "Start"),
+    ("Stop", "Stop"),
+]
+
+RECOGNITION_COMMAND_STATUS_CHOICES = [
+    ("Pending", "Pending"),
+    ("Done", "Done"),
+    ("Failed", "Failed"),
+]
+
+RECOGNITION_STATE_CHOICES = [
+    ("Starting", "Starting"),
+    ("Running", "Running"),
+    ("Stopping", "Stopping"),
+    ("Stopped", "Stopped"),
+    ("Ended", "Ended"),             # the stream finished on its own
+    ("Failed", "Failed"),
+    ("Interrupted", "Interrupted"), # the supervisor shut down; resumed when it restarts
+]
+
+class RecognitionCommand(models.Model):
+    """
+    Start/stop request for a camera's recognition worker, queued by the API and carried
+    out by the recognition_supervisor command.
+    """
+    action = models.CharField(choices=RECOGNITION_ACTION_CHOICES, max_length=10)
+    key = models.CharField(max_length=255) # camera key, e.g. "<classroom>_<role>"
+    timetable = models.ForeignKey("Timetable.Timetable", on_delete=models.CASCADE, blank=True, null=True)
+    camera = models.ForeignKey(CameraDevice, on_delete=models.SET_NULL, blank=True, null=True)
+    stream_url = models.CharField(max_length=500, blank=True, null=True)
+    status = models.CharField(choices=RECOGNITION_COMMAND_STATUS_CHOICES, max_length=20, default="Pending")
+    result = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    handled_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.action} {self.key} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"]),
+        ]
+
+class RecognitionWorker(models.Model):
+    """
+    Health of the recognition worker process of a camera, written by the supervisor.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    timetable = models.ForeignKey("Timetable.Timetable", on_delete=models.SET_NULL, blank=True, null=True)
+    camera = models.ForeignKey(CameraDevice, on_delete=models.SET_NULL, blank=True, null=True)
+    stream_url = models.CharField(max_length=500, blank=True, null=True)
+    state = models.CharField(choices=RECOGNITION_STATE_CHOICES, max_length=20, default="Starting")
+    pid = models.PositiveIntegerField(blank=True, null=True)
+    supervisor = models.CharField(max_length=100, blank=True, null=True) # host:pid of the supervisor
+    restarts = models.PositiveIntegerField(default=0)
+    frames = models.PositiveBigIntegerField(default=0)
+    faces = models.PositiveBigIntegerField(default=0)
+    matches = models.PositiveBigIntegerField(default=0)
+    last_frame_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    stopped_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.state})"
@@ -0,0 +1,29 @@
+from django.db.models.signals import post_save, post_delete #type: ignore
+from django.dispatch import receiver #type: ignore
+
+from Students.models import Allocate_Student
+
+from .models import KnownFace
+from .face_cache import update_known_face, invalidate_class_faces
+
+# Keep the faces cached in this process in step with enrolments; recognition workers in
+# other processes pick them up through face_cache.apply_recent_changes
+@receiver(post_save, sender=KnownFace)
+def sync_known_face(sender, instance, **kwargs):
+    encoding = None
+    if instance.encoding:
+        try:
+            encoding = instance.get_encoding()
+        except Exception as e:
+            print(f"[WARN] Failed to decode encoding for {instance.regno}: {e}", flush=True)
+    update_known_face(instance.regno, encoding)
+
+@receiver(post_delete, sender=KnownFace)
+def drop_known_face(sender, instance, **kwargs):
+    update_known_face(instance.regno)
+
+@receiver(post_save, sender=Allocate_Student)
+@receiver(post_delete, sender=Allocate_Student)
+def sync_class_members(sender, instance, **kwargs):
+    if instance.Class_id:
+        invalidate_class_faces(instance.Class_id, instance.term_id)
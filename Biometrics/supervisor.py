@@ -0,0 +1,492 @@
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+from django.db import connections #type: ignore
+from django.utils import timezone #type: ignore
+
+from .models import CameraDevice, RecognitionCommand, RecognitionWorker
+
+# Seconds between health writes; a supervisor silent for STALE_AFTER is considered down
+HEARTBEAT_INTERVAL = 5
+STALE_AFTER = 3 * HEARTBEAT_INTERVAL
+
+# Seconds a worker has to stop once asked before it is terminated
+STOP_GRACE = 10
+
+# Restarts of a crashing worker, waiting RESTART_BACKOFF * 2^n seconds before the n-th
+MAX_RESTARTS = 3
+RESTART_BACKOFF = 2
+
+# Seconds between frame counts sent by a worker
+REPORT_INTERVAL = 1
+
+ACTIVE_STATES = ["Starting", "Running", "Stopping"]
+
+def get_camera_key(camera: CameraDevice) -> str:
+    return f"{camera.classroom.name}_{camera.role}"
+
+# ============================== API ============================== #
+def queue_command(action: str, key: str, **fields) -> RecognitionCommand:
+    """
+    Queues a command for the supervisor, unless the same one is already pending.
+    """
+    pending = RecognitionCommand.objects.filter(action=action, key=key, status="Pending").first()
+    if pending:
+        return pending
+    return RecognitionCommand.objects.create(action=action, key=key, **fields)
+
+def request_start(timetable, camera: CameraDevice) -> RecognitionCommand:
+    return queue_command("Start", get_camera_key(camera), timetable=timetable, camera=camera, stream_url=camera.stream_url)
+
+def request_stop(timetable, camera: CameraDevice) -> RecognitionCommand:
+    return queue_command("Stop", get_camera_key(camera), timetable=timetable, camera=camera)
+
+def get_worker_health(keys: Optional[List[str]] = None) -> List[dict]:
+    """
+    State and frame counts of each camera's worker. `alive` is only true while the worker
+    is active and its supervisor is still writing heartbeats.
+    """
+    rows = RecognitionWorker.objects.order_by("key")
+    if keys is not None:
+        rows = rows.filter(key__in=keys)
+
+    now = timezone.now()
+    health = []
+    for row in rows:
+        fresh = row.heartbeat_at is not None and (now - row.heartbeat_at).total_seconds() <= STALE_AFTER
+        running_for = (now - row.started_at).total_seconds() if row.started_at and row.state in ACTIVE_STATES else None
+        health.append({
+            "key": row.key,
+            "timetable": row.timetable_id,
+            "camera": row.camera_id,
+            "state": row.state,
+            "alive": row.state in ACTIVE_STATES and fresh,
+            "pid": row.pid,
+            "supervisor": row.supervisor,
+            "restarts": row.restarts,
+            "frames": row.frames,
+            "faces": row.faces,
+            "matches": row.matches,
+            "fps": round(row.frames / running_for, 2) if running_for else None,
+            "last_frame_at": row.last_frame_at,
+            "heartbeat_at": row.heartbeat_at,
+            "started_at": row.started_at,
+            "stopped_at": row.stopped_at,
+            "last_error": row.last_error,
+        })
+    return health
+
+# ============================== WORKER ============================== #
+def run_camera(recognize, key: str, run: int, timetable_id: int, stream_url: str, stop_event, events) -> None:
+    """
+    Camera thread: runs recognition for one camera, sending its frame counts to the
+    supervisor every REPORT_INTERVAL, and a final message when recognition returns.
+    """
+    counts = {}
+    last_sent = [0.0]
+
+    def report(**latest):
+        counts.update(latest)
+        if time.monotonic() - last_sent[0] >= REPORT_INTERVAL:
+            last_sent[0] = time.monotonic()
+            events.put(("frames", key, run, dict(counts), timezone.now(), None))
+
+    try:
+        recognize(timetable_id, stream_url, key, stop_event, report=report)
+        events.put(("finished", key, run, dict(counts), timezone.now(), None))
+    except Exception as e:
+        events.put(("failed", key, run, dict(counts), timezone.now(), f"{type(e).__name__}: {e}"))
+    finally:
+        connections.close_all()
+
+def run_worker(group: str, commands, events, recognize=None) -> None:
+    """
+    Worker process: runs the cameras of one lesson, a thread each, so they share the
+    process's face_cache and load each class once. Carries out ("start", key, run,
+    timetable_id, stream_url), ("stop", key) and ("exit",) messages from the supervisor.
+    """
+    # Ctrl-C reaches the whole process group; only the supervisor decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if recognize is None:
+        # Loaded here so dlib only ever runs in worker processes
+        from .application import recognize_faces as recognize
+
+    stops = {}
+    threads = []
+    while True:
+        message = commands.get()
+        if message[0] == "start":
+            _, key, run, timetable_id, stream_url = message
+            stops[key] = threading.Event()
+            thread = threading.Thread(
+                target=run_camera,
+                args=(recognize, key, run, timetable_id, stream_url, stops[key], events),
+                name=f"face-rec-{key}",
+                daemon=True,
+            )
+            threads.append(thread)
+            thread.start()
+        elif message[0] == "stop":
+            if message[1] in stops:
+                stops[message[1]].set()
+        else:
+            break
+
+    for stop_event in stops.values():
+        stop_event.set()
+    for thread in threads:
+        thread.join()
+    connections.close_all()
+
+class WorkerGroup:
+    """
+    A worker process and the keys of the cameras it is running.
+    """
+    def __init__(self, key, process, commands):
+        self.key = key
+        self.process = process
+        self.commands = commands
+        self.cameras = set()
+        self.closing = False # told to exit, or terminated; takes no more cameras
+
+class WorkerHandle:
+    """
+    A camera running in a worker group. `run` tells its events apart from those of an
+    earlier run of the same camera.
+    """
+    def __init__(self, key, group, run, timetable_id, camera_id, stream_url, restarts):
+        self.key = key
+        self.group = group
+        self.run = run
+        self.timetable_id = timetable_id
+        self.camera_id = camera_id
+        self.stream_url = stream_url
+        self.restarts = restarts
+        self.counts = {}
+        self.last_frame_at = None
+        self.done = False
+        self.finished = False
+        self.error = None
+        self.stop_requested_at = None
+        self.interrupted = False # stopped by the supervisor shutting down, not a command
+        self.collateral = None # key of the camera of its group that would not stop, terminating both
+
+# ============================== SUPERVISOR ============================== #
+class RecognitionSupervisor:
+    """
+    Runs recognition for at most `workers` cameras at a time, carrying out the start/stop
+    commands queued in RecognitionCommand and writing each camera's health to
+    RecognitionWorker.
+
+    The cameras of a lesson run in one worker process, a thread each, so they share its
+    face_cache: a class's faces are loaded and held once however many cameras watch it.
+
+    A camera whose recognition crashes is restarted with backoff up to `max_restarts`
+    times. Cameras still running when the supervisor shuts down are marked Interrupted
+    and started again by the next supervisor.
+    """
+
+    def __init__(self, workers: int, recognize=None, grace=STOP_GRACE, max_restarts=MAX_RESTARTS,
+                 heartbeat=HEARTBEAT_INTERVAL, keys: Optional[List[str]] = None, log=print):
+        self.workers = max(workers, 1)
+        self.keys = keys # only carry out commands for these cameras, e.g. in the video harness
+        self.recognize = recognize # recognition of one camera; recognize_faces by default
+        self.grace = grace
+        self.max_restarts = max_restarts
+        self.heartbeat = heartbeat
+        self.log = log
+
+        # Workers are forked: the supervisor has Django set up already and never loads dlib
+        self.context = multiprocessing.get_context("fork")
+        self.events = self.context.Queue()
+        self.handles: Dict[str, WorkerHandle] = {}
+        self.groups: Dict[str, WorkerGroup] = {} # open group of each lesson
+        self.processes: List[WorkerGroup] = [] # every group whose process has not been reaped
+        self.restarts_due: Dict[str, tuple] = {} # key: (due at, start arguments)
+        self.runs = 0
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.shutting_down = False
+        self.last_heartbeat = 0.0
+
+    def request_shutdown(self, *args) -> None:
+        self.shutting_down = True
+
+    # ----- workers -----
+    def get_group_key(self, key, timetable_id) -> str:
+        return f"lesson:{timetable_id}" if timetable_id else f"camera:{key}"
+
+    def start_group(self, group_key) -> WorkerGroup:
+        # The child must open its own database connections rather than share ours
+        connections.close_all()
+        commands = self.context.Queue()
+        process = self.context.Process(
+            target=run_worker,
+            args=(group_key, commands, self.events, self.recognize),
+            name=f"face-rec-{group_key}",
+            daemon=True,
+        )
+        process.start()
+        group = WorkerGroup(group_key, process, commands)
+        self.groups[group_key] = group
+        self.processes.append(group)
+        self.log(f"[INFO] Started worker for {group_key} (pid {process.pid})")
+        return group
+
+    def start(self, key, timetable_id, camera_id, stream_url, restarts=0) -> WorkerHandle:
+        group_key = self.get_group_key(key, timetable_id)
+        group = self.groups.get(group_key)
+        if not group or group.closing or not group.process.is_alive():
+            group = self.start_group(group_key)
+
+        self.runs += 1
+        group.commands.put(("start", key, self.runs, timetable_id, stream_url))
+        group.cameras.add(key)
+        handle = WorkerHandle(key, group, self.runs, timetable_id, camera_id, stream_url, restarts)
+        self.handles[key] = handle
+
+        now = timezone.now()
+        RecognitionWorker.objects.update_or_create(key=key, defaults={
+            "timetable_id": timetable_id, "camera_id": camera_id, "stream_url": stream_url,
+            "state": "Starting", "pid": group.process.pid, "supervisor": self.name, "restarts": restarts,
+            "frames": 0, "faces": 0, "matches": 0, "last_frame_at": None,
+            "heartbeat_at": now, "started_at": now, "stopped_at": None, "last_error": None,
+        })
+        if camera_id:
+            CameraDevice.objects.filter(id=camera_id).update(is_activated=True)
+        self.log(f"[INFO] Started {key} in {group_key} (pid {group.process.pid})")
+        return handle
+
+    def stop(self, key) -> str:
+        self.restarts_due.pop(key, None)
+        handle = self.handles.get(key)
+        if not handle:
+            RecognitionWorker.objects.filter(key=key).exclude(state="Stopped").update(state="Stopped", stopped_at=timezone.now())
+            return "Not running"
+
+        if not handle.stop_requested_at:
+            handle.group.commands.put(("stop", key))
+            handle.stop_requested_at = time.monotonic()
+            RecognitionWorker.objects.filter(key=key).update(state="Stopping")
+        return "Stopping"
+
+    def close_group(self, group: WorkerGroup, terminate=False) -> None:
+        group.closing = True
+        if self.groups.get(group.key) is group:
+            del self.groups[group.key]
+        if terminate:
+            group.process.terminate()
+        else:
+            group.commands.put(("exit",))
+
+    def reap(self) -> None:
+        """
+        Records cameras that have finished and worker processes that have exited. A camera
+        that outlives its stop grace can only be stopped with its whole process; the other
+        cameras of the process are started again straight away.
+        """
+        for group in list(self.processes):
+            if group.process.is_alive():
+                continue
+            group.process.join()
+            self.drain_events()
+            self.processes.remove(group)
+            if self.groups.get(group.key) is group:
+                del self.groups[group.key]
+
+            exitcode = group.process.exitcode
+            for key in group.cameras:
+                handle = self.handles.get(key)
+                if handle and handle.group is group and not handle.done:
+                    handle.done = True
+                    if handle.collateral:
+                        handle.error = f"Worker terminated as {handle.collateral} would not stop"
+                    else:
+                        handle.error = f"Worker exited with code {exitcode}" if exitcode else "Worker exited before recognition finished"
+
+        for key, handle in list(self.handles.items()):
+            if not handle.done:
+                if handle.stop_requested_at and not handle.group.closing and time.monotonic() - handle.stop_requested_at > self.grace:
+                    self.log(f"[WARN] {key} did not stop within {self.grace}s, terminating {handle.group.key}")
+                    for other in handle.group.cameras:
+                        sibling = self.handles.get(other)
+                        if sibling and sibling.group is handle.group and not sibling.stop_requested_at:
+                            sibling.collateral = key
+                    self.close_group(handle.group, terminate=True)
+                continue
+
+            del self.handles[key]
+            handle.group.cameras.discard(key)
+
+            error = None
+            if handle.stop_requested_at:
+                state = "Interrupted" if handle.interrupted else "Stopped"
+            elif handle.finished:
+                state = "Ended"
+            else:
+                state = "Failed"
+                error = handle.error or "Recognition exited before it finished"
+
+            self.write_worker(handle, state=state, stopped_at=timezone.now(), last_error=error)
+            self.log(f"[INFO] {key} {state.lower()}" + (f": {error}" if error else ""))
+
+            if state == "Failed" and handle.collateral and not self.shutting_down:
+                self.restarts_due[key] = (time.monotonic(), (key, handle.timetable_id, handle.camera_id, handle.stream_url, handle.restarts))
+                self.log(f"[INFO] Restarting {key}")
+            elif state == "Failed" and handle.restarts < self.max_restarts and not self.shutting_down:
+                delay = RESTART_BACKOFF * 2 ** handle.restarts
+                self.restarts_due[key] = (time.monotonic() + delay, (key, handle.timetable_id, handle.camera_id, handle.stream_url, handle.restarts + 1))
+                self.log(f"[INFO] Restarting {key} in {delay}s")
+            elif state != "Interrupted" and handle.camera_id:
+                CameraDevice.objects.filter(id=handle.camera_id).update(is_activated=False)
+
+        # A group left without cameras exits; the lesson's next camera starts a new one
+        for group in list(self.groups.values()):
+            if not group.cameras:
+                self.close_group(group)
+
+    def start_due_restarts(self) -> None:
+        for key, (due_at, arguments) in list(self.restarts_due.items()):
+            if due_at <= time.monotonic() and len(self.handles) < self.workers:
+                del self.restarts_due[key]
+                self.start(*arguments)
+
+    # ----- commands and health -----
+    def recover(self) -> None:
+        """
+        Queues a start for every camera a previous supervisor left active or interrupted.
+        """
+        for row in RecognitionWorker.objects.filter(state__in=ACTIVE_STATES + ["Interrupted"]):
+            if row.state == "Stopping":
+                RecognitionWorker.objects.filter(id=row.id).update(state="Stopped", stopped_at=timezone.now())
+                continue
+            queue_command("Start", row.key, timetable_id=row.timetable_id, camera_id=row.camera_id, stream_url=row.stream_url)
+            self.log(f"[INFO] Resuming {row.key}")
+
+    def get_pending_commands(self):
+        commands = RecognitionCommand.objects.filter(status="Pending")
+        if self.keys is not None:
+            commands = commands.filter(key__in=self.keys)
+        return commands.order_by("id")
+
+    def handle_commands(self) -> None:
+        for command in self.get_pending_commands():
+            if command.action == "Stop":
+                result = self.stop(command.key)
+                # Starts still waiting for a free worker are overtaken by the stop
+                RecognitionCommand.objects.filter(
+                    action="Start", key=command.key, status="Pending", id__lt=command.id
+                ).update(status="Done", result="Cancelled by a later stop", handled_at=timezone.now())
+            else:
+                handle = self.handles.get(command.key)
+                if handle and handle.stop_requested_at:
+                    continue # starts again once the previous run has exited
+                if handle:
+                    result = "Already running"
+                elif len(self.handles) >= self.workers:
+                    continue # waits for a free worker
+                elif not command.stream_url:
+                    RecognitionCommand.objects.filter(id=command.id).update(status="Failed", result="No stream URL", handled_at=timezone.now())
+                    continue
+                else:
+                    self.restarts_due.pop(command.key, None)
+                    handle = self.start(command.key, command.timetable_id, command.camera_id, command.stream_url)
+                    result = f"Started (pid {handle.group.process.pid})"
+
+            RecognitionCommand.objects.filter(id=command.id).update(status="Done", result=result, handled_at=timezone.now())
+
+    def drain_events(self) -> None:
+        while True:
+            try:
+                kind, key, run, counts, at, error = self.events.get_nowait()
+            except queue.Empty:
+                return
+            handle = self.handles.get(key)
+            if not handle or handle.run != run:
+                continue
+            handle.counts = counts
+            handle.last_frame_at = at if counts else handle.last_frame_at
+            if kind != "frames":
+                handle.done = True
+                handle.finished = kind == "finished"
+                handle.error = error
+
+    def write_worker(self, handle: WorkerHandle, **fields) -> None:
+        RecognitionWorker.objects.filter(key=handle.key).update(
+            frames=handle.counts.get("frames", 0),
+            faces=handle.counts.get("faces", 0),
+            matches=handle.counts.get("matches", 0),
+            last_frame_at=handle.last_frame_at,
+            heartbeat_at=timezone.now(),
+            **fields,
+        )
+
+    def write_health(self) -> None:
+        for handle in self.handles.values():
+            state = "Stopping" if handle.stop_requested_at else "Running" if handle.last_frame_at else "Starting"
+            self.write_worker(handle, state=state)
+        self.last_heartbeat = time.monotonic()
+
+    # ----- loop -----
+    def pending(self) -> bool:
+        return bool(self.handles or self.processes or self.restarts_due or self.get_pending_commands().exists())
+
+    def tick(self) -> None:
+        self.handle_commands()
+        self.drain_events()
+        self.reap()
+        self.start_due_restarts()
+        if time.monotonic() - self.last_heartbeat >= self.heartbeat:
+            self.write_health()
+
+    def run(self, poll_interval=1.0, until_idle=False, on_tick=None) -> None:
+        """
+        Supervises until asked to shut down, or with `until_idle` until no worker is
+        running and no command is waiting. `on_tick` is called before every check.
+        """
+        self.log(f"[INFO] Recognition supervisor {self.name} started with {self.workers} worker(s)")
+        if self.keys is None:
+            self.recover()
+        try:
+            while not self.shutting_down:
+                if on_tick:
+                    on_tick()
+                self.tick()
+                if until_idle and not self.pending():
+                    break
+                time.sleep(poll_interval)
+        finally:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        """
+        Asks every camera to stop, waits out the grace period and terminates the worker
+        processes still running.
+        """
+        self.shutting_down = True
+        for key, handle in list(self.handles.items()):
+            if not handle.stop_requested_at:
+                self.stop(key)
+                handle.interrupted = True
+
+        deadline = time.monotonic() + self.grace
+        while (self.handles or self.processes) and time.monotonic() < deadline:
+            self.drain_events()
+            self.reap()
+            time.sleep(0.1)
+        for group in self.processes:
+            group.process.terminate()
+        while self.handles or self.processes:
+            self.reap()
+            time.sleep(0.05)
+
+        # Crashed cameras waiting to restart are resumed by the next supervisor instead
+        RecognitionWorker.objects.filter(key__in=list(self.restarts_due)).update(state="Interrupted")
+        self.restarts_due.clear()
+        self.log(f"[INFO] Recognition supervisor {self.name} stopped")
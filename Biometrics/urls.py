@@ -13,5 +13,6 @@ urlpatterns = [
     path('api/stop-face-attendance/', stop_face_attendance, name = "stop-face-attendance"),
 
     path('api/camera_count/', camera_count, name='camera-count'),
+    path('api/recognition-health/', recognition_health, name='recognition-health'),
 
 ]
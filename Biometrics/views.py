@@ -8,17 +8,20 @@ from django.core.files.uploadedfile import InMemoryUploadedFile  #type: ignore
 from django.http import StreamingHttpResponse, JsonResponse #type: ignore
 from django.shortcuts import get_object_or_404  #type: ignore
 
-import threading
 import cv2  #type: ignore
 import numpy as np #type: ignore
 import face_recognition  #type: ignore
 import requests
+from datetime import date
 
+from Core.jobs import enqueue
 from Students.models import Student
 from Staff.models import Staff
 from Timetable.models import Timetable
 
 from .models import *
+from .face_encoding import encode_encoding
+from .supervisor import get_camera_key, get_worker_health, request_start, request_stop
 from .application import *
 from .filters import *
 from .serializers import *
@@ -104,7 +107,7 @@ class FaceEnrollView(APIView):
             # Save or update KnownFace record
             known_face, created = KnownFace.objects.get_or_create(regno=regno)
             known_face.image.save(image_file.name, image_file, save=False)
-            known_face.encoding = np.array(encoding).tobytes()
+            known_face.encoding = encode_encoding(encoding)
             known_face.save()
 
             return Response({
@@ -147,43 +150,14 @@ def activate_camera(request):
         if not cameras.exists():
             return JsonResponse({"error": "No active cameras set for this classroom"}, status=400)
 
-        success = []
-        errors = []
-        info = []
+        # Recognition runs in the recognition_supervisor's worker processes, not here
+        success, errors, info = [], [], []
         for cam in cameras:
-            key = f"{cam.classroom.name}_{cam.role}"
+            key = get_camera_key(cam)
             try:
-                # Skip if already running
-                if key in running_threads and running_threads[key].is_alive():
-                    info.append(f"{key} Already running")
-                    continue
-
-                # Test stream
-                cap = cv2.VideoCapture(cam.stream_url)
-                ret, frame = cap.read()
-                cap.release()
-                if not ret:
-                    raise Exception("Stream not accessible")
- 
-                cam.is_activated = True
-                cam.save()
- 
-                # Start recognition thread
-                stop_event = threading.Event()
-                stop_events[key] = stop_event
-                thread = threading.Thread(
-                    target=recognize_faces,
-                    args=(lesson_id, cam.stream_url, key, stop_event),
-                    daemon=True
-                )
-                running_threads[key] = thread
-                thread.start()
-
-                success.append(f"{key} Activated")
- 
+                command = request_start(timetable, cam)
+                success.append(f"{key} start queued (command #{command.id})")
             except Exception as e:
-                cam.is_activated = False
-                cam.save()
                 errors.append(f"{key} Failed: {str(e)}")
 
         return JsonResponse({"success": success, "errors": errors, "info": info})
@@ -215,37 +189,18 @@ def stop_face_attendance(request):
         success, errors, info = [], [], []
 
         for cam in cameras:
-            key = f"{cam.classroom.name}_{cam.role}"
+            key = get_camera_key(cam)
             try:
-                # Stop if running
-                if key in running_threads and running_threads[key].is_alive():
-                    # Signal stop
-                    if key in stop_events:
-                        stop_events[key].set()
-                        success.append(f"{key} stopping signal sent")
-                    else:
-                        info.append(f"{key} no stop flag, might already be stopped")
-                else:
-                    info.append(f"{key} not running")
-
-                stop_cleanup(cam.classroom.name)
-                with thread_lock:
-                    running_threads.pop(key, None)
-                    stop_events.pop(key, None)
-
-                # Mark camera deactivated
-                cam.is_activated = False
-                cam.save()
-
+                command = request_stop(timetable, cam)
+                success.append(f"{key} stop queued (command #{command.id})")
             except Exception as e:
                 errors.append(f"{key} Failed: {str(e)}")
 
-        # Mark Students Absent:
-        result = stop_face_recognition(timetable_id=timetable.id)
-        info.append(result["info"])
-        errors.append(result["errors"])
+        # Mark Students Absent (in the background job queue):
+        job = enqueue(stop_face_recognition, timetable.id, key=f"mark-absentees:{timetable.id}:{date.today()}")
+        info.append(f"Absentee marking queued (job #{job.id})")
         
-        return JsonResponse({"success": success, "errors": errors, "info": info, "result": result})
+        return JsonResponse({"success": success, "errors": errors, "info": info, "result": {"job": job.id, "status": job.status}})
 
     except Exception as e:
         print("Camera Deactivation Error:", e)
@@ -267,9 +222,15 @@ def camera_status(request):
     classroom = timetable.classroom
     cameras = CameraDevice.objects.filter(classroom=classroom, is_active=True)
 
+    health = {row["key"]: row for row in get_worker_health([get_camera_key(cam) for cam in cameras])}
     statuses = {}
     for cam in cameras:
-        key = f"{cam.classroom.name}_{cam.role}"
-        statuses[key] = key in running_threads and running_threads[key].is_alive()
+        key = get_camera_key(cam)
+        statuses[key] = key in health and health[key]["alive"]
 
-    return JsonResponse({"statuses": statuses})
\ No newline at end of file
+    return JsonResponse({"statuses": statuses, "workers": list(health.values())})
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def recognition_health(request):
+    return Response({"workers": get_worker_health()})
\ No newline at end of file
@@ -3,6 +3,7 @@ from .models import *
 from django.urls import reverse #type:ignore
 from django.utils.http import urlencode #type:ignore
 from django.utils.html import format_html #type:ignore
+from django.utils import timezone #type:ignore
 
 @admin.register(Institution)
 class InstitutionAdmin(admin.ModelAdmin):
@@ -69,3 +70,15 @@ class SponsorAdmin(admin.ModelAdmin):
 @admin.register(CourseDuration)
 class CourseDurationAdmin(admin.ModelAdmin):
     list_display = ('course', 'module', 'duration')
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("name", "key", "status", "attempts", "max_attempts", "run_at", "started_at", "finished_at")
+    readonly_fields = ("progress",)
+    list_filter = ("status", "name")
+    search_fields = ("name", "key")
+    actions = ["retry_jobs"]
+
+    @admin.action(description="Retry selected jobs")
+    def retry_jobs(self, request, queryset):
+        queryset.exclude(status="Running").update(status="Queued", attempts=0, run_at=timezone.now(), locked_by=None)
@@ -0,0 +1,43 @@
+import json, time
+from typing import Callable, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder #type: ignore
+
+from .jobs import enqueue
+from .models import Forecast
+
+def store_forecast(name: str, version: str, compute: Callable[[], dict]) -> dict:
+    """
+    Computes a forecast and saves it under `name`, tagged with `version`.
+
+    Returns:
+        The data as it was stored (JSON types, so dict keys are strings).
+    """
+    started = time.perf_counter()
+    data = json.loads(json.dumps(compute(), cls=DjangoJSONEncoder))
+
+    Forecast.objects.update_or_create(name=name, defaults={
+        "version": version,
+        "data": data,
+        "compute_time": time.perf_counter() - started,
+    })
+    return data
+
+def get_forecast(name: str, version: str, compute: Callable[[], dict], refresh: Callable = None) -> Tuple[dict, bool]:
+    """
+    Returns the stored forecast when it was computed from `version` of the data. A stale one
+    is returned as is while `refresh` (a job function) recomputes it in the background; with
+    no stored forecast, or no `refresh`, it is computed now.
+
+    Returns:
+        (data, is_current)
+    """
+    forecast = Forecast.objects.filter(name=name).first()
+    if forecast and forecast.version == version:
+        return forecast.data, True
+
+    if forecast and refresh:
+        enqueue(refresh, key=f"forecast:{name}:{version}"[:255], max_attempts=1)
+        return forecast.data, False
+
+    return store_forecast(name, version, compute), True
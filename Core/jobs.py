@@ -0,0 +1,260 @@
+import threading, traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction #type: ignore
+from django.db.models import Count, F #type: ignore
+from django.db.models.functions import Coalesce #type: ignore
+from django.utils import timezone #type: ignore
+from django.utils.module_loading import import_string #type: ignore
+
+from .models import Job
+
+RETRY_BASE_SECONDS = 10
+RETRY_MAX_SECONDS = 60 * 60
+HEARTBEAT_SECONDS = 30
+LATENCY_WINDOW = timedelta(hours=1)
+
+# The job each worker thread is running, for `report_progress`
+_running = threading.local()
+
+# ============================== ENQUEUE ============================== #
+def get_task_name(func) -> str:
+    if isinstance(func, str):
+        return func
+    return f"{func.__module__}.{func.__qualname__}"
+
+def enqueue(func, *args, key=None, max_attempts=5, delay=0, sensitive=False, **kwargs) -> Job:
+    """
+    Queues `func(*args, **kwargs)` for the `run_jobs` worker. Arguments must be JSON serializable.
+
+    Parameters:
+        key: idempotency key; a job with the same key is only ever queued once.
+        delay: seconds to wait before the job becomes runnable.
+        sensitive: clear the payload once the job finishes (e.g. it carries credentials).
+
+    Returns:
+        The queued Job, or the existing one for `key`.
+    """
+    payload = {"args": list(args), "kwargs": kwargs}
+    if sensitive:
+        payload["sensitive"] = True
+
+    fields = dict(
+        name = get_task_name(func),
+        payload = payload,
+        max_attempts = max_attempts,
+        run_at = timezone.now() + timedelta(seconds=delay),
+    )
+
+    if not key:
+        return Job.objects.create(**fields)
+
+    existing = Job.objects.filter(key=key).first()
+    if existing:
+        return existing
+
+    try:
+        with transaction.atomic():
+            return Job.objects.create(key=key, **fields)
+    except IntegrityError:
+        return Job.objects.get(key=key)
+
+def requeue(func, *args, key, max_attempts=5, **kwargs) -> bool:
+    """
+    Queues `func(*args, **kwargs)` under `key` again: as a new job if there is none, or by
+    resetting the finished (Done or Failed) job to run now. A job for `key` that is still
+    Queued or Running is left as it is.
+
+    Returns:
+        True if a job was queued.
+    """
+    existing = Job.objects.filter(key=key).first()
+    if not existing:
+        enqueue(func, *args, key=key, max_attempts=max_attempts, **kwargs)
+        return True
+
+    return bool(Job.objects.filter(pk=existing.pk, status__in=["Done", "Failed"]).update(
+        name = get_task_name(func),
+        payload = {"args": list(args), "kwargs": kwargs},
+        status = "Queued",
+        attempts = 0,
+        max_attempts = max_attempts,
+        run_at = timezone.now(),
+        locked_by = None,
+        started_at = None,
+        heartbeat_at = None,
+        finished_at = None,
+        last_error = None,
+    ))
+
+# ============================== WORKER ============================== #
+def get_retry_delay(attempts: int) -> int:
+    """
+    Exponential backoff: 10s, 20s, 40s ... capped at an hour.
+    """
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+def claim_jobs(worker: str, limit: int) -> list:
+    """
+    Marks up to `limit` runnable jobs as Running for this worker. Each claim is a conditional
+    update, so several workers can poll the same table without running a job twice.
+    """
+    now = timezone.now()
+    candidates = (
+        Job.objects.filter(status="Queued", run_at__lte=now)
+        .order_by("run_at", "id")
+        .values_list("id", flat=True)[:limit * 2]
+    )
+
+    claimed = []
+    for job_id in candidates:
+        won = Job.objects.filter(pk=job_id, status="Queued").update(
+            status = "Running",
+            locked_by = worker,
+            started_at = now,
+            heartbeat_at = now,
+            attempts = F("attempts") + 1,
+        )
+        if won:
+            claimed.append(job_id)
+        if len(claimed) >= limit:
+            break
+
+    return list(Job.objects.filter(pk__in=claimed).order_by("run_at", "id"))
+
+def finish_job(job: Job, error=None) -> None:
+    now = timezone.now()
+    payload = {} if job.payload.get("sensitive") else job.payload
+
+    if error is None:
+        Job.objects.filter(pk=job.pk).update(status="Done", finished_at=now, last_error=None, payload=payload)
+    elif job.attempts < job.max_attempts:
+        Job.objects.filter(pk=job.pk).update(
+            status = "Queued",
+            locked_by = None,
+            run_at = now + timedelta(seconds=get_retry_delay(job.attempts)),
+            last_error = error,
+        )
+    else:
+        Job.objects.filter(pk=job.pk).update(status="Failed", finished_at=now, last_error=error, payload=payload)
+
+def run_job(job: Job) -> bool:
+    """
+    Runs a claimed job and records the outcome. Exceptions are retried with backoff until
+    `max_attempts` is reached. Returns True on success.
+    """
+    _running.job = job
+    try:
+        func = import_string(job.name)
+        func(*job.payload.get("args", []), **job.payload.get("kwargs", {}))
+    except Exception:
+        error = traceback.format_exc()
+        print(f"[JOB ERROR]: {job} {error}")
+        finish_job(job, error)
+        return False
+    finally:
+        _running.job = None
+
+    finish_job(job)
+    return True
+
+def get_current_job():
+    """
+    The Job this thread is running, or None when the task was called directly.
+    """
+    return getattr(_running, "job", None)
+
+def report_progress(**progress) -> None:
+    """
+    Records how far the running task has got on its Job, e.g.
+    report_progress(total=1200, done=500). Does nothing outside a job.
+    """
+    job = get_current_job()
+    if job is None:
+        return
+    job.progress = progress
+    Job.objects.filter(pk=job.pk).update(progress=progress, heartbeat_at=timezone.now())
+
+def beat_jobs(worker: str, job_ids) -> int:
+    """
+    Marks the jobs this worker is still running as alive, so `requeue_stale_jobs` leaves
+    long jobs alone. Returns the number of jobs updated.
+    """
+    return Job.objects.filter(pk__in=list(job_ids), status="Running", locked_by=worker).update(heartbeat_at=timezone.now())
+
+def get_job_status(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "name": job.name,
+        "key": job.key,
+        "status": job.status,
+        "attempts": job.attempts,
+        "progress": job.progress,
+        "error": job.last_error if job.status == "Failed" else None,
+        "started_at": job.started_at,
+        "heartbeat_at": job.heartbeat_at,
+        "finished_at": job.finished_at,
+    }
+
+def requeue_stale_jobs(stale_after: int) -> int:
+    """
+    Puts back jobs left Running by a worker that died, i.e. with no heartbeat for
+    `stale_after` seconds. Returns the number requeued.
+    """
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    stale = (
+        Job.objects.filter(status="Running")
+        .alias(last_seen=Coalesce("heartbeat_at", "started_at"))
+        .filter(last_seen__lt=cutoff)
+    )
+
+    failed = stale.filter(attempts__gte=F("max_attempts")).update(
+        status="Failed", finished_at=timezone.now(), last_error="Worker stopped while running the job"
+    )
+    requeued = stale.update(status="Queued", locked_by=None, run_at=timezone.now())
+    return failed + requeued
+
+# ============================== STATS ============================== #
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def queue_stats() -> dict:
+    """
+    Queue depth per status and task, plus wait/run latency (seconds) of jobs finished in the last hour.
+    """
+    now = timezone.now()
+
+    depth = {status: 0 for status, _ in Job._meta.get_field("status").choices}
+    for row in Job.objects.values("status").annotate(total=Count("id")).order_by():
+        depth[row["status"]] = row["total"]
+
+    by_task = {}
+    for row in Job.objects.filter(status__in=["Queued", "Running", "Failed"]).values("name", "status").annotate(total=Count("id")).order_by():
+        by_task.setdefault(row["name"], {})[row["status"]] = row["total"]
+
+    oldest = Job.objects.filter(status="Queued", run_at__lte=now).order_by("run_at").values_list("run_at", flat=True).first()
+
+    finished = (
+        Job.objects.filter(status="Done", finished_at__gte=now - LATENCY_WINDOW)
+        .order_by("-finished_at")
+        .values_list("created_at", "started_at", "finished_at")[:5000]
+    )
+    waits = [(started - created).total_seconds() for created, started, _ in finished if started]
+    runs = [(done - started).total_seconds() for _, started, done in finished if started]
+
+    return {
+        "depth": depth,
+        "ready": Job.objects.filter(status="Queued", run_at__lte=now).count(),
+        "oldest_ready_age": (now - oldest).total_seconds() if oldest else 0,
+        "by_task": by_task,
+        "latency": {
+            "completed": len(runs),
+            "wait_avg": sum(waits) / len(waits) if waits else None,
+            "wait_p95": percentile(waits, 0.95),
+            "run_avg": sum(runs) / len(runs) if runs else None,
+            "run_p95": percentile(runs, 0.95),
+        },
+    }
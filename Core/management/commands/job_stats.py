@@ -0,0 +1,34 @@
+import json
+from django.core.management.base import BaseCommand #type: ignore
+
+from Core.jobs import queue_stats
+
+class Command(BaseCommand):
+    help = "Show background job queue depth and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the raw stats as JSON")
+
+    def seconds(self, value):
+        return "-" if value is None else f"{value:.2f}s"
+
+    def handle(self, *args, **options):
+        stats = queue_stats()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+
+        depth = stats["depth"]
+        self.stdout.write("Depth:   " + ", ".join(f"{status} {total}" for status, total in depth.items()))
+        self.stdout.write(f"Ready:   {stats['ready']} (oldest waiting {self.seconds(stats['oldest_ready_age'])})")
+
+        latency = stats["latency"]
+        self.stdout.write(
+            f"Latency: {latency['completed']} done in the last hour, "
+            f"wait avg {self.seconds(latency['wait_avg'])} p95 {self.seconds(latency['wait_p95'])}, "
+            f"run avg {self.seconds(latency['run_avg'])} p95 {self.seconds(latency['run_p95'])}"
+        )
+
+        for name, counts in sorted(stats["by_task"].items()):
+            self.stdout.write(f"  {name}: " + ", ".join(f"{status} {total}" for status, total in counts.items()))
@@ -0,0 +1,62 @@
+import os, socket, time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand #type: ignore
+from django.db import connection #type: ignore
+
+from Core.jobs import HEARTBEAT_SECONDS, beat_jobs, claim_jobs, run_job, requeue_stale_jobs
+
+class Command(BaseCommand):
+    help = "Run queued background jobs with a bounded pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Jobs run at the same time")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--stale-after", type=int, default=600, help="Requeue Running jobs whose worker has not sent a heartbeat for this many seconds")
+        parser.add_argument("--once", action="store_true", help="Exit once no job is ready to run")
+
+    def run(self, job):
+        try:
+            return run_job(job)
+        finally:
+            connection.close()
+
+    def handle(self, *args, **options):
+        workers = max(options["workers"], 1)
+        worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        processed = failed = 0
+        running = {} # future: job id
+        last_sweep = last_beat = 0
+
+        self.stdout.write(f"Worker {worker_id} started with {workers} thread(s)")
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job") as executor:
+            try:
+                while True:
+                    if time.monotonic() - last_sweep > 60:
+                        requeued = requeue_stale_jobs(options["stale_after"])
+                        if requeued:
+                            self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale job(s)"))
+                        last_sweep = time.monotonic()
+
+                    if running and time.monotonic() - last_beat > HEARTBEAT_SECONDS:
+                        beat_jobs(worker_id, running.values())
+                        last_beat = time.monotonic()
+
+                    for future in [future for future in running if future.done()]:
+                        del running[future]
+                        processed += 1
+                        failed += 0 if future.result() else 1
+
+                    jobs = claim_jobs(worker_id, workers - len(running)) if len(running) < workers else []
+                    for job in jobs:
+                        running[executor.submit(self.run, job)] = job.id
+
+                    if options["once"] and not jobs and not running:
+                        break
+                    if not jobs:
+                        time.sleep(options["poll_interval"] if not running else 0.05)
+
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping, waiting for running jobs to finish...")
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} job(s), {failed} failed or retried"))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0020_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Forecast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('version', models.CharField(max_length=255)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('compute_time', models.FloatField(default=0, verbose_name='Compute Time (s)')),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
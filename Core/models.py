@@ -360,3 +360,52 @@ class Sponsor(models.Model):
         verbose_name = "Sponsor"
         verbose_name_plural = "Sponsors"
         ordering = ("name", "state")
+
+# ==========================================================================================#
+# ========================              BACKGROUND JOBS            =========================#
+JOB_STATUS_CHOICES = [
+    ("Queued", "Queued"),
+    ("Running", "Running"),
+    ("Done", "Done"),
+    ("Failed", "Failed"),
+]
+
+class Job(models.Model):
+    name = models.CharField(verbose_name='Task', max_length=255) # dotted path of the task function
+    payload = models.JSONField(default=dict, blank=True)
+    key = models.CharField(verbose_name='Idempotency Key', max_length=255, unique=True, blank=True, null=True)
+    status = models.CharField(choices=JOB_STATUS_CHOICES, max_length=20, default="Queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=utils.timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True) # last sign of life from the worker running it
+    finished_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    progress = models.JSONField(default=dict, blank=True) # last value reported by the task
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+    class Meta:
+        verbose_name = "Background Job"
+        verbose_name_plural = "Background Jobs"
+        indexes = [
+            models.Index(fields=["status", "run_at"]),
+        ]
+
+class Forecast(models.Model):
+    """
+    Latest result of an expensive report or model fit, tagged with the version of the data it
+    was computed from so readers can tell when it is stale.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.CharField(max_length=255)
+    data = models.JSONField(default=dict, blank=True)
+    compute_time = models.FloatField(verbose_name='Compute Time (s)', default=0)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.computed_at})"
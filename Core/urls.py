@@ -46,5 +46,7 @@ urlpatterns = [
     path("api/change-password/", change_password, name="change-password"),
     path("api/check-token/", check_token, name="check-token"),
     path("api/download-template/", download_school_template, name="download_template"),
+    path("api/jobs/stats/", job_queue_stats, name="job-queue-stats"),
+    path("api/jobs/<int:job_id>/", job_status, name="job-status"),
     
 ]
\ No newline at end of file
@@ -16,9 +16,10 @@ from .models import *
 from .application import *
 from .serializers import *
 from .filters import *
+from .jobs import queue_stats, get_job_status
 
 from Students.application import deactivate_student
-from Finance.models import FeeParticular
+from Finance.fee_structures import get_structures
 from Staff.models import Staff
 
 from Students.models import Student, Application
@@ -588,7 +589,7 @@ def promote_system(request):
         if not next_term:
             # Create next term if it doesn't exist
             start, end = map(int, current_year.name.split("/"))
-            next_term = Term.objects.get_or_create(
+            next_term, _ = Term.objects.get_or_create(
                 name=next_intake,
                 year=current_year,
                 defaults={
@@ -634,9 +635,11 @@ def promote_system(request):
     # Check if next_year and next_intake have fees set
     fee_responses = []
     courses_with_fees_optimum = 0
-    for courseduration in CourseDuration.objects.all():
-        fee_structure = FeeParticular.objects.filter(course=courseduration.course, term__year=next_year, term__name=next_intake).first()
-        if not fee_structure:
+    course_durations = CourseDuration.objects.select_related("course", "module")
+    fee_structures = get_structures([(item.course_id, item.module_id, next_term.id) for item in course_durations])
+    for courseduration in course_durations:
+        fee_structure = fee_structures[(courseduration.course_id, courseduration.module_id, next_term.id)]
+        if not fee_structure.items:
             fee_responses.append(f"{courseduration.course.abbr} {courseduration.module.abbr} has no fee structure for {next_year.name} - {next_intake.name}")
         else:
             courses_with_fees_optimum += 1
@@ -862,3 +865,16 @@ def fetch_user_profile(request):
         user_data.update({"user_type": "unknown"})
 
     return Response(user_data)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def job_queue_stats(request):
+    return Response(queue_stats())
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def job_status(request, job_id):
+    job = Job.objects.filter(id=job_id).first()
+    if not job:
+        return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(get_job_status(job))
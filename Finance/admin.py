@@ -32,6 +32,18 @@ class FeeParticularAdmin(admin.ModelAdmin):
 class FeeStatusAdmin(admin.ModelAdmin):
     list_display = ("student", "term", "module", "status", "arrears", )
 
+@admin.register(InvoiceSequence)
+class InvoiceSequenceAdmin(admin.ModelAdmin):
+    list_display = ("year", "last_value", )
+
+@admin.register(StudentFeeBalance)
+class StudentFeeBalanceAdmin(admin.ModelAdmin):
+    list_display = ("student", "term", "invoiced", "paid", "arrears", "status", "is_latest", )
+
+@admin.register(FeeAging)
+class FeeAgingAdmin(admin.ModelAdmin):
+    list_display = ("student", "outstanding", "current", "days_31_60", "days_61_90", "days_over_90", "oldest_due", "aged_on", )
+
 @admin.register(Receipt)
 class ReceiptAdmin(admin.ModelAdmin):
     list_display = ("trans_id", "student", "wallet", "term", "amount", )
@@ -46,7 +58,7 @@ class PaymentAttemptAdmin(admin.ModelAdmin):
 
 @admin.register(PaymentPlan)
 class PaymentPlanAdmin(admin.ModelAdmin):
-    list_display = ("sponsor", "plan", "datelastreminded", )
+    list_display = ("sponsor", "plan", "datelastreminded", "datenextreminder", )
 
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
@@ -0,0 +1,278 @@
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction #type: ignore
+from django.db.models import Count, Min, Sum #type: ignore
+from django.utils import timezone #type: ignore
+
+from Core.jobs import enqueue
+
+from .models import FeeAging, FeeStatus, Invoice, StudentFeeBalance
+from .balances import get_latest_arrears
+
+BATCH_SIZE = 500
+
+# (column, oldest age in days the bucket holds); the last bucket is open ended
+AGING_BUCKETS = [
+    ("current", 30),
+    ("days_31_60", 60),
+    ("days_61_90", 90),
+    ("days_over_90", None),
+]
+BUCKET_FIELDS = [name for name, _ in AGING_BUCKETS]
+
+AGING_ORDERING = ["outstanding", "oldest_due", "student__regno"] + BUCKET_FIELDS
+
+# ============================== AGING ============================== #
+def get_bucket(days: int) -> str:
+    for name, limit in AGING_BUCKETS:
+        if limit is None or days <= limit:
+            return name
+
+def get_open_items(outstanding: Decimal, invoices: List[Tuple[datetime, Decimal]], opened_at=None) -> List[Tuple[datetime, Decimal]]:
+    """
+    Splits what a student owes into the invoice portions still unpaid, oldest first.
+
+    Parameters:
+        invoices: [(created_at, amount)], newest first
+        opened_at: date for debt the invoices do not account for (e.g. a balance brought
+            forward) when the student has no invoices; it otherwise dates from the oldest invoice
+
+    Returns:
+        [(date, amount)]
+    """
+    items = []
+    remaining = outstanding
+    for created_at, amount in invoices:
+        if remaining <= 0:
+            break
+        portion = min(remaining, amount or Decimal("0.00"))
+        if portion > 0:
+            items.append((created_at, portion))
+            remaining -= portion
+
+    if remaining > 0:
+        dated = invoices[-1][0] if invoices else opened_at or timezone.now()
+        if items and items[-1][0] == dated:
+            items[-1] = (dated, items[-1][1] + remaining)
+        else:
+            items.append((dated, remaining))
+
+    items.reverse()
+    return items
+
+def age_items(items, today) -> Dict[str, Decimal]:
+    """
+    Sums open items into the aging buckets as of `today`. Items are (date, amount) pairs,
+    as datetimes or the ISO strings stored in FeeAging.open_items.
+    """
+    buckets = {name: Decimal("0.00") for name in BUCKET_FIELDS}
+    for dated, amount in items:
+        if isinstance(dated, str):
+            dated = datetime.fromisoformat(dated)
+        day = timezone.localdate(dated) if timezone.is_aware(dated) else dated.date()
+        buckets[get_bucket(max((today - day).days, 0))] += Decimal(str(amount))
+    return buckets
+
+def set_aging(aging: FeeAging, outstanding: Decimal, items, today) -> None:
+    aging.outstanding = outstanding
+    aging.open_items = [[dated.isoformat(), str(amount)] for dated, amount in items]
+    aging.oldest_due = items[0][0] if items else None
+    aging.aged_on = today
+    for name, amount in age_items(items, today).items():
+        setattr(aging, name, amount)
+
+# ============================== MAINTAIN ============================== #
+def update_grouped(rows: List[FeeAging], fields: List[str], batch_size=BATCH_SIZE) -> None:
+    """
+    Writes `fields` of existing rows with one UPDATE per distinct set of values. Students
+    invoiced together share their aging, so this is far cheaper than a per-row CASE update.
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        values = tuple(json.dumps(getattr(row, field), default=str) for field in fields)
+        groups[values].append(row)
+
+    for members in groups.values():
+        values = {field: getattr(members[0], field) for field in fields}
+        ids = [row.id for row in members]
+        for start in range(0, len(ids), batch_size):
+            FeeAging.objects.filter(id__in=ids[start:start + batch_size]).update(**values, updated_at=timezone.now())
+
+def refresh_aging(student_ids: Iterable[int], batch_size=BATCH_SIZE, create=True) -> int:
+    """
+    Recomputes the aging of the given students from their latest arrears and invoices, a
+    batch at a time. With `create` False (deletes) students without a row are left out.
+    Returns the number of rows written.
+    """
+    student_ids = list(dict.fromkeys(student_ids))
+    today = timezone.localdate()
+    written = 0
+
+    for start in range(0, len(student_ids), batch_size):
+        chunk = student_ids[start:start + batch_size]
+        arrears = get_latest_arrears(chunk)
+
+        invoices = defaultdict(list)
+        rows = (
+            Invoice.objects.filter(student_id__in=chunk)
+            .order_by("student_id", "-created_at", "-id")
+            .values_list("student_id", "created_at", "amount")
+        )
+        for student_id, created_at, amount in rows:
+            invoices[student_id].append((created_at, amount))
+
+        # Only students owing more than their invoices account for need a start date
+        outstanding = {student_id: max(-(arrears.get(student_id) or Decimal("0.00")), Decimal("0.00")) for student_id in chunk}
+        uninvoiced = [student_id for student_id in chunk if outstanding[student_id] > 0 and not invoices[student_id]]
+        opened = dict(
+            FeeStatus.objects.filter(student_id__in=uninvoiced).values("student_id")
+            .annotate(first=Min("created_at")).order_by().values_list("student_id", "first")
+        ) if uninvoiced else {}
+
+        existing = {aging.student_id: aging for aging in FeeAging.objects.filter(student_id__in=chunk)}
+        created, updated = [], []
+        for student_id in chunk:
+            aging = existing.get(student_id)
+            if aging:
+                updated.append(aging)
+            elif not create:
+                continue
+            else:
+                aging = FeeAging(student_id=student_id)
+                created.append(aging)
+
+            items = get_open_items(outstanding[student_id], invoices[student_id], opened.get(student_id))
+            set_aging(aging, outstanding[student_id], items, today)
+
+        with transaction.atomic():
+            FeeAging.objects.bulk_create(created, batch_size=batch_size, ignore_conflicts=True)
+            update_grouped(updated, ["outstanding", "oldest_due", "open_items", "aged_on"] + BUCKET_FIELDS, batch_size=batch_size)
+        written += len(created) + len(updated)
+
+    return written
+
+def reage_aging(today=None, batch_size=BATCH_SIZE) -> int:
+    """
+    Job: moves outstanding amounts into older buckets as days pass, from the stored open
+    items; the ledger is not read. Returns the number of rows re-aged.
+    """
+    today = today or timezone.localdate()
+    stale = (
+        FeeAging.objects.filter(outstanding__gt=0, aged_on__lt=today)
+        .only("id", "open_items", "aged_on", *BUCKET_FIELDS)
+        .order_by("id")
+    )
+
+    # Walk by id rather than holding a cursor open over rows being updated
+    count, last_id = 0, 0
+    while True:
+        batch = list(stale.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return count
+
+        for aging in batch:
+            for name, amount in age_items(aging.open_items, today).items():
+                setattr(aging, name, amount)
+            aging.aged_on = today
+        update_grouped(batch, ["aged_on"] + BUCKET_FIELDS, batch_size=batch_size)
+
+        count += len(batch)
+        last_id = batch[-1].id
+
+def schedule_reaging() -> None:
+    """
+    Queues today's re-aging once; later calls on the same day find the job by its key.
+    """
+    today = timezone.localdate()
+    enqueue(reage_aging, key=f"fee-aging:{today.isoformat()}", max_attempts=3)
+
+def rebuild_aging(batch_size=BATCH_SIZE) -> int:
+    """
+    Rebuilds the aging of every student with fee history. Returns the number of rows written.
+    """
+    student_ids = set(StudentFeeBalance.objects.values_list("student_id", flat=True).distinct())
+    student_ids.update(FeeStatus.objects.values_list("student_id", flat=True).distinct())
+
+    FeeAging.objects.exclude(student_id__in=student_ids).delete()
+    return refresh_aging(sorted(student_ids), batch_size=batch_size)
+
+# ============================== QUERY ============================== #
+def get_aging_queryset(branch_id=None, class_id=None, course_id=None, min_amount=None, min_days=None, bucket=None, ordering=None):
+    """
+    Students with outstanding fees, filtered and sorted for the aging report.
+
+    Parameters:
+        min_amount: owing more than this; compared with `bucket` when given, else the total
+        min_days: part of the debt has been owed for more than this many days
+        bucket: one of BUCKET_FIELDS
+        ordering: one of AGING_ORDERING, "-" prefixed for descending (default "-outstanding")
+
+    Raises:
+        ValueError for an unknown bucket or ordering.
+    """
+    if bucket and bucket not in BUCKET_FIELDS:
+        raise ValueError(f"Unknown bucket {bucket}")
+    ordering = ordering or "-outstanding"
+    if ordering.lstrip("-") not in AGING_ORDERING:
+        raise ValueError(f"Cannot order by {ordering}")
+
+    queryset = FeeAging.objects.filter(outstanding__gt=0).select_related(
+        "student", "student__course", "student__branch", "student__students__Class"
+    )
+    if branch_id:
+        queryset = queryset.filter(student__branch_id=int(branch_id))
+    if course_id:
+        queryset = queryset.filter(student__course_id=int(course_id))
+    if class_id:
+        queryset = queryset.filter(student__students__Class_id=int(class_id))
+    if min_amount:
+        queryset = queryset.filter(**{f"{bucket or 'outstanding'}__gt": Decimal(str(min_amount))})
+    elif bucket:
+        queryset = queryset.filter(**{f"{bucket}__gt": 0})
+    if min_days:
+        queryset = queryset.filter(oldest_due__lt=timezone.now() - timedelta(days=int(min_days)))
+
+    return queryset.order_by(ordering, "id")
+
+def get_aging_summary(queryset) -> dict:
+    """
+    Student count and bucket totals of an aging queryset.
+    """
+    totals = queryset.order_by().aggregate(
+        students=Count("id"), **{f"total_{name}": Sum(name) for name in ["outstanding"] + BUCKET_FIELDS}
+    )
+    return {
+        key.replace("total_", "", 1): value if value is not None else Decimal("0.00")
+        for key, value in totals.items()
+    }
+
+def get_sponsor_arrears(sponsor_ids=None) -> Dict[int, dict]:
+    """
+    Outstanding fees of each sponsor's students, in one grouped query, for payment plan
+    reminders.
+
+    Returns:
+        {sponsor_id: {"students", "outstanding", "oldest_due", "current", ..., "days_over_90"}}
+    """
+    queryset = FeeAging.objects.filter(outstanding__gt=0)
+    if sponsor_ids is not None:
+        queryset = queryset.filter(student__sponsor_id__in=sponsor_ids)
+
+    rows = queryset.values("student__sponsor_id").annotate(
+        students=Count("id"),
+        first_due=Min("oldest_due"),
+        **{f"total_{name}": Sum(name) for name in ["outstanding"] + BUCKET_FIELDS}
+    ).order_by()
+
+    return {
+        row["student__sponsor_id"]: {
+            "students": row["students"],
+            "oldest_due": row["first_due"],
+            **{name: row[f"total_{name}"] for name in ["outstanding"] + BUCKET_FIELDS},
+        }
+        for row in rows
+    }
@@ -0,0 +1,267 @@
+from decimal import Decimal, ROUND_DOWN
+from typing import Any, Dict, Iterable, List, Tuple
+
+CENT = Decimal("0.01")
+ZERO = Decimal("0.00")
+
+Distribution = Dict[Any, Tuple[Decimal, int]]
+
+class VoteheadShare:
+    """
+    Allocation state of one sub-100% priority votehead while a partial payment is spread.
+    """
+    __slots__ = ("account", "balance_due", "ratio", "cap", "allocated", "remaining")
+
+    def __init__(self, account, balance_due: Decimal, priority: int, remaining_total_balance: Decimal):
+        self.account = account
+        self.balance_due = balance_due
+        # Same expressions as the original loop so every figure rounds identically
+        self.ratio = balance_due / remaining_total_balance
+        self.cap = ((Decimal(priority) / Decimal("100.00")) * balance_due).quantize(CENT, rounding=ROUND_DOWN)
+        self.allocated = ZERO
+        self.remaining = balance_due
+
+    def add(self, allocation: Decimal) -> None:
+        self.allocated += allocation
+        self.remaining = self.balance_due - self.allocated
+
+    def ratio_based(self, amount: Decimal) -> Decimal:
+        return (self.ratio * amount).quantize(CENT, rounding=ROUND_DOWN)
+
+def sort_distribution(distribution: Distribution) -> List[Tuple[Any, Decimal, int]]:
+    """
+    Returns [(account, balance_due, priority)] ordered by ascending priority, keeping
+    insertion order between equal priorities.
+    """
+    ordered = sorted(distribution.items(), key=lambda item: item[1][1])
+    return [(account, balance_due, priority) for account, (balance_due, priority) in ordered]
+
+def run_pass(amount: Decimal, shares: List[VoteheadShare]) -> Tuple[Decimal, bool]:
+    """
+    One round-robin pass over the shares, exactly as the original while loop did it.
+    Returns the amount left and whether anything was allocated.
+    """
+    distributed = False
+
+    for share in shares:
+        remaining = share.remaining
+        if remaining <= ZERO:
+            continue
+
+        allocation = min(share.ratio_based(amount), share.cap, remaining, amount)
+        if allocation <= ZERO:
+            continue
+
+        share.add(allocation)
+        amount -= allocation
+        distributed = True
+
+        if amount <= ZERO:
+            break
+
+    return amount, distributed
+
+def is_capped_pass(amount: Decimal, shares: List[VoteheadShare], step: Decimal, passes: int) -> bool:
+    """
+    True when pass number `passes` (1-based) would hand every share exactly its cap,
+    i.e. the cap is the smallest of the ratio, remaining balance and amount left.
+    """
+    amount -= (passes - 1) * step
+    for share in shares:
+        if share.remaining - (passes - 1) * share.cap < share.cap:
+            return False
+        if amount < share.cap or share.ratio_based(amount) < share.cap:
+            return False
+        amount -= share.cap
+    return True
+
+def count_capped_passes(amount: Decimal, shares: List[VoteheadShare]) -> int:
+    """
+    Number of consecutive passes, starting now, in which every share receives its cap.
+
+    Each condition only gets harder as passes go by, so the count is found by binary search
+    instead of walking the passes one at a time.
+    """
+    step = sum((share.cap for share in shares), ZERO)
+    if not is_capped_pass(amount, shares, step, 1):
+        return 0
+
+    low, high = 1, min(int(share.remaining // share.cap) for share in shares)
+
+    while low < high:
+        middle = (low + high + 1) // 2
+        if is_capped_pass(amount, shares, step, middle):
+            low = middle
+        else:
+            high = middle - 1
+
+    return low
+
+def spread_payment(amount: Decimal, shares: List[VoteheadShare]) -> None:
+    """
+    Spreads `amount` over sub-100% priority voteheads. Runs of passes where each votehead is
+    limited by its priority cap are applied in one step; the remaining passes, where the
+    ratio share or the balance is the limit, are run one by one.
+    """
+    while amount > ZERO:
+        active = [share for share in shares if share.remaining > ZERO and share.cap > ZERO]
+        if not active:
+            break
+
+        passes = count_capped_passes(amount, active)
+        if passes:
+            for share in active:
+                share.add(passes * share.cap)
+            amount -= passes * sum((share.cap for share in active), ZERO)
+            continue
+
+        amount, distributed = run_pass(amount, shares)
+        if not distributed:
+            break
+
+def allocate(amount: Decimal, distribution: Distribution) -> Dict[Any, Decimal]:
+    """
+    Allocate payment based on account priorities and remaining balances.
+
+    Parameters:
+        amount: total amount available to allocate (Decimal)
+        distribution: {Account: (balance_due, priority_percent)}
+
+    Returns:
+        Dict of {Account: allocated_amount}
+    """
+    ordered = sort_distribution(distribution)
+    particular_balance = {account: ZERO for account, _, _ in ordered}
+
+    # Full payment case
+    total_balance = sum(balance_due for _, balance_due, _ in ordered)
+    if amount >= total_balance:
+        for account, balance_due, _ in ordered:
+            particular_balance[account] = balance_due
+        return particular_balance
+
+    # 100% priority voteheads are settled first, in order
+    remaining_distribution = []
+    for account, balance_due, priority in ordered:
+        if amount <= ZERO:
+            break
+
+        if priority == 100:
+            allocation = min(balance_due, amount)
+            particular_balance[account] = allocation
+            amount -= allocation
+        else:
+            remaining_distribution.append((account, balance_due, priority))
+
+    if amount <= ZERO:
+        return particular_balance
+
+    remaining_total_balance = sum(balance_due for _, balance_due, _ in remaining_distribution)
+    if remaining_total_balance <= 0:
+        return particular_balance
+
+    shares = [
+        VoteheadShare(account, balance_due, priority, remaining_total_balance)
+        for account, balance_due, priority in remaining_distribution
+    ]
+    spread_payment(amount, shares)
+
+    for share in shares:
+        particular_balance[share.account] = share.allocated
+
+    return particular_balance
+
+def allocate_batch(payments: Iterable[Tuple[Decimal, Distribution]]) -> List[Dict[Any, Decimal]]:
+    """
+    Allocates many (amount, distribution) pairs, e.g. every receipt in a reconciliation run.
+
+    Students on the same fee structure paying the same amount produce the same allocation,
+    so each distinct (amount, balances, priorities) shape is only computed once.
+    """
+    results = []
+    computed: Dict[tuple, List[Decimal]] = {}
+
+    for amount, distribution in payments:
+        ordered = sort_distribution(distribution)
+        key = (amount, tuple((balance_due, priority) for _, balance_due, priority in ordered))
+
+        if key not in computed:
+            positional = {index: (balance_due, priority) for index, (_, balance_due, priority) in enumerate(ordered)}
+            allocated = allocate(amount, positional)
+            computed[key] = [allocated[index] for index in range(len(ordered))]
+
+        results.append({
+            account: value
+            for (account, _, _), value in zip(ordered, computed[key])
+        })
+
+    return results
+
+def allocate_iterative(amount: Decimal, distribution: Distribution) -> Dict[Any, Decimal]:
+    """
+    The original pass-by-pass allocation loop. Kept as the reference that `allocate` must
+    match; used by the `benchmark_fee_allocation` command.
+    """
+    sorted_distribution = dict(
+        sorted(distribution.items(), key=lambda item: item[1][1], reverse=False)
+    )
+
+    total_balance = sum(balance for balance, _ in sorted_distribution.values())
+    particular_balance = {account: Decimal("0.00") for account in sorted_distribution}
+
+    if amount >= total_balance:
+        for account, (balance_due, _) in sorted_distribution.items():
+            particular_balance[account] = balance_due
+        return particular_balance
+
+    remaining_distribution = {}
+    for account, (balance_due, priority) in sorted_distribution.items():
+        if amount <= Decimal("0.00"):
+            break
+
+        if priority == 100:
+            if amount >= balance_due:
+                particular_balance[account] = balance_due
+                amount -= balance_due
+            else:
+                particular_balance[account] = amount
+                amount = Decimal("0.00")
+        else:
+            remaining_distribution[account] = (balance_due, priority)
+
+    if amount <= Decimal("0.00"):
+        return particular_balance
+
+    remaining_total_balance = sum(balance for balance, _ in remaining_distribution.values())
+
+    if remaining_total_balance <= 0:
+        return particular_balance
+
+    while amount > Decimal("0.00"):
+        distributed = False
+
+        for account, (balance_due, priority) in remaining_distribution.items():
+            already_allocated = particular_balance[account]
+            remaining = balance_due - already_allocated
+            if remaining <= Decimal("0.00"):
+                continue
+
+            ratio_based = ((balance_due / remaining_total_balance) * amount).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+            priority_based = ((Decimal(priority) / Decimal("100.00")) * balance_due).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
+
+            allocation = min(ratio_based, priority_based, remaining, amount)
+
+            if allocation <= Decimal("0.00"):
+                continue
+
+            particular_balance[account] += allocation
+            amount -= allocation
+            distributed = True
+
+            if amount <= Decimal("0.00"):
+                break
+
+        if not distributed:
+            break
+
+    return particular_balance
@@ -1,7 +1,8 @@
 import requests, json, base64
-from requests.auth import HTTPBasicAuth
 from datetime import datetime
+from decimal import Decimal
 from django.utils import timezone #type: ignore
+from django.db import transaction, IntegrityError #type: ignore
 from django.db.models import Sum, Avg, F  #type: ignore
 
 from Students.models import Allocate_Student  #type: ignore
@@ -9,6 +10,9 @@ from Students.models import Allocate_Student  #type: ignore
 from .configs import api_settings
 from .models import *
 from .fee_manager import FeeManager
+from .fee_structures import get_structure
+from .mpesa_tokens import token_cache
+from .gateway import daraja
 
 from Core.models import Term, Institution, CourseDuration
 
@@ -18,24 +22,53 @@ class IllegalPhoneNumberException(Exception):
 	"""
 	pass
 
-def generate_invoice_number(term):
+def get_invoice_year(term):
+    return term.year.name.split("/")[0]  # e.g., '2023-2024' → '2023'
+
+def format_invoice_number(year, value):
+    # Format count as 3-digit number (001, 002, etc.)
+    return f"INV\\{year}\\{str(value).zfill(3)}"
+
+def seed_invoice_sequence(year):
     """
-    Generates a unique invoice number using:
-    [Year][Term]-[CourseCode]-[RegNo]-[SequentialCount]
+    Creates the counter row for the year, starting after the highest number already
+    issued so that existing invoices are never re-numbered.
     """
+    prefix = f"INV\\{year}\\"
+    issued = Invoice.objects.filter(inv_no__startswith=prefix).values_list("inv_no", flat=True)
+    last_value = max((int(inv_no[len(prefix):]) for inv_no in issued if inv_no[len(prefix):].isdigit()), default=0)
 
-    year = term.year.name.split("/")[0]  # e.g., '2023-2024' → '2023'
+    try:
+        with transaction.atomic():
+            InvoiceSequence.objects.create(year=year, last_value=last_value)
+    except IntegrityError:
+        pass  # Another worker seeded the row first
 
-    # Count existing invoices for this student in the term (useful if allowing multiple invoices)
-    existing_count = Invoice.objects.all().count() + 1
+def reserve_invoice_numbers(term, count=1):
+    """
+    Reserves a block of `count` consecutive invoice numbers for the term's year and
+    returns them in order. The counter is bumped with a single UPDATE, which holds the
+    row lock until the transaction commits, so concurrent callers never overlap.
+    """
+    year = get_invoice_year(term)
 
-    # Format count as 3-digit number (001, 002, etc.)
-    count_str = str(existing_count).zfill(3)
+    with transaction.atomic():
+        sequence = InvoiceSequence.objects.filter(year=year)
+        if not sequence.update(last_value=F("last_value") + count):
+            seed_invoice_sequence(year)
+            sequence.update(last_value=F("last_value") + count)
 
-    # Final invoice number
-    invoice_number = f"INV\\{year}\\{count_str}"
+        last_value = sequence.values_list("last_value", flat=True).get()
 
-    return invoice_number
+    first_value = last_value - count + 1
+    return [format_invoice_number(year, value) for value in range(first_value, last_value + 1)]
+
+def generate_invoice_number(term):
+    """
+    Generates a unique invoice number using:
+    INV\\[Year]\\[SequentialCount]
+    """
+    return reserve_invoice_numbers(term, 1)[0]
 
 def format_phone_number(phone_number):
 	"""
@@ -56,47 +89,18 @@ def generate_pass_key(shortcode):
     encoded = base64.b64encode(s.encode()).decode()
     return encoded, time_stamp
 
-def get_mpesa_access_token(wallet=None):
+def get_mpesa_access_token():
     """
-    Fetch OAuth access token from Safaricom M-Pesa API.
-    If you support multiple wallets/paybills, map wallet -> consumer_key/secret.
-    Otherwise, just use the default global app credentials.
+    Returns an OAuth access token for the configured M-Pesa app credentials, served from the
+    process-wide token cache. Returns None if Safaricom could not be reached.
     """
-    token_url = f"{api_settings.SAFARICOM_API}/oauth/v1/generate?grant_type=client_credentials"
-
-    # Decide which keys to use
-    consumer_key = api_settings.MPESA_CONSUMER_KEY
-    consumer_secret = api_settings.MPESA_CONSUMER_SECRET
-
-    # Check if a valid token exists
-    access_token = AccessToken.objects.filter(account_number=wallet).first()
-    if access_token:
-        delta = timezone.now() - access_token.created_at
-        minutes = (delta.total_seconds() // 60)
-        if minutes < 50:
-            return access_token.token  # still valid
-        else:
-            access_token.delete()  # expired
-
-    # Request a new token
-    try:
-        response = requests.get(
-            token_url,
-            auth=HTTPBasicAuth(consumer_key, consumer_secret)
-        )
-        response.raise_for_status()
-        token = response.json().get("access_token")
-
-        if token:
-            AccessToken.objects.create(account_number=wallet, token=token, created_at=timezone.now())
-        return token
-    except requests.RequestException as e:
-        print("Error fetching M-Pesa access token:", str(e))
-        return None
+    return token_cache.get()
 
 def initiate_stk_push(phone_number: str, amount: int, paybill: str, account_reference: str, transaction_desc: str):
-    access_token = get_mpesa_access_token(format_phone_number(phone_number))
-    
+    access_token = get_mpesa_access_token()
+    if not access_token:
+        raise requests.RequestException("Failed to acquire M-Pesa access token.")
+
     password, timestamp = generate_pass_key(paybill or api_settings.MPESA_SHORTCODE)
 
     headers = {
@@ -118,8 +122,12 @@ def initiate_stk_push(phone_number: str, amount: int, paybill: str, account_refe
         "TransactionDesc": transaction_desc,
     }
 
-    url = f"{api_settings.SAFARICOM_API}/mpesa/stkpush/v1/processrequest"
-    response = requests.post(url, headers=headers, json=payload)
+    response = daraja.post("/mpesa/stkpush/v1/processrequest", endpoint="stkpush", headers=headers, json=payload)
+    if response.status_code == 401:
+        # Token revoked upstream before it expired; fetch a new one and try once more
+        token_cache.invalidate()
+        headers["Authorization"] = f"Bearer {get_mpesa_access_token()}"
+        response = daraja.post("/mpesa/stkpush/v1/processrequest", endpoint="stkpush", headers=headers, json=payload)
 
     return response.json()
 
@@ -133,7 +141,7 @@ def query_stk_status(checkout_request_id):
         }
 
     # Get access token
-    access_token = get_mpesa_access_token(attempt.account_number)
+    access_token = get_mpesa_access_token()
     if not access_token:
         return {
             "success": False,
@@ -158,8 +166,7 @@ def query_stk_status(checkout_request_id):
     }
 
     try:
-        url = f"{api_settings.SAFARICOM_API}/mpesa/stkpushquery/v1/query"
-        response = requests.post(url, headers=headers, json=payload)
+        response = daraja.post("/mpesa/stkpushquery/v1/query", endpoint="stkpushquery", headers=headers, json=payload)
         res_json = response.json()
         
         return res_json
@@ -204,66 +211,6 @@ def create_receipt(attempt_id):
         print(f"Error creating receipt: {str(e)}")
         return None
 
-def create_invoice(student_ids, voteheads, target):
-    try:
-        inst = Institution.objects.first()
-        term = Term.objects.filter(name=inst.current_intake, year=inst.current_year).first()
-
-        students = Allocate_Student.objects.filter(id__in=student_ids)
-        if not students.exists():
-            return {"error": True,
-                    "errMessage": "No valid students found."}
-
-        for student in students:
-            # Create Invoice Items
-            part_ids = []
-            part_name = ''
-            for registry in voteheads:
-                votehead = Account.objects.filter(id = registry["votehead"]).first()
-                amount = registry["amount"]
-                # Create a Fee Particular and add the fee particular id
-                if target == "Course":
-                    part_name = str(student.studentno.course.abbr) + "_" + str(votehead.votehead) + "_" + str(term.name)
-                elif target == "Class":
-                    part_name = str(student.Class.name) + "_" + str(votehead.votehead) + "_" + str(term.name)
-                else:
-                    part_name = str(student.studentno.regno) + "_" + str(votehead.votehead) + "_" + str(term.name)
-                
-                fee_narration = FeeParticular.objects.create(
-                    name = part_name, 
-                    course = student.Class.course, 
-                    module = student.module, 
-                    term = term, 
-                    account = votehead, 
-                    amount = amount,
-                    target = target
-                )
-                part_ids.append(fee_narration)
-                
-            total_amount = sum(int(item.amount) for item in part_ids)
-
-            # Create Invoice
-            invoice = Invoice.objects.create(
-                inv_no = generate_invoice_number(term), 
-                student=student.studentno, 
-                term=term, 
-                amount=total_amount,
-                state="Pending",
-                is_cleared=False,
-                paid_amount=0.00,
-            )
-            invoice.narration.set(part_ids)
-            invoice.save()
-
-        return {
-            "success": True
-        }
-    except Exception as e:
-        print(f"[ERROR]: {e}")
-        return {
-            "error":True,
-            "errMessage": e}
-
 def create_feestructure(course_id, voteheads):
     try:
         inst = Institution.objects.first()
@@ -326,19 +273,15 @@ def create_newterm_invoice(student_regno, term_id):
             return existing_invoice
 
         # Get applicable fee particulars for this student's course, module, and term
-        fee_narrations = FeeParticular.objects.filter(
-            course=student.course,
-            module=module,
-            term=target_term,
-            target = "Course"
-        )
+        fee_structure = get_structure(student.course_id, module.id, target_term.id)
+        fee_narrations = fee_structure.course_items
 
-        if not fee_narrations.exists():
+        if not fee_narrations:
             print("No fee particulars found for this student and term.")
             return "No fee structure for this student."
         
         # Calculate total amount
-        total_amount = sum(item.amount for item in fee_narrations)
+        total_amount = fee_structure.course_total
 
         # Create the invoice without narration first (since it's ManyToMany)
         invoice = Invoice.objects.create(
@@ -352,7 +295,7 @@ def create_newterm_invoice(student_regno, term_id):
         )
         
         # Now attach the many-to-many narration
-        invoice.narration.set(fee_narrations)
+        invoice.narration.set([item.id for item in fee_narrations])
 
         return invoice
     
@@ -412,74 +355,87 @@ def create_new_invoice(student_regno, term_id, fee_narration_ids):
         return f"Error: {str(e)}"
     
 def process_fee_allocation(reciept_id):
+    """
+    Allocates a receipt to the student's pending invoices. Runs from the job queue: the work is
+    atomic and errors are re-raised so a failed allocation is retried, and a receipt whose fee
+    status has already been written is not allocated twice.
+    """
     try:
         # Get the amount
         receipt = Receipt.objects.filter(id = reciept_id).first()
         if not receipt:
             return {"success": False, "message": "Transaction not found."}
-        
-        amount_paid = receipt.amount
-        amount_arrears = amount_paid
-
-        # Default manager - Reciept's Student and Reciept's Term
-        manager = FeeManager(receipt.student.regno, receipt.term.pk)
-
-        # Check Pending Invoices 
-        pending_invoices = Invoice.objects.filter(student=receipt.student, state="Pending").order_by("created_at")
-        if pending_invoices:
-            # Pay Pending Invoices
-            for invoice in pending_invoices:
-                invoice_due = invoice.get_balance_due()
-                # If the amount is able to settle the invoice the proceed
-                if amount_arrears <= 0:
-                    break
-
-                allocation = min(invoice_due, amount_arrears)
- 
-                # Link receipt to invoice
-                ReceiptAllocation.objects.create(
-                    receipt = receipt,
-                    invoice = invoice,
-                    amount = allocation
-                )
-                
-                # Process the pending for the invoice
-                manager = FeeManager(invoice.student.regno, invoice.term.pk)
-
-                paid = manager.get_paid_records()
-                structure = manager.get_invoice_items(invoice)
-                priorities = manager.get_priorities()
-
-                particular_balance = manager.get_particular_balance(structure, paid)
-                priority_map = manager.filter_priorities(particular_balance, priorities)
-
-                # Combine unpaid + priority for allocation
-                distribution = {
-                    account: (particular_balance[account], priority_map.get(account, 0))
-                    for account in particular_balance
-                }
-
-                allocated_money = manager.allocate_payment(amount_arrears, distribution)
-
-                manager.apply_payment(receipt, allocated_money)
- 
-                invoice.paid_amount += allocation
-                invoice.save()
 
-                if invoice.paid_amount == invoice.amount:
-                    invoice.state = "Cleared"
-                    invoice.is_cleared = True
+        if FeeStatus.objects.filter(student=receipt.student, purpose=receipt.trans_id).exists():
+            return {"success": True, "message": "Receipt already allocated."}
 
-                invoice.updated_at = datetime.now()
-                invoice.save()
-
-                amount_arrears -= allocation
-        
-        # Update the Fee Status
-        manager.update_status(receipt.trans_id, amount_paid)
+        with transaction.atomic():
+            allocate_receipt(receipt)
 
     except Exception as e:
         print("Error in async fee allocation:", str(e))
+        raise
+
+def allocate_receipt(receipt):
+    amount_paid = receipt.amount
+    amount_arrears = amount_paid
+
+    # Default manager - Reciept's Student and Reciept's Term
+    manager = FeeManager(receipt.student.regno, receipt.term.pk)
+
+    # Check Pending Invoices 
+    pending_invoices = Invoice.objects.filter(student=receipt.student, state="Pending").order_by("created_at")
+    if pending_invoices:
+        # Pay Pending Invoices
+        for invoice in pending_invoices:
+            invoice_due = invoice.get_balance_due()
+            # If the amount is able to settle the invoice the proceed
+            if amount_arrears <= 0:
+                break
+
+            allocation = min(invoice_due, amount_arrears)
+ 
+            # Link receipt to invoice
+            ReceiptAllocation.objects.create(
+                receipt = receipt,
+                invoice = invoice,
+                amount = allocation
+            )
+            
+            # Process the pending for the invoice
+            manager = FeeManager(invoice.student.regno, invoice.term.pk)
+
+            paid = manager.get_paid_records()
+            structure = manager.get_invoice_items(invoice)
+            priorities = manager.get_priorities()
+
+            particular_balance = manager.get_particular_balance(structure, paid)
+            priority_map = manager.filter_priorities(particular_balance, priorities)
+
+            # Combine unpaid + priority for allocation
+            distribution = {
+                account: (particular_balance[account], priority_map.get(account, 0))
+                for account in particular_balance
+            }
+
+            allocated_money = manager.allocate_payment(amount_arrears, distribution)
+
+            manager.apply_payment(receipt, allocated_money)
+ 
+            invoice.paid_amount += allocation
+            invoice.save()
+
+            if invoice.paid_amount == invoice.amount:
+                invoice.state = "Cleared"
+                invoice.is_cleared = True
+
+            invoice.updated_at = datetime.now()
+            invoice.save()
+
+            amount_arrears -= allocation
+    
+    # Update the Fee Status
+    manager.update_status(receipt.trans_id, amount_paid)
 
 def get_historical_payment_rates():
     # Step 1: Get total invoice amount per course
@@ -522,4 +478,4 @@ def get_course_fee(course):
     # Step 2: Sum up the averages
     total_fee = sum(item['avg_amount'] for item in averages)
 
-    return round(total_fee, 2)
\ No newline at end of file
+    return round(total_fee, 2)
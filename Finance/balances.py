@@ -0,0 +1,221 @@
+from decimal import Decimal
+
+from django.db import transaction #type: ignore
+from django.db.models import Sum #type: ignore
+
+from .models import Invoice, Receipt, FeeStatus, StudentFeeBalance
+
+def get_balance_row(student_id, term_id, create=True) -> StudentFeeBalance:
+    """
+    Returns the locked projection row for (student, term), creating it if missing.
+    With `create` False a missing row is not created and None is returned.
+    Must be called inside a transaction.
+    """
+    if not create:
+        return StudentFeeBalance.objects.select_for_update().filter(student_id=student_id, term_id=term_id).first()
+
+    balance, _created = StudentFeeBalance.objects.select_for_update().get_or_create(
+        student_id=student_id,
+        term_id=term_id,
+    )
+    return balance
+
+def refresh_invoiced(student_id, term_id, event=None, create=True) -> None:
+    """
+    Re-sums the student's invoices for the term into the projection. Deletes pass
+    `create` False: they only update a row that exists, as the student or term may be
+    being deleted along with it.
+    """
+    with transaction.atomic():
+        balance = get_balance_row(student_id, term_id, create)
+        if balance is None:
+            return
+        balance.invoiced = Invoice.objects.filter(student_id=student_id, term_id=term_id).aggregate(
+            total=Sum("amount")
+        )["total"] or Decimal("0.00")
+        if event:
+            balance.last_event = event
+        balance.save(update_fields=["invoiced", "last_event", "updated_at"])
+
+def refresh_paid(student_id, term_id, event=None, create=True) -> None:
+    """
+    Re-sums the student's receipts for the term into the projection. See refresh_invoiced
+    for `create`.
+    """
+    with transaction.atomic():
+        balance = get_balance_row(student_id, term_id, create)
+        if balance is None:
+            return
+        balance.paid = Receipt.objects.filter(student_id=student_id, term_id=term_id).aggregate(
+            total=Sum("amount")
+        )["total"] or Decimal("0.00")
+        if event:
+            balance.last_event = event
+        balance.save(update_fields=["paid", "last_event", "updated_at"])
+
+def apply_fee_status(fee_status: FeeStatus) -> None:
+    """
+    Records a newly written FeeStatus as the student's latest position.
+    """
+    with transaction.atomic():
+        balance = get_balance_row(fee_status.student_id, fee_status.term_id)
+        balance.arrears = fee_status.arrears
+        balance.status = fee_status.status
+        balance.last_event = fee_status.purpose
+        balance.is_latest = True
+        balance.save(update_fields=["arrears", "status", "last_event", "is_latest", "updated_at"])
+
+        StudentFeeBalance.objects.filter(student_id=fee_status.student_id, is_latest=True).exclude(
+            pk=balance.pk
+        ).update(is_latest=False)
+
+def apply_invoice_batch(term_id, fee_statuses, batch_size=500) -> None:
+    """
+    Bulk counterpart of the Invoice/FeeStatus signals for rows written with bulk_create.
+    `fee_statuses` are the opening statuses of the batch, in creation order.
+    """
+    latest = {fee_status.student_id: fee_status for fee_status in fee_statuses}
+    student_ids = list(latest)
+
+    with transaction.atomic():
+        for start in range(0, len(student_ids), batch_size):
+            chunk = student_ids[start:start + batch_size]
+
+            invoiced = dict(
+                Invoice.objects.filter(term_id=term_id, student_id__in=chunk)
+                .values("student_id")
+                .annotate(total=Sum("amount"))
+                .order_by()
+                .values_list("student_id", "total")
+            )
+            existing = {
+                balance.student_id: balance
+                for balance in StudentFeeBalance.objects.select_for_update().filter(term_id=term_id, student_id__in=chunk)
+            }
+
+            StudentFeeBalance.objects.filter(student_id__in=chunk, is_latest=True).exclude(
+                term_id=term_id
+            ).update(is_latest=False)
+
+            created, updated = [], []
+            for student_id in chunk:
+                balance = existing.get(student_id)
+                if balance:
+                    updated.append(balance)
+                else:
+                    balance = StudentFeeBalance(student_id=student_id, term_id=term_id)
+                    created.append(balance)
+
+                fee_status = latest[student_id]
+                balance.invoiced = invoiced.get(student_id) or Decimal("0.00")
+                balance.arrears = fee_status.arrears
+                balance.status = fee_status.status
+                balance.last_event = fee_status.purpose
+                balance.is_latest = True
+
+            StudentFeeBalance.objects.bulk_create(created, batch_size=batch_size)
+            StudentFeeBalance.objects.bulk_update(
+                updated, ["invoiced", "arrears", "status", "last_event", "is_latest"], batch_size=batch_size
+            )
+
+def get_latest_arrears(student_ids) -> dict:
+    """
+    Returns {student_id: arrears} for the students' latest positions, falling back to
+    FeeStatus history for students the projection has not seen yet.
+    """
+    arrears = dict(
+        StudentFeeBalance.objects.filter(student_id__in=student_ids, is_latest=True).values_list("student_id", "arrears")
+    )
+
+    missing = [student_id for student_id in student_ids if student_id not in arrears]
+    if missing:
+        history = (
+            FeeStatus.objects.filter(student_id__in=missing)
+            .order_by("student_id", "-created_at")
+            .values_list("student_id", "arrears")
+        )
+        for student_id, value in history:
+            arrears.setdefault(student_id, value)
+
+    return arrears
+
+def refresh_fee_status(student_id) -> None:
+    """
+    Recomputes arrears/status for every term of a student from FeeStatus history.
+    Used when a FeeStatus row is deleted, so it only updates rows that already exist.
+    """
+    with transaction.atomic():
+        StudentFeeBalance.objects.filter(student_id=student_id).update(
+            arrears=Decimal("0.00"), status="Cleared", is_latest=False
+        )
+
+        latest = None
+        for fee_status in FeeStatus.objects.filter(student_id=student_id).order_by("created_at", "id"):
+            balance = get_balance_row(student_id, fee_status.term_id, create=False)
+            if balance is None:
+                continue
+            balance.arrears = fee_status.arrears
+            balance.status = fee_status.status
+            balance.save(update_fields=["arrears", "status", "updated_at"])
+            latest = balance
+
+        if latest:
+            StudentFeeBalance.objects.filter(pk=latest.pk).update(is_latest=True)
+
+def get_latest_balance(student) -> StudentFeeBalance:
+    """
+    Returns the student's most recent projected position, or None if the student has no history.
+    """
+    return StudentFeeBalance.objects.filter(student=student, is_latest=True).first()
+
+def get_pending_dues() -> Decimal:
+    """
+    Sums the arrears of every student whose latest position is Not-Cleared.
+    """
+    return StudentFeeBalance.objects.filter(is_latest=True, status="Not-Cleared").aggregate(
+        total=Sum("arrears")
+    )["total"] or Decimal("0.00")
+
+def rebuild_balances(batch_size=1000) -> int:
+    """
+    Rebuilds the whole projection from Invoice, Receipt and FeeStatus history.
+    Returns the number of rows written.
+    """
+    rows = {}
+
+    def row(student_id, term_id):
+        key = (student_id, term_id)
+        if key not in rows:
+            rows[key] = StudentFeeBalance(student_id=student_id, term_id=term_id)
+        return rows[key]
+
+    invoiced = Invoice.objects.values("student_id", "term_id").annotate(total=Sum("amount")).order_by()
+    for item in invoiced:
+        row(item["student_id"], item["term_id"]).invoiced = item["total"] or Decimal("0.00")
+
+    paid = Receipt.objects.values("student_id", "term_id").annotate(total=Sum("amount")).order_by()
+    for item in paid:
+        row(item["student_id"], item["term_id"]).paid = item["total"] or Decimal("0.00")
+
+    latest = {}
+    history = (
+        FeeStatus.objects
+        .order_by("created_at", "id")
+        .values_list("student_id", "term_id", "arrears", "status", "purpose")
+        .iterator(chunk_size=batch_size)
+    )
+    for student_id, term_id, arrears, status, purpose in history:
+        balance = row(student_id, term_id)
+        balance.arrears = arrears
+        balance.status = status
+        balance.last_event = purpose
+        latest[student_id] = balance
+
+    for balance in latest.values():
+        balance.is_latest = True
+
+    with transaction.atomic():
+        StudentFeeBalance.objects.all().delete()
+        StudentFeeBalance.objects.bulk_create(rows.values(), batch_size=batch_size)
+
+    return len(rows)
@@ -0,0 +1,193 @@
+import time, uuid
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from django.db import IntegrityError, transaction #type: ignore
+from django.db.models import Q #type: ignore
+from django.utils import timezone #type: ignore
+
+from Core.jobs import enqueue
+from Students.models import Student
+
+from .models import PaymentAttempt, PaymentCallback, Wallet
+from .application import create_receipt, process_fee_allocation
+
+BATCH_SIZE = 500
+
+# Seconds a callback waits in the inbox so a burst is processed as one batch
+PROCESS_DELAY = 1
+
+# ============================== PAYLOADS ============================== #
+# Each parser maps a provider's payload onto the fields a PaymentAttempt needs
+def parse_mpesa_c2b(data) -> dict:
+    return {
+        "trans_id": data.get("TransID"),
+        "amount": data.get("TransAmount", 0),
+        "regno": data.get("BillRefNumber"), # Admission number
+        "payer_name": " ".join(filter(None, [data.get("FirstName", ""), data.get("MiddleName", ""), data.get("LastName", "")])),
+        "account_number": data.get("MSISDN"),
+        "wallet": "MPesa",
+    }
+
+def parse_equity(data) -> dict:
+    return {
+        "trans_id": data.get("transaction_id"),
+        "amount": data.get("amount"),
+        "regno": data.get("reference"), # e.g., ADM00123
+        "payer_name": data.get("sender_name"),
+        "account_number": data.get("sender_account"),
+        "wallet": "Equity",
+    }
+
+def parse_bank(data) -> dict:
+    return {
+        "trans_id": data.get("trans_id"),
+        "amount": data.get("amount"),
+        "regno": data.get("reference_number"),
+        "payer_name": data.get("bank_name"),
+        "account_number": data.get("account_number"),
+        "wallet": data.get("bank_name") or "Bank",
+    }
+
+CALLBACK_PARSERS = {
+    "mpesa-c2b": parse_mpesa_c2b,
+    "equity": parse_equity,
+    "bank": parse_bank,
+}
+
+# ============================== INGEST ============================== #
+_scheduled_second = None
+
+def schedule_inbox() -> None:
+    """
+    Queues one inbox run per second of callbacks; the job key makes the rest no-ops, and
+    this process skips the lookup for a second it has already scheduled.
+    """
+    global _scheduled_second
+    second = int(time.time())
+    if second == _scheduled_second:
+        return
+    enqueue(process_inbox, key=f"payment-callbacks:{second}", delay=PROCESS_DELAY, max_attempts=1)
+    _scheduled_second = second
+
+def receive_callback(source: str, payload: dict) -> Tuple[Optional[PaymentCallback], bool]:
+    """
+    Stores a callback in the inbox and schedules processing. Nothing else is done while the
+    provider waits for its acknowledgement.
+
+    Returns:
+        (callback, created); (None, False) when the transaction was already received.
+
+    Raises:
+        ValueError if the payload has no transaction id.
+    """
+    trans_id = CALLBACK_PARSERS[source](payload).get("trans_id")
+    if not trans_id:
+        raise ValueError("Missing transaction id")
+
+    # Retries vastly outnumber first deliveries in a storm; answer them with a read and
+    # leave the unique constraint to settle the races
+    if PaymentCallback.objects.filter(source=source, trans_id=str(trans_id)).exists():
+        return None, False
+
+    try:
+        with transaction.atomic():
+            callback = PaymentCallback.objects.create(source=source, trans_id=str(trans_id), payload=payload)
+    except IntegrityError:
+        return None, False
+
+    schedule_inbox()
+    return callback, True
+
+# ============================== PROCESS ============================== #
+def claim_callbacks(limit: int) -> list:
+    """
+    Marks up to `limit` received callbacks as Processing under a fresh claim token, so
+    concurrent runs never process the same callback.
+    """
+    ids = list(PaymentCallback.objects.filter(status="Received").order_by("id").values_list("id", flat=True)[:limit])
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    PaymentCallback.objects.filter(id__in=ids, status="Received").update(status="Processing", batch=token)
+    return list(PaymentCallback.objects.filter(batch=token, status="Processing").order_by("id"))
+
+def get_callback_wallet(name, wallets: dict):
+    if name not in wallets:
+        wallets[name] = Wallet.objects.filter(Q(name__icontains=name) | Q(payment_method__name__iexact=name)).order_by("id").first()
+    return wallets[name]
+
+def process_callbacks(callbacks, counts: dict) -> None:
+    """
+    Turns a claimed batch of callbacks into payment attempts and receipts. Students and
+    already-recorded transactions are looked up once for the whole batch.
+    """
+    parsed = [(callback, CALLBACK_PARSERS[callback.source](callback.payload)) for callback in callbacks]
+
+    students = {}
+    for student in Student.objects.filter(regno__in={details["regno"] for _, details in parsed if details["regno"]}).order_by("-id"):
+        students[student.regno] = student # lowest id wins, as .first() did
+    recorded = set(PaymentAttempt.objects.filter(ref_id__in=[callback.trans_id for callback in callbacks]).values_list("ref_id", flat=True))
+    wallets = {}
+
+    for callback, details in parsed:
+        callback.processed_at = timezone.now()
+        callback.error = None
+        student = students.get(details["regno"])
+
+        if callback.trans_id in recorded:
+            callback.status = "Duplicate"
+        elif not student:
+            callback.status = "Unmatched"
+        else:
+            try:
+                with transaction.atomic():
+                    callback.attempt = PaymentAttempt.objects.create(
+                        wallet=get_callback_wallet(details["wallet"], wallets),
+                        status="Success",
+                        account_number=details["account_number"],
+                        payer_name=details["payer_name"],
+                        ref_id=callback.trans_id,
+                        merchant_request_id=callback.trans_id,
+                        checkout_request_id=callback.trans_id,
+                        student=student,
+                        amount=Decimal(str(details["amount"] or 0)),
+                        response_payload=callback.payload,
+                    )
+                    rcpt = create_receipt(callback.attempt.id)
+                    if not rcpt:
+                        raise ValueError("Receipt could not be created")
+                enqueue(process_fee_allocation, rcpt.id, key=f"fee-allocation:{rcpt.id}")
+                recorded.add(callback.trans_id)
+                callback.status = "Processed"
+            except Exception as e:
+                print(f"[ERROR]: payment callback {callback} failed: {e}")
+                callback.attempt = None
+                callback.status = "Failed"
+                callback.error = str(e)
+
+        counts[callback.status] = counts.get(callback.status, 0) + 1
+
+    PaymentCallback.objects.bulk_update(callbacks, ["status", "attempt", "error", "processed_at"])
+
+def process_inbox(batch_size=BATCH_SIZE) -> dict:
+    """
+    Job: processes received callbacks in batches until the inbox is empty.
+
+    Returns:
+        Callbacks handled by outcome, e.g. {"Processed": 950, "Unmatched": 50}.
+    """
+    counts = {}
+    while True:
+        callbacks = claim_callbacks(batch_size)
+        if not callbacks:
+            return counts
+        process_callbacks(callbacks, counts)
+
+def requeue_callbacks(statuses=(), ids=()) -> int:
+    """
+    Puts callbacks back in the inbox to be processed again. Returns the number requeued.
+    """
+    callbacks = PaymentCallback.objects.filter(Q(status__in=statuses) | Q(id__in=ids)).exclude(status="Processed")
+    return callbacks.update(status="Received", batch=None)
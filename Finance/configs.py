@@ -22,6 +22,8 @@ DEFAULTS = {
     'TRANSACTION_TYPE': 'CustomerPayBillOnline',
     'ENV': MPESA_ENV,  # can be "sandbox" or "production"
     'SAFARICOM_API': MPESA_BASE_URLS.get(MPESA_ENV, MPESA_BASE_URLS['sandbox']),
+    'CONNECT_TIMEOUT': 3.05,  # seconds
+    'READ_TIMEOUT': 15,
 }
 
 api_settings = APISettings(USER_SETTINGS, DEFAULTS, None)
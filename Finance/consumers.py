@@ -0,0 +1,37 @@
+from channels.generic.websocket import AsyncWebsocketConsumer  #type: ignore
+from channels.db import database_sync_to_async #type: ignore
+import json
+
+from .models import PaymentAttempt
+from .payments import get_payment_group, get_attempt_status, can_follow_attempt
+
+class PaymentStatusConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes the result of one STK push to the payer. Only the user who started the payment
+    (or an admin) may subscribe; the socket is authenticated by JWTAuthMiddleware.
+    """
+    async def connect(self):
+        self.checkout_id = self.scope['url_route']['kwargs']['checkout_id']
+        attempt = await self.get_attempt()
+        if not attempt or not await database_sync_to_async(can_follow_attempt)(self.scope.get("user"), attempt):
+            await self.close()
+            return
+
+        self.group_name = get_payment_group(self.checkout_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        # The callback may have arrived before the client subscribed
+        if attempt.status != "Pending":
+            await self.send(json.dumps(await database_sync_to_async(get_attempt_status)(attempt)))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, "group_name"):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def payment_status(self, event):
+        await self.send(json.dumps(event["status"]))
+
+    @database_sync_to_async
+    def get_attempt(self):
+        return PaymentAttempt.objects.filter(checkout_request_id=self.checkout_id).first()
@@ -0,0 +1,275 @@
+import csv, io, json, re, zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Iterator, List
+from xml.sax.saxutils import escape
+
+from django.utils import timezone #type: ignore
+from django.utils.dateparse import parse_date #type: ignore
+
+from .models import FeeStatus, Invoice, Receipt, Transaction
+from .statements import Echo
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+# Rows fetched per database round trip, and rows joined into each chunk sent to the client
+CHUNK_SIZE = 2000
+WRITE_BATCH = 500
+
+STUDENT_COLUMNS = [
+    ("Reg No", "student__regno"),
+    ("First Name", "student__fname"),
+    ("Middle Name", "student__mname"),
+    ("Surname", "student__sname"),
+    ("Course", "student__course__abbr"),
+]
+
+# dataset: queryset, the date, term and course lookups the filters apply to, and
+# [(column, lookup)]
+EXPORTS = {
+    "receipts": {
+        "queryset": Receipt.objects.all,
+        "date": "dop",
+        "term": "term_id",
+        "course": "student__course_id",
+        "columns": [("ID", "id"), ("Transaction ID", "trans_id")] + STUDENT_COLUMNS + [
+            ("Year", "term__year__name"),
+            ("Intake", "term__name__name"),
+            ("Wallet", "wallet__name"),
+            ("Amount", "amount"),
+            ("Cashier", "cashier"),
+            ("Date of Payment", "dop"),
+            ("Narration", "narration"),
+            ("Created", "created_at"),
+        ],
+    },
+    "transactions": {
+        "queryset": Transaction.objects.all,
+        "date": "created_at",
+        "term": "receipt__term_id",
+        "course": "receipt__student__course_id",
+        "columns": [
+            ("ID", "id"),
+            ("Receipt", "receipt_id"),
+            ("Transaction ID", "receipt__trans_id"),
+            ("Reg No", "receipt__student__regno"),
+            ("Votehead", "account__account__votehead"),
+            ("Fee Particular", "account__name"),
+            ("Amount", "amount"),
+            ("Running Balance", "running_balance"),
+            ("Created", "created_at"),
+        ],
+    },
+    "invoices": {
+        "queryset": Invoice.objects.all,
+        "date": "created_at",
+        "term": "term_id",
+        "course": "student__course_id",
+        "columns": [("ID", "id"), ("Invoice No", "inv_no")] + STUDENT_COLUMNS + [
+            ("Year", "term__year__name"),
+            ("Intake", "term__name__name"),
+            ("Amount", "amount"),
+            ("Paid", "paid_amount"),
+            ("State", "state"),
+            ("Cleared", "is_cleared"),
+            ("Created", "created_at"),
+        ],
+    },
+    "fee-statuses": {
+        "queryset": FeeStatus.objects.all,
+        "date": "created_at",
+        "term": "term_id",
+        "course": "student__course_id",
+        "columns": [("ID", "id")] + STUDENT_COLUMNS + [
+            ("Year", "term__year__name"),
+            ("Intake", "term__name__name"),
+            ("Module", "module__name"),
+            ("Status", "status"),
+            ("Arrears", "arrears"),
+            ("Purpose", "purpose"),
+            ("Created", "created_at"),
+        ],
+    },
+}
+
+def get_export_queryset(dataset: str, start=None, end=None, term_id=None, course_id=None):
+    """
+    Rows of an export, oldest first, as value tuples in the order of the dataset's columns.
+
+    Parameters:
+        start, end: "YYYY-MM-DD", both inclusive
+        term_id, course_id: optional filters
+
+    Raises:
+        KeyError for an unknown dataset, ValueError for a malformed date.
+    """
+    spec = EXPORTS[dataset]
+    filters = {}
+    for key, value, lookup in (("start", start, "gte"), ("end", end, "lt")):
+        if not value:
+            continue
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid {key} date {value}")
+        if key == "end":
+            day += timedelta(days=1)
+        filters[f"{spec['date']}__{lookup}"] = timezone.make_aware(datetime(day.year, day.month, day.day))
+    if term_id:
+        filters[spec["term"]] = int(term_id)
+    if course_id:
+        filters[spec["course"]] = int(course_id)
+
+    lookups = [lookup for _, lookup in spec["columns"]]
+    return spec["queryset"]().filter(**filters).order_by("id").values_list(*lookups)
+
+def get_export_columns(dataset: str) -> List[str]:
+    return [column for column, _ in EXPORTS[dataset]["columns"]]
+
+def format_value(value, keep_numbers=False):
+    """
+    Datetimes become local ISO strings and Decimals strings, unless `keep_numbers`.
+    """
+    if isinstance(value, datetime):
+        return (timezone.localtime(value) if timezone.is_aware(value) else value).isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, Decimal) and not keep_numbers:
+        return str(value)
+    return value
+
+def iter_rows(queryset, keep_numbers=False) -> Iterator[list]:
+    for row in queryset.iterator(chunk_size=CHUNK_SIZE):
+        yield [format_value(value, keep_numbers) for value in row]
+
+def iter_batches(lines: Iterator[str]) -> Iterator[str]:
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) == WRITE_BATCH:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+def iter_export_csv(columns, queryset) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    yield from iter_batches(
+        writer.writerow(["" if value is None else value for value in row]) for row in iter_rows(queryset)
+    )
+
+def iter_export_ndjson(columns, queryset) -> Iterator[str]:
+    yield from iter_batches(json.dumps(dict(zip(columns, row))) + "\n" for row in iter_rows(queryset))
+
+class StreamBuffer(io.RawIOBase):
+    """
+    Write-only, unseekable file that hands back what has been written since the last `pop`.
+    Given to ZipFile, it makes the archive stream out entry by entry.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+class XLSXStream:
+    """
+    Minimal single-sheet XLSX writer. Cells are written inline (no shared string table) so
+    the sheet can be compressed and sent row by row.
+    """
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    )
+    ROOT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+    WORKBOOK = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    )
+    WORKBOOK_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )
+    SHEET_START = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+    )
+    SHEET_END = '</sheetData></worksheet>'
+
+    # Characters XML 1.0 does not allow
+    INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+    @classmethod
+    def cell(cls, value) -> str:
+        if value is None or value == "":
+            return "<c/>"
+        if isinstance(value, bool):
+            return f'<c t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float, Decimal)):
+            return f"<c><v>{value}</v></c>"
+        text = escape(cls.INVALID_CHARS.sub("", str(value)))
+        return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+    @classmethod
+    def row(cls, values) -> str:
+        return "<row>" + "".join(cls.cell(value) for value in values) + "</row>"
+
+    def __init__(self, sheet_name="Sheet1"):
+        self.sheet_name = escape(sheet_name[:31])
+        self.buffer = StreamBuffer()
+        self.zip = zipfile.ZipFile(self.buffer, mode="w", compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, columns, rows: Iterator[list]) -> Iterator[bytes]:
+        self.zip.writestr("[Content_Types].xml", self.CONTENT_TYPES)
+        self.zip.writestr("_rels/.rels", self.ROOT_RELS)
+        self.zip.writestr("xl/workbook.xml", self.WORKBOOK.format(name=self.sheet_name))
+        self.zip.writestr("xl/_rels/workbook.xml.rels", self.WORKBOOK_RELS)
+        yield self.buffer.pop()
+
+        with self.zip.open("xl/worksheets/sheet1.xml", mode="w", force_zip64=True) as sheet:
+            sheet.write((self.SHEET_START + self.row(columns)).encode())
+            for batch in iter_batches(self.row(row) for row in rows):
+                sheet.write(batch.encode())
+                data = self.buffer.pop()
+                if data:
+                    yield data
+            sheet.write(self.SHEET_END.encode())
+
+        self.zip.close()
+        yield self.buffer.pop()
+
+def iter_export_xlsx(columns, queryset, sheet_name="Sheet1") -> Iterator[bytes]:
+    yield from XLSXStream(sheet_name).write(columns, iter_rows(queryset, keep_numbers=True))
+
+def iter_export(dataset: str, export_format: str, queryset):
+    columns = get_export_columns(dataset)
+    if export_format == "xlsx":
+        return iter_export_xlsx(columns, queryset, sheet_name=dataset)
+    if export_format == "ndjson":
+        return iter_export_ndjson(columns, queryset)
+    return iter_export_csv(columns, queryset)
@@ -0,0 +1,129 @@
+from typing import Dict, Optional
+from decimal import Decimal
+
+from django.db.models import F, Sum, QuerySet #type: ignore
+
+from .models import Invoice, Receipt
+
+# Lookups from an Invoice/Receipt row to each grouping level. Allocate_Student is
+# one-to-one with Student (related_name "students"), so the joins never fan out.
+GROUP_KEYS = {
+    "student": "student_id",
+    "class": "student__students__Class_id",
+    "course": "student__students__Class__course_id",
+    "department": "student__students__Class__course__department_id",
+}
+
+def make_totals(invoiced=Decimal("0.00"), paid=Decimal("0.00")) -> Dict[str, Decimal]:
+    return {
+        "invoiced": invoiced,
+        "paid": paid,
+        "balance": invoiced - paid,
+    }
+
+class FeeAggregator:
+    """
+    Computes invoiced / paid / balance figures for a term in a fixed number of grouped
+    queries, independent of how many students, classes or courses exist.
+
+    Each grouping level costs two queries (one for invoices, one for receipts) and is
+    cached on the instance, so a view can ask for several levels without re-querying.
+    """
+
+    def __init__(self, term, students: Optional[QuerySet] = None):
+        self.term = term
+        self.students = students
+        self._cache: Dict[str, Dict[int, Dict[str, Decimal]]] = {}
+
+    def get_invoices(self) -> QuerySet:
+        invoices = Invoice.objects.filter(term=self.term)
+        if self.students is not None:
+            invoices = invoices.filter(student__in=self.students)
+        return invoices
+
+    def get_receipts(self) -> QuerySet:
+        receipts = Receipt.objects.filter(term=self.term)
+        if self.students is not None:
+            receipts = receipts.filter(student__in=self.students)
+        return receipts
+
+    def group_by(self, level: str) -> Dict[int, Dict[str, Decimal]]:
+        """
+        Returns {key: {"invoiced", "paid", "balance"}} for the requested level
+        ("student", "class", "course" or "department"). Keys with neither invoices
+        nor receipts in the term are absent; use `get()` for a zero default.
+        """
+        if level in self._cache:
+            return self._cache[level]
+
+        lookup = GROUP_KEYS[level]
+
+        invoiced = (
+            self.get_invoices()
+            .values(key=F(lookup))
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        paid = (
+            self.get_receipts()
+            .values(key=F(lookup))
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+
+        invoiced_map = {row["key"]: row["total"] or Decimal("0.00") for row in invoiced}
+        paid_map = {row["key"]: row["total"] or Decimal("0.00") for row in paid}
+
+        grouped = {
+            key: make_totals(invoiced_map.get(key, Decimal("0.00")), paid_map.get(key, Decimal("0.00")))
+            for key in invoiced_map.keys() | paid_map.keys()
+        }
+
+        self._cache[level] = grouped
+        return grouped
+
+    def by_student(self) -> Dict[int, Dict[str, Decimal]]:
+        return self.group_by("student")
+
+    def by_class(self) -> Dict[int, Dict[str, Decimal]]:
+        return self.group_by("class")
+
+    def by_course(self) -> Dict[int, Dict[str, Decimal]]:
+        return self.group_by("course")
+
+    def by_department(self) -> Dict[int, Dict[str, Decimal]]:
+        return self.group_by("department")
+
+    def get(self, level: str, key) -> Dict[str, Decimal]:
+        """
+        Returns the totals for a single key, defaulting to zeros.
+        """
+        return self.group_by(level).get(key) or make_totals()
+
+    def totals(self) -> Dict[str, Decimal]:
+        """
+        Returns the term-wide totals.
+        """
+        if "total" not in self._cache:
+            invoiced = self.get_invoices().aggregate(total=Sum("amount"))["total"] or Decimal("0.00")
+            paid = self.get_receipts().aggregate(total=Sum("amount"))["total"] or Decimal("0.00")
+            self._cache["total"] = make_totals(invoiced, paid)
+        return self._cache["total"]
+
+    def balance_counts(self, total_students: int) -> Dict[str, int]:
+        """
+        Counts students that are cleared, owing or overpaid. Students without any invoice
+        or receipt in the term have a zero balance and are counted as cleared.
+        """
+        owing, overpaid = 0, 0
+        for totals in self.by_student().values():
+            if totals["balance"] > 0:
+                owing += 1
+            elif totals["balance"] < 0:
+                overpaid += 1
+
+        return {
+            "cleared": total_students - owing - overpaid,
+            "owing": owing,
+            "overpaid": overpaid,
+        }
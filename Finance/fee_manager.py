@@ -1,11 +1,24 @@
 from django.utils import timezone #type: ignore
 from typing import Dict, Tuple, List
-from decimal import Decimal, ROUND_DOWN
+from decimal import Decimal
 
 
 from .models import Receipt, Transaction, FeeParticular, Account, FeeStatus, Invoice
+from .balances import get_latest_balance
+from .allocation import allocate
+from .fee_structures import get_structure
 from Students.models import Student, Allocate_Student
 
+def get_fee_status(arrears: Decimal) -> str:
+    """
+    Maps a running arrears figure (negative when owing) to a FEE_STATUS value.
+    """
+    if arrears > 0:
+        return "Overpaid"
+    elif arrears < 0:
+        return "Not-Cleared"
+    return "Cleared"
+
 class FeeManager:
     def __init__(self, student_regno, term_id):
         self.student = Student.objects.get(regno=student_regno)
@@ -30,18 +43,25 @@ class FeeManager:
 
     def get_structure(self) -> Dict[FeeParticular, int]:
         """
-        Returns a dictionary {Account: amount} representing the expected fee structure
-        for the student's course, module, and term.
+        Returns a dictionary {FeeParticular: amount} representing the expected fee structure
+        for the student's course, module, and term, read from the fee structure cache.
+        The particulars are unsaved copies for lookups; their related objects load on access.
         """
-        structure = {}
-        particulars = FeeParticular.objects.filter(
-            course = self.student.course, 
-            module = self.module, 
-            term__id = self.term
-        )
+        fee_structure = get_structure(self.student.course_id, self.module.id, self.term)
 
-        for item in particulars:
-            structure[item] = structure.get(item, 0) + item.amount
+        structure = {}
+        for item in fee_structure.items:
+            particular = FeeParticular(
+                id = item.id,
+                name = item.name,
+                course_id = fee_structure.course_id,
+                module_id = fee_structure.module_id,
+                term_id = fee_structure.term_id,
+                account_id = item.account_id,
+                amount = item.amount,
+                target = item.target
+            )
+            structure[particular] = structure.get(particular, 0) + item.amount
 
         return structure
     
@@ -114,6 +134,7 @@ class FeeManager:
     def allocate_payment( self, amount: Decimal, distribution: Dict[FeeParticular, Tuple[Decimal, int]]) -> Dict[FeeParticular, Decimal]:
         """
         Allocate payment based on account priorities and remaining balances.
+        See `Finance.allocation.allocate`.
 
         Parameters:
             amount: total amount available to allocate (Decimal)
@@ -123,81 +144,8 @@ class FeeManager:
             Dict of {Account: allocated_amount}
         """
 
-        # Step 1: Sort Accounts by priority ascending
-        sorted_distribution = dict(
-            sorted(distribution.items(), key=lambda item: item[1][1], reverse=False)
-        )
+        return allocate(amount, distribution)
 
-        total_balance = sum(balance for balance, _ in sorted_distribution.values())
-        particular_balance = {account: Decimal("0.00") for account in sorted_distribution}
-
-        # Step 2: Full payment case
-        if amount >= total_balance:
-            for account, (balance_due, _) in sorted_distribution.items():
-                particular_balance[account] = balance_due
-            return particular_balance
-
-        # Step 3: Partial payment case - handle 100% priority logic
-        remaining_distribution = {}
-        for account, (balance_due, priority) in sorted_distribution.items():
-            if amount <= Decimal("0.00"):
-                break
-
-            if priority == 100:
-                # Full priority
-                if amount >= balance_due:
-                    particular_balance[account] = balance_due
-                    amount -= balance_due
-                else:
-                    particular_balance[account] = amount
-                    amount = Decimal("0.00")
-            else:
-                remaining_distribution[account] = (balance_due, priority)
-        
-        if amount <= Decimal("0.00"):
-            return particular_balance
-
-        # Step 4: Handle priorities less than 100%
-        # A) Total balance of remaining voteheads
-        remaining_total_balance = sum(balance for balance, _ in remaining_distribution.values())
-
-        if remaining_total_balance <= 0:
-            return particular_balance
-
-        # B) Loop and distribute based on priority logic
-        while amount > Decimal("0.00"):
-            distributed = False
-
-            for account, (balance_due, priority) in remaining_distribution.items():
-                already_allocated = particular_balance[account]
-                remaining = balance_due - already_allocated
-                if remaining <= Decimal("0.00"):
-                    continue
-
-                # Ratio-based allocation
-                ratio_based = ((balance_due / remaining_total_balance) * amount).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
-
-                # Priority-based allocation
-                priority_based = ((Decimal(priority) / Decimal("100.00")) * balance_due).quantize(Decimal("0.01"), rounding=ROUND_DOWN)
-
-                # Choose the smaller of the two
-                allocation = min(ratio_based, priority_based, remaining, amount)
-
-                if allocation <= Decimal("0.00"):
-                    continue
-
-                particular_balance[account] += allocation
-                amount -= allocation
-                distributed = True
-
-                if amount <= Decimal("0.00"):
-                    break
-
-            if not distributed:
-                break  # No more allocations possible, avoid infinite loop
-
-        return particular_balance
-    
     def apply_payment(self, receipt: Receipt, distributed: Dict[FeeParticular, Decimal]) -> None:
         """
         Applies and records the payment allocations to the database.
@@ -231,20 +179,15 @@ class FeeManager:
         """
         arrears = Decimal("0.00")
 
-        # Get current status
-        latest_status = FeeStatus.objects.filter(student=self.student).order_by('-created_at').first()        
+        # Get current status from the balance projection, falling back to history if it has not been built
+        latest_status = get_latest_balance(self.student) or FeeStatus.objects.filter(student=self.student).order_by('-created_at').first()
         if latest_status:
             previous_arrears = latest_status.arrears or Decimal("0.00")
             arrears = previous_arrears + amount_paid
         else:
             arrears = amount_paid
 
-        if arrears > 0:
-            status = "Overpaid"
-        elif arrears < 0:
-            status = "Not-Cleared"
-        else:
-            status = "Cleared"
+        status = get_fee_status(arrears)
 
         # Update fee status record
         FeeStatus.objects.create(
@@ -0,0 +1,155 @@
+from decimal import Decimal
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Tuple
+
+from django.core.cache import cache #type: ignore
+from django.db import transaction #type: ignore
+
+from .models import FeeParticular
+
+# Saves and deletes invalidate structures explicitly in the shared cache (settings.CACHES);
+# the timeout only bounds the life of entries nobody invalidated
+STRUCTURE_TTL = 10 * 60
+CACHE_PREFIX = "fee-structure"
+GENERATION_KEY = f"{CACHE_PREFIX}:generation"
+
+StructureKey = Tuple[int, int, int] # (course_id, module_id, term_id)
+
+class FeeItem(NamedTuple):
+    id: int
+    name: str
+    account_id: int
+    votehead: str
+    priority: int # PriorityLevel.rank of the votehead
+    amount: Decimal
+    target: Optional[str]
+
+class FeeStructure(NamedTuple):
+    """
+    Read-only snapshot of the fee particulars billed for a course and module in a term,
+    ordered by id. Safe to share between requests.
+    """
+    course_id: int
+    module_id: int
+    term_id: int
+    items: Tuple[FeeItem, ...]
+
+    @property
+    def ids(self) -> FrozenSet[int]:
+        return frozenset(item.id for item in self.items)
+
+    @property
+    def total(self) -> Decimal:
+        return sum((item.amount for item in self.items), Decimal("0.00"))
+
+    @property
+    def course_items(self) -> Tuple[FeeItem, ...]:
+        """
+        Particulars billed to the whole course, i.e. what a new term invoice is made of.
+        """
+        return tuple(item for item in self.items if item.target == "Course")
+
+    @property
+    def course_total(self) -> Decimal:
+        return sum((item.amount for item in self.course_items), Decimal("0.00"))
+
+    @property
+    def priorities(self) -> Dict[int, int]:
+        """
+        {FeeParticular id: votehead priority}
+        """
+        return {item.id: item.priority for item in self.items}
+
+def get_generation() -> int:
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+def get_cache_key(generation: int, key: StructureKey) -> str:
+    return f"{CACHE_PREFIX}:{generation}:{key[0]}:{key[1]}:{key[2]}"
+
+def normalize_key(key) -> StructureKey:
+    course_id, module_id, term_id = key
+    return int(course_id), int(module_id), int(term_id)
+
+def load_structures(keys) -> Dict[StructureKey, FeeStructure]:
+    """
+    Reads the structures for `keys` from the database in one query. Keys without
+    particulars get an empty structure.
+    """
+    keys = set(keys)
+    items = {key: [] for key in keys}
+
+    rows = FeeParticular.objects.filter(
+        course_id__in={key[0] for key in keys},
+        module_id__in={key[1] for key in keys},
+        term_id__in={key[2] for key in keys},
+    ).order_by("id").values_list(
+        "course_id", "module_id", "term_id",
+        "id", "name", "account_id", "account__votehead", "account__priority__rank", "amount", "target",
+    )
+    for course_id, module_id, term_id, *item in rows:
+        key = (course_id, module_id, term_id)
+        if key in items:
+            items[key].append(FeeItem(*item))
+
+    return {key: FeeStructure(*key, tuple(found)) for key, found in items.items()}
+
+def get_structures(keys: Iterable) -> Dict[StructureKey, FeeStructure]:
+    """
+    Fee structures for many (course_id, module_id, term_id) keys. Cached structures are
+    fetched together and the rest are loaded with a single query.
+
+    Returns:
+        {(course_id, module_id, term_id): FeeStructure}
+    """
+    keys = {normalize_key(key) for key in keys}
+    if not keys:
+        return {}
+
+    generation = get_generation()
+    cache_keys = {get_cache_key(generation, key): key for key in keys}
+    structures = {cache_keys[cache_key]: structure for cache_key, structure in cache.get_many(list(cache_keys)).items()}
+
+    missing = keys - structures.keys()
+    if missing:
+        loaded = load_structures(missing)
+        cache.set_many({get_cache_key(generation, key): structure for key, structure in loaded.items()}, STRUCTURE_TTL)
+        structures.update(loaded)
+
+    return structures
+
+def get_structure(course_id, module_id, term_id) -> FeeStructure:
+    key = normalize_key((course_id, module_id, term_id))
+    return get_structures([key])[key]
+
+def invalidate_structures(keys: Iterable) -> None:
+    """
+    Drops cached structures now and again once the current transaction commits, so a
+    concurrent reader cannot re-cache the rows being replaced.
+    """
+    keys = {normalize_key(key) for key in keys}
+    if not keys:
+        return
+
+    def drop():
+        generation = get_generation()
+        cache.delete_many([get_cache_key(generation, key) for key in keys])
+
+    drop()
+    transaction.on_commit(drop)
+
+def invalidate_all_structures() -> None:
+    """
+    Moves every structure to a new cache generation, e.g. after a votehead or its priority
+    changes. Old entries are left to expire.
+    """
+    def bump():
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.set(GENERATION_KEY, 2, None)
+
+    bump()
+    transaction.on_commit(bump)
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Avg, Count, Max #type: ignore
+
+from Core.forecasts import get_forecast, store_forecast
+from Core.models import Course
+from Students.forecasting import forecast_applications, get_applications_version
+
+from .models import FeeParticular, FeeRollup
+from .application import get_historical_payment_rates
+
+FORECAST_NAME = "fee-collection"
+DEFAULT_PAYMENT_RATE = 0.9
+
+def get_forecast_version() -> str:
+    """
+    Changes whenever applications, invoices, receipts (through their rollups) or fee
+    particulars change.
+    """
+    rollups = FeeRollup.objects.aggregate(count=Count("id"), last=Max("updated_at"))
+    particulars = FeeParticular.objects.aggregate(count=Count("id"), last=Max("updated_at"))
+    return "|".join([
+        get_applications_version(),
+        f"rollups:{rollups['count']}:{rollups['last']}",
+        f"particulars:{particulars['count']}:{particulars['last']}",
+    ])
+
+def get_course_fees(course_ids) -> dict:
+    """
+    `get_course_fee` for many courses in one query: {course_id: sum of votehead averages}.
+    """
+    totals = defaultdict(lambda: Decimal("0"))
+    for row in FeeParticular.objects.filter(course_id__in=course_ids).values("course", "account").annotate(
+        avg_amount=Avg("amount")
+    ).order_by():
+        totals[row["course"]] += row["avg_amount"]
+    return {course_id: round(totals.get(course_id, 0), 2) for course_id in course_ids}
+
+def compute_fee_forecast() -> dict:
+    """
+    Next year's invoicing and collections per course and department: predicted enrolment
+    times the course fee, collected at the course's historical payment rate. Amounts are
+    summed as Decimals and returned as numbers.
+    """
+    applications = forecast_applications()
+    predicted_enrollment = applications["by_course"]
+
+    courses = Course.objects.select_related("department").in_bulk(list(predicted_enrollment))
+    fees = get_course_fees(list(courses))
+    course_payment_rates = get_historical_payment_rates()
+
+    total_students = 0
+    total_invoice = 0
+    total_receipt = 0
+    department_data = {}
+
+    for course_id, student_count in predicted_enrollment.items():
+        course = courses.get(course_id)
+        if not course:
+            continue
+        department = course.department
+
+        invoice_total = fees[course_id] * student_count
+        payment_rate = course_payment_rates.get(course_id, DEFAULT_PAYMENT_RATE)
+        receipt_total = invoice_total * Decimal(str(payment_rate))
+        balance = invoice_total - receipt_total
+
+        total_students += student_count
+        total_invoice += invoice_total
+        total_receipt += receipt_total
+
+        if department.id not in department_data:
+            department_data[department.id] = {
+                "id": department.id,
+                "name": department.name,
+                "abbr": department.abbr,
+                "students": 0,
+                "invoice": 0,
+                "receipt": 0,
+                "balance": 0,
+                "courses": []
+            }
+
+        department_entry = department_data[department.id]
+        department_entry["students"] += student_count
+        department_entry["invoice"] += invoice_total
+        department_entry["receipt"] += receipt_total
+        department_entry["balance"] += balance
+        department_entry["courses"].append({
+            "id": course.id,
+            "abbr": course.abbr,
+            "name": course.name,
+            "students": student_count,
+            "invoice": float(invoice_total),
+            "receipt": float(receipt_total),
+            "balance": float(balance)
+        })
+
+    for department_entry in department_data.values():
+        for name in ("invoice", "receipt", "balance"):
+            department_entry[name] = float(department_entry[name])
+
+    return {
+        "total_students": total_students,
+        "total_invoice": int(total_invoice),
+        "total_receipt": int(total_receipt),
+        "total_balance": int(total_invoice - total_receipt),
+        "departments": list(department_data.values())
+    }
+
+def refresh_fee_forecast() -> dict:
+    """
+    Job: recomputes the stored fee collection forecast.
+    """
+    return store_forecast(FORECAST_NAME, get_forecast_version(), compute_fee_forecast)
+
+def get_fee_forecast():
+    """
+    Returns (forecast, is_current). See `Core.forecasts.get_forecast`.
+    """
+    return get_forecast(FORECAST_NAME, get_forecast_version(), compute_fee_forecast, refresh=refresh_fee_forecast)
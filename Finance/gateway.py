@@ -0,0 +1,181 @@
+import threading, time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .configs import api_settings
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised instead of calling an upstream that has been failing.
+    """
+    pass
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_timeout`
+    seconds. After that a single trial call is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+class CallMetrics:
+    """
+    Latency and outcome counters for one endpoint. Keeps the last `window` latencies for percentiles.
+    """
+
+    def __init__(self, window=500):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, elapsed, ok) -> None:
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.latencies.append(elapsed)
+
+    def snapshot(self) -> dict:
+        latencies = sorted(self.latencies)
+        percentile = lambda fraction: latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if latencies else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "avg": self.total_time / self.calls if self.calls else None,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": self.max_time if self.calls else None,
+        }
+
+class GatewayClient:
+    """
+    Shared HTTP client for a payments upstream (Daraja, bank APIs).
+
+    One pooled requests.Session with keep-alive, connect/read timeouts on every call, retries
+    for connection errors (and for 502/503/504 on GETs only, so a payment request is never sent
+    twice; read timeouts are not retried), a circuit breaker, and per-endpoint latency metrics.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=3.05, read_timeout=15, retries=2, pool_size=20,
+                 failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.metrics = {}
+        self.metrics_lock = threading.Lock()
+
+        retry = Retry(
+            total = retries,
+            connect = retries,
+            read = 0,  # a slow upstream would only multiply the wait
+            status = retries,
+            backoff_factor = 0.3,
+            status_forcelist = (502, 503, 504),
+            allowed_methods = frozenset({"GET"}),
+            raise_on_status = False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_metrics(self, endpoint) -> CallMetrics:
+        with self.metrics_lock:
+            return self.metrics.setdefault(endpoint, CallMetrics())
+
+    def request(self, method, path, endpoint=None, **kwargs) -> requests.Response:
+        """
+        Sends a request to `base_url + path`. Raises CircuitOpenError while the upstream is
+        failing, and requests exceptions for network errors; 5xx responses count as failures.
+        """
+        endpoint = endpoint or path
+        metrics = self.get_metrics(endpoint)
+
+        if not self.breaker.allow():
+            metrics.rejected += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, try again shortly")
+
+        kwargs.setdefault("timeout", self.timeout)
+        base_url = self.base_url() if callable(self.base_url) else self.base_url
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{base_url}{path}", **kwargs)
+        except requests.RequestException:
+            metrics.record(time.perf_counter() - started, ok=False)
+            self.breaker.record_failure()
+            raise
+
+        ok = response.status_code < 500
+        metrics.record(time.perf_counter() - started, ok=ok)
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return response
+
+    def get(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("GET", path, endpoint, **kwargs)
+
+    def post(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("POST", path, endpoint, **kwargs)
+
+    def stats(self) -> dict:
+        with self.metrics_lock:
+            endpoints = {endpoint: metrics.snapshot() for endpoint, metrics in self.metrics.items()}
+        return {"name": self.name, "circuit": self.breaker.state, "endpoints": endpoints}
+
+daraja = GatewayClient(
+    "Daraja",
+    base_url = lambda: api_settings.SAFARICOM_API,
+    connect_timeout = api_settings.CONNECT_TIMEOUT,
+    read_timeout = api_settings.READ_TIMEOUT,
+)
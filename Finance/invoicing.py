@@ -0,0 +1,307 @@
+from decimal import Decimal
+from itertools import groupby, islice
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction #type: ignore
+
+from Core.jobs import enqueue, get_task_name, report_progress
+from Core.models import Institution, Job, Term
+from Students.models import Allocate_Student
+
+from .models import Account, FeeParticular, FeeStatus, Invoice
+from .application import reserve_invoice_numbers
+from .balances import apply_invoice_batch, get_latest_arrears
+from .aging import refresh_aging
+from .rollups import get_bucket, refresh_rollups
+from .fee_manager import get_fee_status
+from .fee_structures import FeeItem, get_structure, get_structures, invalidate_structures
+
+BATCH_SIZE = 500
+
+def get_particular_name(allocation, votehead, term, target) -> str:
+    if target == "Course":
+        owner = allocation.studentno.course.abbr
+    elif target == "Class":
+        owner = allocation.Class.name
+    else:
+        owner = allocation.studentno.regno
+    return str(owner) + "_" + str(votehead.votehead) + "_" + str(term.name)
+
+def resolve_particulars(allocations, term, voteheads, target) -> Dict[int, List[FeeParticular]]:
+    """
+    Builds the fee particulars for each allocation, sharing one particular per
+    (name, course, module) instead of cloning it per student. Particulars that already
+    exist are reused; the rest are created with a single bulk insert.
+
+    Returns {allocation_id: [FeeParticular]}.
+    """
+    accounts = Account.objects.in_bulk([registry["votehead"] for registry in voteheads])
+
+    wanted: Dict[Tuple[str, int, int], FeeParticular] = {}
+    keys_by_allocation: Dict[int, List[Tuple[str, int, int]]] = {}
+
+    for allocation in allocations:
+        keys = []
+        for registry in voteheads:
+            votehead = accounts.get(int(registry["votehead"]))
+            if not votehead:
+                raise ValueError(f"Votehead of ID {registry['votehead']} is not found!")
+
+            name = get_particular_name(allocation, votehead, term, target)
+            key = (name, allocation.Class.course_id, allocation.module_id)
+            if key not in wanted:
+                wanted[key] = FeeParticular(
+                    name = name,
+                    course_id = allocation.Class.course_id,
+                    module_id = allocation.module_id,
+                    term = term,
+                    account = votehead,
+                    amount = Decimal(str(registry["amount"])),
+                    target = target
+                )
+            keys.append(key)
+        keys_by_allocation[allocation.id] = keys
+
+    existing = FeeParticular.objects.filter(term=term, name__in={key[0] for key in wanted})
+    found = {(item.name, item.course_id, item.module_id): item for item in existing}
+
+    for key, particular in wanted.items():
+        if key in found and found[key].amount != particular.amount:
+            raise ValueError(f"{particular.name} already exists with amount {found[key].amount}")
+
+    missing = [particular for key, particular in wanted.items() if key not in found]
+    FeeParticular.objects.bulk_create(missing, batch_size=BATCH_SIZE)
+    invalidate_structures({(item.course_id, item.module_id, term.id) for item in missing})
+    found.update({key: particular for key, particular in wanted.items() if key not in found})
+
+    return {
+        allocation_id: [found[key] for key in keys]
+        for allocation_id, keys in keys_by_allocation.items()
+    }
+
+def bulk_create_invoices(term, entries: Iterable[Tuple[Allocate_Student, List[FeeParticular]]]) -> List[Invoice]:
+    """
+    Creates one invoice per (allocation, particulars) entry together with its narration
+    rows and opening FeeStatus, using bulk inserts inside one transaction.
+
+    The per-row Invoice signals are bypassed, so the StudentFeeBalance projection and the
+    fee rollups are updated in bulk at the end. Re-aging the students' arrears costs as
+    much as the invoicing itself and only feeds reports, so it is queued as a job instead.
+    """
+    entries = [(allocation, particulars) for allocation, particulars in entries if particulars]
+    if not entries:
+        return []
+
+    Narration = Invoice.narration.through
+
+    with transaction.atomic():
+        numbers = reserve_invoice_numbers(term, len(entries))
+
+        invoices = [
+            Invoice(
+                inv_no = inv_no,
+                student_id = allocation.studentno_id,
+                term = term,
+                amount = sum((item.amount for item in particulars), Decimal("0.00")),
+                state = "Pending",
+                is_cleared = False,
+                paid_amount = Decimal("0.00"),
+            )
+            for inv_no, (allocation, particulars) in zip(numbers, entries)
+        ]
+        Invoice.objects.bulk_create(invoices, batch_size=BATCH_SIZE)
+
+        Narration.objects.bulk_create([
+            Narration(invoice_id=invoice.id, feeparticular_id=item.id)
+            for invoice, (allocation, particulars) in zip(invoices, entries)
+            for item in particulars
+        ], batch_size=BATCH_SIZE)
+
+        # Opening fee status: previous arrears less the new invoice, as FeeManager.update_status does
+        running = get_latest_arrears(list({allocation.studentno_id for allocation, _ in entries}))
+        fee_statuses = []
+        for invoice, (allocation, particulars) in zip(invoices, entries):
+            arrears = running.get(allocation.studentno_id, Decimal("0.00")) - invoice.amount
+            running[allocation.studentno_id] = arrears
+
+            fee_statuses.append(FeeStatus(
+                student_id = allocation.studentno_id,
+                term = term,
+                module_id = allocation.module_id,
+                status = get_fee_status(arrears),
+                arrears = arrears,
+                purpose = invoice.inv_no,
+            ))
+        FeeStatus.objects.bulk_create(fee_statuses, batch_size=BATCH_SIZE)
+
+        apply_invoice_batch(term.id, fee_statuses, batch_size=BATCH_SIZE)
+        enqueue(refresh_aging, list(dict.fromkeys(fee_status.student_id for fee_status in fee_statuses)), max_attempts=3)
+        refresh_rollups(
+            get_bucket(invoice.created_at, term.id, allocation.studentno.course_id)
+            for invoice, (allocation, particulars) in zip(invoices, entries)
+        )
+
+    return invoices
+
+def get_course_structures(allocations, term) -> Dict[Tuple[int, int], Tuple[FeeItem, ...]]:
+    """
+    Looks up the course-level fee structures for every (course, module) among the
+    allocations from the fee structure cache. Returns {(course_id, module_id): (FeeItem, ...)}.
+    """
+    structures = get_structures({(allocation.studentno.course_id, allocation.module_id, term.id) for allocation in allocations})
+    return {(course_id, module_id): structure.course_items for (course_id, module_id, _), structure in structures.items()}
+
+def get_invoiced_students(allocations, term) -> set:
+    return set(
+        Invoice.objects.filter(term=term, student_id__in=[allocation.studentno_id for allocation in allocations])
+        .values_list("student_id", flat=True)
+    )
+
+def create_newterm_invoices(allocations, term) -> List[Invoice]:
+    """
+    Bulk form of `create_newterm_invoice`: invoices every allocation that has no invoice
+    for the term yet against its course/module fee structure.
+    """
+    allocations = list(allocations)
+    invoiced = get_invoiced_students(allocations, term)
+    structures = get_course_structures(allocations, term)
+
+    return bulk_create_invoices(term, [
+        (allocation, structures.get((allocation.studentno.course_id, allocation.module_id), []))
+        for allocation in allocations
+        if allocation.studentno_id not in invoiced
+    ])
+
+def create_new_invoices(allocations, term, fee_narration_ids) -> List[Invoice]:
+    """
+    Bulk form of `create_new_invoice`: students that already hold an invoice for the term
+    are billed the given particulars only; the rest get the full course fee structure.
+    """
+    allocations = list(allocations)
+    invoiced = get_invoiced_students(allocations, term)
+    structures = get_course_structures(allocations, term)
+    narrations = list(FeeParticular.objects.filter(id__in=fee_narration_ids))
+
+    return bulk_create_invoices(term, [
+        (
+            allocation,
+            narrations if allocation.studentno_id in invoiced
+            else structures.get((allocation.studentno.course_id, allocation.module_id), [])
+        )
+        for allocation in allocations
+    ])
+
+# Students in these states are not billed for a new term
+ROLLOVER_EXCLUDED_STATES = ["Cleared", "Suspended", "Expelled", "Graduated", "Differ"]
+
+def get_rollover_allocations():
+    """
+    Allocations of every student billable for a new term, grouped by (course, module).
+    """
+    return (
+        Allocate_Student.objects.select_related("studentno")
+        .exclude(studentno__state__in=ROLLOVER_EXCLUDED_STATES)
+        .order_by("studentno__course_id", "module_id", "id")
+    )
+
+def get_allocation_group(allocation) -> Tuple[int, int]:
+    return allocation.studentno.course_id, allocation.module_id
+
+def invoice_term_rollover(term_id, batch_size=BATCH_SIZE) -> dict:
+    """
+    Job: invoices every billable student for `term_id` against their course/module fee
+    structure, as `create_newterm_invoice` does one student at a time. Each fee structure is
+    resolved once per (course, module) and each batch is committed on its own, reporting
+    progress on the job.
+
+    Students already invoiced for the term are skipped, so an interrupted run is resumed by
+    running it again.
+
+    Returns:
+        The final progress, e.g. {"total": 1200, "processed": 1200, "invoiced": 1150, ...}
+    """
+    term = Term.objects.get(id=term_id)
+    allocations = get_rollover_allocations()
+
+    progress = {
+        "term": term.id,
+        "total": allocations.count(),
+        "processed": 0,
+        "invoiced": 0,
+        "already_invoiced": 0,
+        "no_structure": 0,
+        "groups": 0,
+    }
+    report_progress(**progress)
+
+    rows = allocations.iterator(chunk_size=batch_size)
+    for (course_id, module_id), group in groupby(rows, key=get_allocation_group):
+        items = get_structure(course_id, module_id, term.id).course_items if course_id else ()
+        progress["groups"] += 1
+
+        while True:
+            batch = list(islice(group, batch_size))
+            if not batch:
+                break
+
+            if not items:
+                progress["no_structure"] += len(batch)
+            else:
+                with transaction.atomic():
+                    invoiced = get_invoiced_students(batch, term)
+                    bulk_create_invoices(term, [
+                        (allocation, items) for allocation in batch if allocation.studentno_id not in invoiced
+                    ])
+                progress["already_invoiced"] += len(invoiced)
+                progress["invoiced"] += len(batch) - len(invoiced)
+
+            progress["processed"] += len(batch)
+            report_progress(**progress)
+
+    print(f"[ROLLOVER]: {term} {progress}")
+    return progress
+
+def start_term_rollover(term) -> Job:
+    """
+    Queues `invoice_term_rollover` for `term`, or returns the rollover already queued or
+    running for it.
+    """
+    active = Job.objects.filter(
+        name = get_task_name(invoice_term_rollover),
+        status__in = ["Queued", "Running"],
+        payload__args = [term.id],
+    ).first()
+    if active:
+        return active
+    return enqueue(invoice_term_rollover, term.id, max_attempts=3)
+
+def create_invoice(student_ids, voteheads, target):
+    try:
+        inst = Institution.objects.first()
+        term = Term.objects.filter(name=inst.current_intake, year=inst.current_year).first()
+
+        students = list(
+            Allocate_Student.objects
+            .filter(id__in=student_ids)
+            .select_related("studentno__course", "Class")
+            .only(
+                "studentno_id", "module_id", "Class_id", "studentno__regno", "studentno__course_id",
+                "studentno__course__abbr", "Class__name", "Class__course_id",
+            )
+        )
+        if not students:
+            return {"error": True,
+                    "errMessage": "No valid students found."}
+
+        with transaction.atomic():
+            particulars = resolve_particulars(students, term, voteheads, target)
+            bulk_create_invoices(term, [(student, particulars[student.id]) for student in students])
+
+        return {
+            "success": True
+        }
+    except Exception as e:
+        print(f"[ERROR]: {e}")
+        return {
+            "error":True,
+            "errMessage": e}
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand #type: ignore
+
+from Finance.aging import BATCH_SIZE, rebuild_aging, reage_aging
+
+class Command(BaseCommand):
+    help = "Move outstanding fees into older aging buckets as days pass, or rebuild the aging from the ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Recompute every student's aging from invoices and fee status history")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Rows per bulk write")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options["rebuild"]:
+            count = rebuild_aging(batch_size=options["batch_size"])
+            action = "Rebuilt"
+        else:
+            count = reage_aging(batch_size=options["batch_size"])
+            action = "Re-aged"
+
+        self.stdout.write(self.style.SUCCESS(f"{action} {count} student(s) in {time.monotonic() - started:.2f}s"))
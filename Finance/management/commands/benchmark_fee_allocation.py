@@ -0,0 +1,54 @@
+import random, time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Finance.allocation import allocate, allocate_batch, allocate_iterative
+
+PRIORITIES = [100, 100, 90, 75, 50, 30, 20, 10, 5, 1, 0]
+
+class Command(BaseCommand):
+    help = "Compare the fee allocation engine with the original iterative loop over randomized fee structures"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cases", type=int, default=2000, help="Number of random receipts to allocate")
+        parser.add_argument("--max-voteheads", type=int, default=12, help="Largest number of voteheads per structure")
+        parser.add_argument("--seed", type=int, default=2025, help="Random seed, so runs are repeatable")
+
+    def make_cases(self, cases, max_voteheads, rng):
+        corpus = []
+        for _ in range(cases):
+            distribution = {}
+            for votehead in range(rng.randint(1, max_voteheads)):
+                balance = Decimal(rng.choice([rng.randint(1, 500) * 100, rng.randint(1, 5_000_000)])) / 100
+                distribution[votehead] = (balance, rng.choice(PRIORITIES))
+
+            total = sum(balance for balance, _ in distribution.values())
+            amount = (total * Decimal(rng.choice(["0.001", "0.01", "0.1", "0.3", "0.5", "0.9", "1.1"]))).quantize(Decimal("0.01"))
+            corpus.append((amount, distribution))
+        return corpus
+
+    def timed(self, allocator, corpus):
+        started = time.perf_counter()
+        results = [allocator(amount, distribution) for amount, distribution in corpus]
+        return results, time.perf_counter() - started
+
+    def handle(self, *args, **options):
+        corpus = self.make_cases(options["cases"], options["max_voteheads"], random.Random(options["seed"]))
+
+        expected, iterative_time = self.timed(allocate_iterative, corpus)
+        results, engine_time = self.timed(allocate, corpus)
+
+        started = time.perf_counter()
+        batched = allocate_batch(corpus)
+        batch_time = time.perf_counter() - started
+
+        mismatches = [index for index, result in enumerate(results) if result != expected[index]]
+        mismatches += [index for index, result in enumerate(batched) if result != expected[index]]
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} allocation(s) differ from the iterative loop, first at case {mismatches[0]}")
+
+        self.stdout.write(f"Cases:      {len(corpus)}")
+        self.stdout.write(f"Iterative:  {iterative_time:.3f}s")
+        self.stdout.write(f"Engine:     {engine_time:.3f}s ({iterative_time / max(engine_time, 1e-9):.1f}x)")
+        self.stdout.write(f"Batch:      {batch_time:.3f}s")
+        self.stdout.write(self.style.SUCCESS("All allocations match the iterative loop"))
@@ -0,0 +1,57 @@
+import asyncio, time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async #type: ignore
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Finance.application import initiate_stk_push, get_mpesa_access_token
+from Finance.configs import api_settings
+from Finance.payments import stk_push_executor
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent STK push initiations per worker between the sync view path (one request per "
+        "worker thread) and the async view path (one event loop). Run it against `fake_daraja --delay`, "
+        "never against Safaricom"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=40, help="STK pushes started at once")
+        parser.add_argument("--threads", type=int, default=1, help="Request threads of the sync worker")
+        parser.add_argument("--phone", default="0712345678")
+
+    def push_args(self, phone, number) -> dict:
+        return {
+            "phone_number": phone,
+            "amount": 1,
+            "paybill": api_settings.MPESA_SHORTCODE,
+            "account_reference": f"BENCH{number}",
+            "transaction_desc": "Benchmark",
+        }
+
+    def run_sync(self, count, threads, phone):
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            return list(executor.map(lambda number: initiate_stk_push(**self.push_args(phone, number)), range(count)))
+
+    async def run_async(self, count, phone):
+        push = sync_to_async(initiate_stk_push, thread_sensitive=False, executor=stk_push_executor)
+        return await asyncio.gather(*(push(**self.push_args(phone, number)) for number in range(count)))
+
+    def report(self, label, started, responses):
+        elapsed = time.perf_counter() - started
+        accepted = sum(1 for response in responses if response.get("ResponseCode") == "0")
+        self.stdout.write(f"{label:<28} {elapsed:8.2f}s  {len(responses) / elapsed:8.1f} pushes/s  {accepted}/{len(responses)} accepted")
+
+    def handle(self, *args, **options):
+        if "safaricom.co.ke" in api_settings.SAFARICOM_API:
+            raise CommandError("SAFARICOM_API points at Safaricom; start `manage.py fake_daraja` and point it there")
+        if not get_mpesa_access_token():
+            raise CommandError(f"Could not get an access token from {api_settings.SAFARICOM_API}")
+
+        count, threads = options["requests"], max(options["threads"], 1)
+        self.stdout.write(f"{count} concurrent STK pushes against {api_settings.SAFARICOM_API}")
+
+        started = time.perf_counter()
+        self.report(f"sync, {threads} thread(s)", started, self.run_sync(count, threads, options["phone"]))
+
+        started = time.perf_counter()
+        self.report("async, one event loop", started, asyncio.run(self.run_async(count, options["phone"])))
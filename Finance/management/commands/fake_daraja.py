@@ -0,0 +1,87 @@
+import itertools, json, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.core.management.base import BaseCommand #type: ignore
+
+class FakeDarajaHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Daraja calls the Finance app makes: OAuth, STK push and STK query.
+    Every response waits `server.delay` seconds; `server.fail_every` turns every Nth call into a 503.
+    """
+    counter = itertools.count(1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def should_fail(self, number):
+        return self.server.fail_every and number % self.server.fail_every == 0
+
+    def do_GET(self):
+        number = next(self.counter)
+        time.sleep(self.server.delay)
+
+        if self.path.startswith("/oauth/v1/generate"):
+            if self.should_fail(number):
+                return self.reply(503, {"errorMessage": "Service unavailable"})
+            return self.reply(200, {"access_token": f"fake-token-{number}", "expires_in": "3599"})
+        self.reply(404, {"errorMessage": "Not found"})
+
+    def do_POST(self):
+        number = next(self.counter)
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.server.delay)
+
+        if self.should_fail(number):
+            return self.reply(503, {"errorMessage": "Service unavailable"})
+        if not str(self.headers.get("Authorization", "")).startswith("Bearer fake-token-"):
+            return self.reply(401, {"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+
+        if self.path == "/mpesa/stkpush/v1/processrequest":
+            return self.reply(200, {
+                "MerchantRequestID": f"FAKE-M-{number}",
+                "CheckoutRequestID": f"ws_CO_FAKE_{number}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            })
+        if self.path == "/mpesa/stkpushquery/v1/query":
+            return self.reply(200, {
+                "ResponseCode": "0",
+                "MerchantRequestID": f"FAKE-M-{number}",
+                "CheckoutRequestID": payload.get("CheckoutRequestID"),
+                "ResultCode": "0",
+                "ResultDesc": "The service request is processed successfully.",
+            })
+        self.reply(404, {"errorMessage": "Not found"})
+
+class Command(BaseCommand):
+    help = "Run a local fake Safaricom Daraja API for development and load testing (point SAFARICOM_API at it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--delay", type=float, default=0.0, help="Seconds every response is held back, to simulate a slow upstream")
+        parser.add_argument("--fail-every", type=int, default=0, help="Answer every Nth call with a 503")
+        parser.add_argument("--verbose-requests", action="store_true", help="Log each request")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), FakeDarajaHandler)
+        server.delay = options["delay"]
+        server.fail_every = options["fail_every"]
+        server.verbose = options["verbose_requests"]
+
+        self.stdout.write(self.style.SUCCESS(f"Fake Daraja listening on http://127.0.0.1:{options['port']} (delay {server.delay}s)"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,88 @@
+import random, threading, time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests #type: ignore
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Finance.models import PaymentCallback
+
+CALLBACK_PATHS = {
+    "mpesa-c2b": "/api/payments/stk-callback/",
+    "equity": "/api/equity/payment-callback/",
+    "bank": "/bank/payment/webhook/",
+}
+
+class Command(BaseCommand):
+    help = (
+        "Fire duplicated payment callbacks at a running server at a fixed rate, the way provider retry "
+        "storms arrive, and check each transaction reached the inbox exactly once. Never point it at production"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the server under test")
+        parser.add_argument("--source", choices=list(CALLBACK_PATHS), default="equity")
+        parser.add_argument("--rate", type=int, default=1000, help="Callbacks per second")
+        parser.add_argument("--seconds", type=int, default=10)
+        parser.add_argument("--unique", type=int, default=200, help="Distinct transactions; the rest are duplicates")
+        parser.add_argument("--regno", default="LOADTEST", help="Admission number the payments are made to")
+        parser.add_argument("--token", help="Bearer token, for the authenticated M-Pesa endpoint")
+        parser.add_argument("--threads", type=int, default=64)
+
+    def payload(self, source, trans_id, regno) -> dict:
+        if source == "mpesa-c2b":
+            return {"TransID": trans_id, "TransAmount": "10", "BillRefNumber": regno, "MSISDN": "254700000000", "FirstName": "Load"}
+        if source == "bank":
+            return {"trans_id": trans_id, "amount": "10", "reference_number": regno, "account_number": "0", "bank_name": "Bank"}
+        return {"transaction_id": trans_id, "amount": "10", "reference": regno, "sender_name": "Load", "sender_account": "0"}
+
+    def handle(self, *args, **options):
+        source, rate, seconds = options["source"], options["rate"], options["seconds"]
+        url = options["url"].rstrip("/") + CALLBACK_PATHS[source]
+        if "localhost" not in url and "127.0.0.1" not in url:
+            raise CommandError("Only run this against a local server")
+
+        run = f"LT{int(time.time())}"
+        trans_ids = [f"{run}-{number}" for number in range(options["unique"])]
+        headers = {"Authorization": f"Bearer {options['token']}"} if options["token"] else {}
+        local = threading.local()
+        statuses, latencies = Counter(), []
+        lock = threading.Lock()
+
+        def fire(trans_id):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                status = local.session.post(url, json=self.payload(source, trans_id, options["regno"]), headers=headers, timeout=30).status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            with lock:
+                statuses[status] += 1
+                latencies.append(time.perf_counter() - started)
+
+        self.stdout.write(f"{rate}/s for {seconds}s at {url}, {len(trans_ids)} distinct transactions")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["threads"]) as executor:
+            for second in range(seconds):
+                tick = started + second
+                for number in range(rate):
+                    # Spread each second's callbacks evenly
+                    delay = tick + number / rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(fire, random.choice(trans_ids))
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        sent = len(latencies)
+        self.stdout.write(
+            f"Sent {sent} callbacks in {elapsed:.1f}s ({sent / elapsed:.0f}/s); "
+            f"p50 {latencies[sent // 2] * 1000:.0f}ms, p99 {latencies[int(sent * 0.99)] * 1000:.0f}ms"
+        )
+        self.stdout.write(f"Responses: {dict(statuses)}")
+
+        stored = PaymentCallback.objects.filter(source=source, trans_id__startswith=f"{run}-").count()
+        expected = len(trans_ids)
+        style = self.style.SUCCESS if stored <= expected else self.style.ERROR
+        self.stdout.write(style(f"Inbox holds {stored} callback(s) for this run; at most {expected} expected"))
@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand #type: ignore
+
+from Finance.balances import rebuild_balances
+
+class Command(BaseCommand):
+    help = "Rebuild the StudentFeeBalance projection from invoice, receipt and fee status history"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk insert")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = rebuild_balances(batch_size=options["batch_size"])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} fee balance(s) in {elapsed:.2f}s"))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Finance.rollups import rebuild_rollups, verify_rollups
+
+class Command(BaseCommand):
+    help = "Backfill the FeeRollup trend table from invoices and receipts, or check it against them with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per bulk insert")
+        parser.add_argument("--verify", action="store_true", help="Only compare the table with the raw ledger totals")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+
+        if options["verify"]:
+            mismatches = verify_rollups()
+            for (year, month, term_id, course_id), stored, expected in mismatches[:50]:
+                self.stdout.write(self.style.WARNING(
+                    f"{year}-{month:02d} term {term_id} course {course_id}: "
+                    f"stored invoiced/received {stored[0]}/{stored[1]}, ledger {expected[0]}/{expected[1]}"
+                ))
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} rollup(s) differ from the ledger; run rebuild_fee_rollups")
+            self.stdout.write(self.style.SUCCESS(f"Fee rollups match the ledger ({time.monotonic() - started:.2f}s)"))
+            return
+
+        count = rebuild_rollups(batch_size=options["batch_size"])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} fee rollup(s) in {elapsed:.2f}s"))
@@ -0,0 +1,62 @@
+import time
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Core.models import Term
+from Finance.reconciliation import reconcile
+
+class Command(BaseCommand):
+    help = (
+        "Check that receipts, receipt allocations, votehead transactions and invoice totals agree with "
+        "the allocation rules, a chunk of students at a time; --repair rewrites the rows that do not"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--term", type=int, help="Only check receipts and invoices of this term id")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Students loaded and checked at a time")
+        parser.add_argument("--repair", action="store_true", help="Fix discrepancies with bulk updates")
+        parser.add_argument("--show", type=int, default=20, help="Discrepancies to print")
+
+    def handle(self, *args, **options):
+        term_id = options["term"]
+        if term_id and not Term.objects.filter(id=term_id).exists():
+            raise CommandError(f"Term {term_id} does not exist")
+
+        started = time.monotonic()
+
+        def progress(report):
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f"  {report.students} students, {report.rows} rows, {report.total} discrepancies "
+                f"({report.rows / elapsed:.0f} rows/s)"
+            )
+
+        report = reconcile(
+            term_id = term_id,
+            chunk_size = max(options["chunk_size"], 1),
+            repair = options["repair"],
+            keep = options["show"],
+            progress = progress if options["verbosity"] > 1 else None,
+        )
+        elapsed = time.monotonic() - started
+
+        for discrepancy in report.discrepancies:
+            self.stdout.write(self.style.WARNING(str(discrepancy)))
+        if report.total > len(report.discrepancies):
+            self.stdout.write(f"... and {report.total - len(report.discrepancies)} more")
+
+        summary = ", ".join(f"{kind} {total}" for kind, total in sorted(report.counts.items())) or "none"
+        self.stdout.write(f"Discrepancies: {summary}")
+        if options["repair"]:
+            repaired = ", ".join(f"{kind} {total}" for kind, total in sorted(report.repaired.items())) or "nothing"
+            self.stdout.write(f"Repaired: {repaired}")
+            waiting = report.counts.get("unallocated_receipt", 0) - report.repaired.get("unallocated_receipt", 0)
+            if report.repaired.get("unallocated_receipt"):
+                self.stdout.write("Never-allocated receipts were queued for allocation.")
+            if waiting > 0:
+                self.stdout.write(f"{waiting} never-allocated receipt(s) already have an allocation job waiting to run.")
+
+        rate = report.rows / elapsed if elapsed else 0
+        style = self.style.SUCCESS if not report.total or options["repair"] else self.style.ERROR
+        self.stdout.write(style(
+            f"Checked {report.students} students and {report.rows} ledger rows in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        ))
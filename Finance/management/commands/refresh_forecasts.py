@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand #type: ignore
+
+from Core.jobs import enqueue
+from Core.models import Forecast
+from Students.forecasting import refresh_applications_forecast
+from Finance.forecasting import refresh_fee_forecast
+
+class Command(BaseCommand):
+    help = "Recompute the stored applications and fee collection forecasts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--enqueue", action="store_true", help="Queue the refresh for the run_jobs worker instead")
+
+    def handle(self, *args, **options):
+        for refresh in (refresh_applications_forecast, refresh_fee_forecast):
+            if options["enqueue"]:
+                job = enqueue(refresh, max_attempts=1)
+                self.stdout.write(f"Queued {job.name} (job {job.id})")
+                continue
+
+            started = time.monotonic()
+            refresh()
+            self.stdout.write(self.style.SUCCESS(f"Ran {refresh.__name__} in {time.monotonic() - started:.2f}s"))
+
+        if not options["enqueue"]:
+            for forecast in Forecast.objects.order_by("name"):
+                self.stdout.write(f"{forecast.name}: version {forecast.version}, computed in {forecast.compute_time:.3f}s")
@@ -0,0 +1,50 @@
+import json, time
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Finance.callbacks import CALLBACK_PARSERS, process_inbox, receive_callback, requeue_callbacks
+
+class Command(BaseCommand):
+    help = (
+        "Process the payment callback inbox now. Optionally put Failed, Unmatched or stuck Processing "
+        "callbacks back first, or re-ingest raw provider payloads from a JSON / NDJSON file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", action="append", default=[], choices=["Failed", "Unmatched", "Processing"],
+                            help="Requeue callbacks in this state (repeatable)")
+        parser.add_argument("--id", action="append", type=int, default=[], help="Requeue this callback (repeatable)")
+        parser.add_argument("--file", help="Payloads to ingest: a JSON list or one JSON object per line")
+        parser.add_argument("--source", choices=list(CALLBACK_PARSERS), help="Provider of the payloads in --file")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def read_payloads(self, path):
+        with open(path) as f:
+            text = f.read().strip()
+        if text.startswith("["):
+            return json.loads(text)
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            if not options["source"]:
+                raise CommandError("--file needs --source")
+            created = duplicates = 0
+            for payload in self.read_payloads(options["file"]):
+                try:
+                    _, new = receive_callback(options["source"], payload)
+                except ValueError as e:
+                    self.stdout.write(self.style.WARNING(f"Skipped payload: {e}"))
+                    continue
+                created += new
+                duplicates += not new
+            self.stdout.write(f"Ingested {created} callback(s), {duplicates} already in the inbox")
+
+        if options["status"] or options["id"]:
+            requeued = requeue_callbacks(statuses=options["status"], ids=options["id"])
+            self.stdout.write(f"Requeued {requeued} callback(s)")
+
+        started = time.monotonic()
+        counts = process_inbox(batch_size=options["batch_size"])
+        elapsed = time.monotonic() - started
+        summary = ", ".join(f"{count} {status.lower()}" for status, count in sorted(counts.items())) or "nothing to do"
+        self.stdout.write(self.style.SUCCESS(f"Processed the inbox in {elapsed:.2f}s: {summary}"))
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand, CommandError #type: ignore
+
+from Core.models import Institution, Term
+from Finance.invoicing import BATCH_SIZE, invoice_term_rollover, start_term_rollover
+
+class Command(BaseCommand):
+    help = "Invoice every billable student for a new term against their course/module fee structure"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--term", type=int, help="Term id (default: the institution's current term)")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Students invoiced per transaction")
+        parser.add_argument("--enqueue", action="store_true", help="Queue the rollover for the run_jobs worker instead")
+
+    def handle(self, *args, **options):
+        if options["term"]:
+            term = Term.objects.filter(id=options["term"]).first()
+        else:
+            institution = Institution.objects.first()
+            term = Term.objects.filter(name=institution.current_intake, year=institution.current_year).first() if institution else None
+        if not term:
+            raise CommandError("Term not found")
+
+        if options["enqueue"]:
+            job = start_term_rollover(term)
+            self.stdout.write(f"Rollover for {term} is {job.status} (job {job.id})")
+            return
+
+        started = time.monotonic()
+        progress = invoice_term_rollover(term.id, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Invoiced {progress['invoiced']} of {progress['total']} student(s) for {term} in {time.monotonic() - started:.2f}s "
+            f"({progress['already_invoiced']} already invoiced, {progress['no_structure']} without a fee structure, "
+            f"{progress['groups']} course/module group(s))"
+        ))
@@ -0,0 +1,30 @@
+import resource
+from django.core.mail import get_connection #type: ignore
+from django.core.management.base import BaseCommand #type: ignore
+
+from Finance.reminders import SEND_BATCH, send_plan_reminders
+
+class Command(BaseCommand):
+    help = "Send the fee reminders of every due payment plan and schedule their next reminder"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=SEND_BATCH, help="Messages handed to the mail connection at a time")
+        parser.add_argument("--backend", help="Email backend to send through instead of EMAIL_BACKEND, e.g. django.core.mail.backends.console.EmailBackend")
+        parser.add_argument("--file-path", help="Directory for django.core.mail.backends.filebased.EmailBackend")
+        parser.add_argument("--dry-run", action="store_true", help="Render the reminders without sending them or moving the plans on")
+
+    def handle(self, *args, **options):
+        connection = None
+        if options["backend"] or options["file_path"]:
+            backend = options["backend"] or "django.core.mail.backends.filebased.EmailBackend"
+            kwargs = {"file_path": options["file_path"]} if options["file_path"] else {}
+            connection = get_connection(backend, **kwargs)
+
+        stats = send_plan_reminders(connection=connection, batch_size=options["batch_size"], dry_run=options["dry_run"])
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['plans']} plan(s) due: {stats['sent']} reminder(s) sent, {stats['failed']} failed, "
+            f"{stats['deferred']} plan(s) left due to retry "
+            f"in {stats['seconds']:.2f}s ({stats['rate']:.1f}/s, peak memory {peak:.0f}MB)"
+        ))
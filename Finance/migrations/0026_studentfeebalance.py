@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:29
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0019_unit_description_unit_objectives_unit_requirements_and_more'),
+        ('Finance', '0025_alter_feeparticular_unique_together'),
+        ('Students', '0005_alter_student_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentFeeBalance',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('invoiced', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('arrears', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('status', models.CharField(choices=[('Overpaid', 'Overpaid'), ('Cleared', 'Cleared'), ('Not-Cleared', 'Not-Cleared')], default='Cleared', max_length=25)),
+                ('last_event', models.CharField(blank=True, max_length=50, null=True)),
+                ('is_latest', models.BooleanField(default=False)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fee_balances', to='Students.student')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Core.term')),
+            ],
+            options={
+                'verbose_name': 'Student Fee Balance',
+                'verbose_name_plural': 'Student Fee Balances',
+                'indexes': [models.Index(fields=['is_latest', 'status'], name='Finance_stu_is_late_e29152_idx')],
+                'unique_together': {('student', 'term')},
+            },
+        ),
+    ]
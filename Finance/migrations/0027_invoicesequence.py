@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0026_studentfeebalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.CharField(max_length=10, unique=True)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Invoice Sequence',
+                'verbose_name_plural': 'Invoice Sequences',
+            },
+        ),
+    ]
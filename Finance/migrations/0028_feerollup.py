@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0020_job'),
+        ('Finance', '0027_invoicesequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('invoiced', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('received', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Core.course')),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Core.department')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Core.term')),
+            ],
+            options={
+                'verbose_name': 'Fee Rollup',
+                'verbose_name_plural': 'Fee Rollups',
+                'indexes': [models.Index(fields=['year', 'month'], name='Finance_fee_year_755429_idx')],
+                'unique_together': {('year', 'month', 'term', 'course')},
+            },
+        ),
+    ]
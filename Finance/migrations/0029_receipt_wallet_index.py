@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0028_feerollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['wallet', 'created_at'], name='Finance_rec_wallet__ff3eb7_idx'),
+        ),
+    ]
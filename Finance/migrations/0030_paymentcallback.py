@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0029_receipt_wallet_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('mpesa-c2b', 'M-Pesa C2B'), ('equity', 'Equity Bank'), ('bank', 'Bank Webhook')], max_length=20)),
+                ('trans_id', models.CharField(max_length=100, verbose_name='Transaction ID')),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('Received', 'Received'), ('Processing', 'Processing'), ('Processed', 'Processed'), ('Duplicate', 'Duplicate'), ('Unmatched', 'Unmatched'), ('Failed', 'Failed')], default='Received', max_length=20)),
+                ('batch', models.CharField(blank=True, max_length=32, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempt', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Finance.paymentattempt')),
+            ],
+            options={
+                'verbose_name': 'Payment Callback',
+                'verbose_name_plural': 'Payment Callbacks',
+                'indexes': [models.Index(fields=['status', 'id'], name='Finance_pay_status_571135_idx')],
+                'unique_together': {('source', 'trans_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:42
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0030_paymentcallback'),
+        ('Students', '0005_alter_student_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeAging',
+            fields=[
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_deleted', models.BooleanField(default=False)),
+                ('outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('oldest_due', models.DateTimeField(blank=True, null=True)),
+                ('current', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='0-30 Days')),
+                ('days_31_60', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='31-60 Days')),
+                ('days_61_90', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='61-90 Days')),
+                ('days_over_90', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Over 90 Days')),
+                ('open_items', models.JSONField(blank=True, default=list)),
+                ('aged_on', models.DateField(blank=True, null=True)),
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fee_aging', to='Students.student')),
+            ],
+            options={
+                'verbose_name': 'Fee Aging',
+                'verbose_name_plural': 'Fee Aging',
+                'indexes': [models.Index(fields=['outstanding'], name='Finance_fee_outstan_242592_idx'), models.Index(fields=['oldest_due'], name='Finance_fee_oldest__84f4c8_idx'), models.Index(fields=['days_over_90'], name='Finance_fee_days_ov_670071_idx')],
+            },
+        ),
+    ]
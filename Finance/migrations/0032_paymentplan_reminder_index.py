@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0031_feeaging'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentplan',
+            index=models.Index(fields=['datenextreminder'], name='Finance_pay_datenex_b86d20_idx'),
+        ),
+    ]
@@ -2,10 +2,11 @@
 from __future__ import unicode_literals
 
 import uuid
+from django.conf import settings  # type: ignore
 from django.db import models  # type: ignore
 from django.utils import timezone  # type: ignore
 
-from Core.models import Course, Sponsor, Module, Term
+from Core.models import Course, Department, Sponsor, Module, Term
 from Students.models import Student
 
 FEE_STATUS = [
@@ -23,6 +24,21 @@ PAYMENT_PLAN_CHOICES = [
     ('Annually', 'Annually'),
 ]
 
+CALLBACK_SOURCES = [
+    ("mpesa-c2b", "M-Pesa C2B"),
+    ("equity", "Equity Bank"),
+    ("bank", "Bank Webhook"),
+]
+
+CALLBACK_STATUS = [
+    ("Received", "Received"),
+    ("Processing", "Processing"),
+    ("Processed", "Processed"),
+    ("Duplicate", "Duplicate"),
+    ("Unmatched", "Unmatched"),
+    ("Failed", "Failed"),
+]
+
 # ==========================================================================================#
 # ========================                FINANCE MODULE           =========================#
 
@@ -131,7 +147,18 @@ class Invoice(BaseModel):
 
     def get_balance_due(self):
         return self.amount - self.paid_amount
-  
+
+class InvoiceSequence(models.Model):
+    year = models.CharField(max_length=10, unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.year} #{self.last_value}"
+
+    class Meta:
+        verbose_name = "Invoice Sequence"
+        verbose_name_plural = "Invoice Sequences"
+
 class FeeStatus(BaseModel):
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     term = models.ForeignKey(Term, verbose_name='Academic Year', on_delete=models.CASCADE)
@@ -146,7 +173,87 @@ class FeeStatus(BaseModel):
     class Meta:
         verbose_name = "Fee Status"
         verbose_name_plural = "Fee Statuses"
-  
+
+class StudentFeeBalance(BaseModel):
+    """
+    Materialized per-student, per-term fee position. Maintained by the Finance signals
+    whenever an Invoice, Receipt or FeeStatus is written; rebuild with `rebuild_fee_balances`.
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='fee_balances')
+    term = models.ForeignKey(Term, on_delete=models.CASCADE)
+    invoiced = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    arrears = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    status = models.CharField(choices=FEE_STATUS, max_length=25, default="Cleared")
+    last_event = models.CharField(max_length=50, blank=True, null=True)
+    is_latest = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.student} {self.term} {self.status} {self.arrears}"
+
+    class Meta:
+        verbose_name = "Student Fee Balance"
+        verbose_name_plural = "Student Fee Balances"
+        unique_together = ("student", "term")
+        indexes = [
+            models.Index(fields=["is_latest", "status"]),
+        ]
+
+class FeeAging(BaseModel):
+    """
+    How long each student's outstanding fees have been owed. Payments settle the oldest
+    invoices first, so the debt is made up of the newest invoices; `open_items` holds those
+    portions ([date, amount], oldest first) and the bucket columns their ages as of `aged_on`.
+    Maintained with StudentFeeBalance, re-aged daily and rebuilt by `age_fee_arrears`.
+    """
+    student = models.OneToOneField(Student, on_delete=models.CASCADE, related_name='fee_aging')
+    outstanding = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    oldest_due = models.DateTimeField(blank=True, null=True)
+    current = models.DecimalField(verbose_name='0-30 Days', max_digits=14, decimal_places=2, default=0)
+    days_31_60 = models.DecimalField(verbose_name='31-60 Days', max_digits=14, decimal_places=2, default=0)
+    days_61_90 = models.DecimalField(verbose_name='61-90 Days', max_digits=14, decimal_places=2, default=0)
+    days_over_90 = models.DecimalField(verbose_name='Over 90 Days', max_digits=14, decimal_places=2, default=0)
+    open_items = models.JSONField(default=list, blank=True)
+    aged_on = models.DateField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.student} owes {self.outstanding}"
+
+    class Meta:
+        verbose_name = "Fee Aging"
+        verbose_name_plural = "Fee Aging"
+        indexes = [
+            models.Index(fields=["outstanding"]),
+            models.Index(fields=["oldest_due"]),
+            models.Index(fields=["days_over_90"]),
+        ]
+
+class FeeRollup(models.Model):
+    """
+    Invoiced and received totals per calendar month, term and course, for the fee trend
+    reports. Invoices count in the month they were raised, receipts in their date of payment.
+    Maintained by the Finance signals; rebuild with `rebuild_fee_rollups`.
+    """
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    term = models.ForeignKey(Term, on_delete=models.CASCADE)
+    course = models.ForeignKey(Course, on_delete=models.CASCADE)
+    department = models.ForeignKey(Department, on_delete=models.CASCADE)
+    invoiced = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    received = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.year}-{self.month:02d} {self.course} {self.term}"
+
+    class Meta:
+        verbose_name = "Fee Rollup"
+        verbose_name_plural = "Fee Rollups"
+        unique_together = ("year", "month", "term", "course")
+        indexes = [
+            models.Index(fields=["year", "month"]),
+        ]
+
 class Receipt(BaseModel):
     trans_id = models.CharField(max_length=50)
     student = models.ForeignKey(Student, on_delete=models.CASCADE, verbose_name='Student')
@@ -163,6 +270,9 @@ class Receipt(BaseModel):
     class Meta:
         verbose_name = "Receipt"
         verbose_name_plural = "Receipts"
+        indexes = [
+            models.Index(fields=["wallet", "created_at"]),
+        ]
 
 class ReceiptAllocation(models.Model):
     receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE)
@@ -191,6 +301,7 @@ class PaymentAttempt(BaseModel):
     payer_name = models.CharField(max_length=100, null=True, blank=True)
     account_number = models.CharField(max_length=20, null=True, blank=True)
     student = models.ForeignKey(Student, on_delete=models.SET_NULL, null=True)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='payment_attempts')
     status = models.CharField(max_length=20, choices=[
         ('Pending', 'Pending'), ('Success', 'Success'), ('Failed', 'Failed')
     ], default='Pending')
@@ -203,6 +314,33 @@ class PaymentAttempt(BaseModel):
         verbose_name = "Payment Attempt"
         verbose_name_plural = "Payment Attempts"
   
+class PaymentCallback(models.Model):
+    """
+    Raw payment notification from M-Pesa or a bank, stored as received before anything else
+    happens to it. Rows are never edited apart from their processing fields; the unique
+    (source, trans_id) pair makes provider retries no-ops.
+    """
+    source = models.CharField(choices=CALLBACK_SOURCES, max_length=20)
+    trans_id = models.CharField(verbose_name='Transaction ID', max_length=100)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(choices=CALLBACK_STATUS, max_length=20, default="Received")
+    batch = models.CharField(max_length=32, blank=True, null=True) # claim token of the run processing it
+    attempt = models.ForeignKey(PaymentAttempt, on_delete=models.SET_NULL, blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.source} {self.trans_id} ({self.status})"
+
+    class Meta:
+        verbose_name = "Payment Callback"
+        verbose_name_plural = "Payment Callbacks"
+        unique_together = ("source", "trans_id")
+        indexes = [
+            models.Index(fields=["status", "id"]),
+        ]
+
 class PaymentPlan(BaseModel):
     sponsor = models.OneToOneField(Sponsor, on_delete=models.CASCADE)
     plan = models.CharField(choices=PAYMENT_PLAN_CHOICES, max_length=20)
@@ -215,4 +353,7 @@ class PaymentPlan(BaseModel):
     class Meta:
         verbose_name = "Fee Payment Plan"
         verbose_name_plural = "Fee Payment Plans"
+        indexes = [
+            models.Index(fields=["datenextreminder"]),
+        ]
   
\ No newline at end of file
@@ -0,0 +1,125 @@
+import hashlib, threading, time
+from datetime import timedelta
+
+import requests
+from requests.auth import HTTPBasicAuth
+from django.utils import timezone #type: ignore
+
+from .configs import api_settings
+from .models import AccessToken
+from .gateway import daraja
+
+# Safaricom tokens live for an hour; refresh a little early
+DEFAULT_TTL = 50 * 60
+EXPIRY_MARGIN = 60
+# After a failed fetch, callers that were waiting on it get None instead of each retrying
+FAILURE_BACKOFF = 5
+
+def get_credentials_key(consumer_key, consumer_secret) -> str:
+    """
+    Stable, non-reversible key for a consumer key/secret pair. Fits AccessToken.account_number.
+    """
+    return hashlib.sha256(f"{consumer_key}:{consumer_secret}".encode()).hexdigest()[:20]
+
+class TokenCache:
+    """
+    Process-wide cache of M-Pesa OAuth tokens keyed by consumer credentials.
+
+    Each key has its own lock, so when a token expires only the first caller fetches a new one
+    and concurrent callers wait for it (single flight). The AccessToken table is only read when
+    this process has no token, so other workers' tokens are reused.
+    """
+
+    def __init__(self):
+        self.tokens = {}    # key -> (token, expires_at)
+        self.failures = {}  # key -> monotonic time of the last failed fetch
+        self.locks = {}
+        self.locks_guard = threading.Lock()
+
+    def get_lock(self, key) -> threading.Lock:
+        with self.locks_guard:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def get_cached(self, key):
+        token, expires_at = self.tokens.get(key, (None, 0))
+        if token and time.monotonic() < expires_at:
+            return token
+        return None
+
+    def get(self, consumer_key=None, consumer_secret=None):
+        consumer_key = consumer_key or api_settings.MPESA_CONSUMER_KEY
+        consumer_secret = consumer_secret or api_settings.MPESA_CONSUMER_SECRET
+        key = get_credentials_key(consumer_key, consumer_secret)
+
+        token = self.get_cached(key)
+        if token:
+            return token
+
+        with self.get_lock(key):
+            # Another caller may have refreshed it while we waited
+            token = self.get_cached(key)
+            if token:
+                return token
+
+            failed_at = self.failures.get(key)
+            if failed_at and time.monotonic() - failed_at < FAILURE_BACKOFF:
+                return None
+
+            token, ttl = self.load_stored(key)
+            if not token:
+                token, ttl = self.fetch(consumer_key, consumer_secret)
+                if not token:
+                    self.failures[key] = time.monotonic()
+                    return None
+                self.store(key, token)
+
+            self.failures.pop(key, None)
+            self.tokens[key] = (token, time.monotonic() + ttl - EXPIRY_MARGIN)
+            return token
+
+    def invalidate(self, consumer_key=None, consumer_secret=None) -> None:
+        """
+        Drops a token the API rejected, in memory and in the table.
+        """
+        key = get_credentials_key(
+            consumer_key or api_settings.MPESA_CONSUMER_KEY,
+            consumer_secret or api_settings.MPESA_CONSUMER_SECRET,
+        )
+        self.tokens.pop(key, None)
+        AccessToken.objects.filter(account_number=key).delete()
+
+    def load_stored(self, key):
+        stored = AccessToken.objects.filter(
+            account_number = key,
+            created_at__gt = timezone.now() - timedelta(seconds=DEFAULT_TTL),
+        ).order_by("-created_at").first()
+        if not stored:
+            return None, 0
+
+        age = (timezone.now() - stored.created_at).total_seconds()
+        return stored.token, DEFAULT_TTL - age + EXPIRY_MARGIN
+
+    def store(self, key, token) -> None:
+        AccessToken.objects.filter(account_number=key).delete()
+        AccessToken.objects.create(account_number=key, token=token)
+
+    def fetch(self, consumer_key, consumer_secret):
+        try:
+            response = daraja.get(
+                "/oauth/v1/generate?grant_type=client_credentials",
+                endpoint = "oauth",
+                auth = HTTPBasicAuth(consumer_key, consumer_secret),
+            )
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print("Error fetching M-Pesa access token:", str(e))
+            return None, 0
+
+        try:
+            ttl = int(data.get("expires_in", DEFAULT_TTL))
+        except (TypeError, ValueError):
+            ttl = DEFAULT_TTL
+        return data.get("access_token"), ttl
+
+token_cache = TokenCache()
@@ -0,0 +1,106 @@
+from concurrent.futures import ThreadPoolExecutor
+from channels.layers import get_channel_layer #type: ignore
+from asgiref.sync import async_to_sync #type: ignore
+
+from Core.jobs import enqueue
+from Core.application import is_admin_user
+
+from .models import PaymentAttempt
+from .application import create_receipt, process_fee_allocation
+from .gateway import daraja
+
+# Threads the async views hand Safaricom round trips to; one per pooled Daraja connection
+stk_push_executor = ThreadPoolExecutor(max_workers=daraja.pool_size, thread_name_prefix="stk-push")
+
+STK_FAILURE_MESSAGES = {
+    "1": "Insufficient funds.",
+    "1032": "User cancelled the payment.",
+    "1037": "User unreachable.",
+    "2001": "Wrong M-Pesa PIN entered."
+}
+
+def get_payment_group(checkout_request_id) -> str:
+    return f"payment_{checkout_request_id}"
+
+def get_payment_channel(checkout_request_id) -> str:
+    """
+    Websocket path a client subscribes to for the result of an STK push, with its access
+    token as `?token=`. Needs an ASGI server, and a Redis channel layer once the callback
+    and the socket can land on different processes.
+    """
+    return f"ws/payments/{checkout_request_id}/"
+
+def can_follow_attempt(user, attempt: PaymentAttempt) -> bool:
+    """
+    Whether `user` may follow the result of `attempt`: the user who requested it, or an admin.
+    """
+    if not user or not user.is_authenticated:
+        return False
+    if attempt.requested_by_id == user.id:
+        return True
+    return user.is_superuser or is_admin_user(user)
+
+def get_attempt_status(attempt: PaymentAttempt) -> dict:
+    """
+    The status payload sent to the payer, in the same shape `check_stk_status` returns.
+    """
+    if attempt.status == "Success":
+        return {
+            "success": True,
+            "status": "SUCCESS",
+            "transaction_id": attempt.ref_id,
+            "payer": attempt.student.get_full_name() if attempt.student else attempt.payer_name,
+            "amount": str(attempt.amount),
+        }
+    if attempt.status == "Failed":
+        return {"success": True, "status": "FAILED", "message": attempt.response_payload.rsplit("\n\n", 1)[-1]}
+    return {"success": True, "status": "PENDING", "message": "Waiting for the payer to confirm."}
+
+def notify_payment_status(attempt: PaymentAttempt, status: dict) -> None:
+    channel_layer = get_channel_layer()
+    if not channel_layer:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(
+            get_payment_group(attempt.checkout_request_id),
+            {"type": "payment.status", "status": status},
+        )
+    except Exception as e:
+        print(f"[ERROR]: payment status push failed: {e}")
+
+def settle_stk_result(attempt: PaymentAttempt, result_code, result_desc, trans_id=None) -> dict:
+    """
+    Records the outcome of an STK push, from the Safaricom callback or a status query, and
+    pushes it to the payer's browser. A successful attempt is only receipted once, however
+    many times its result arrives.
+
+    Returns:
+        The status payload (see `get_attempt_status`).
+    """
+    result_code = str(result_code)
+    attempt.response_payload = f"{attempt.response_payload or ''}\n\n{result_desc}"
+
+    if result_code == "0":
+        already_settled = attempt.status == "Success"
+        attempt.status = "Success"
+        attempt.ref_id = trans_id or attempt.ref_id
+        attempt.save()
+
+        if not already_settled:
+            rcpt = create_receipt(attempt.id)
+            if rcpt:
+                enqueue(process_fee_allocation, rcpt.id, key=f"fee-allocation:{rcpt.id}")
+        status = get_attempt_status(attempt)
+
+    elif result_code in STK_FAILURE_MESSAGES or attempt.status == "Failed":
+        attempt.status = "Failed"
+        attempt.save()
+        status = {"success": True, "status": "FAILED", "message": STK_FAILURE_MESSAGES.get(result_code, "Transaction failed.")}
+
+    else:
+        # Still pending
+        attempt.save()
+        return {"success": True, "status": "PENDING", "message": result_desc}
+
+    notify_payment_status(attempt, status)
+    return status
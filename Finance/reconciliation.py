@@ -0,0 +1,315 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.db import transaction #type: ignore
+
+from Core.jobs import requeue
+
+from .models import Account, FeeStatus, Invoice, Receipt, ReceiptAllocation, Transaction
+from .allocation import allocate, ZERO
+
+class LedgerInvoice:
+    """
+    An invoice as the replay sees it: the amount paid and state it should have.
+    """
+    __slots__ = ("id", "term_id", "created_at", "amount", "items", "paid", "is_cleared")
+
+    def __init__(self, id, term_id, created_at, amount):
+        self.id = id
+        self.term_id = term_id
+        self.created_at = created_at
+        self.amount = amount or ZERO
+        self.items: Dict[int, Decimal] = {}
+        self.paid = ZERO
+        self.is_cleared = False
+
+class ReconciliationReport:
+    """
+    Running totals of a reconciliation, and the first `keep` discrepancies found.
+    """
+    def __init__(self, keep=50):
+        self.keep = keep
+        self.students = 0
+        self.rows = 0
+        self.counts = defaultdict(int)
+        self.discrepancies: List[dict] = []
+        self.repaired = defaultdict(int)
+
+    def add(self, kind, **details) -> None:
+        self.counts[kind] += 1
+        if len(self.discrepancies) < self.keep:
+            self.discrepancies.append({"kind": kind, **details})
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+def get_priorities() -> Dict[int, int]:
+    """
+    {account_id: priority rank}, the same priorities `FeeManager.get_priorities` uses.
+    """
+    return dict(Account.objects.filter(priority__isnull=False).values_list("id", "priority__rank"))
+
+def iter_student_chunks(term_id=None, chunk_size=500):
+    """
+    Yields lists of student ids that have receipts (in `term_id` when given), by keyset
+    pagination so the id list is never held in full.
+    """
+    receipts = Receipt.objects.all()
+    if term_id:
+        receipts = receipts.filter(term_id=term_id)
+
+    last_id = 0
+    while True:
+        ids = list(
+            receipts.filter(student_id__gt=last_id).order_by("student_id")
+            .values_list("student_id", flat=True).distinct()[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+class Ledger:
+    """
+    The ledger of a chunk of students, loaded with one query per table as plain values.
+    """
+    def __init__(self, student_ids):
+        self.rows = 0
+        self.invoices: Dict[int, List[LedgerInvoice]] = defaultdict(list)
+        self.invoice_by_id: Dict[int, LedgerInvoice] = {}
+        self.particular_accounts: Dict[int, int] = {}
+        self.receipts = defaultdict(list)
+        self.allocated_at = {}
+        self.allocations: Dict[int, Dict[int, Decimal]] = defaultdict(dict)
+        self.transactions: Dict[int, Dict[int, Decimal]] = defaultdict(dict)
+
+        for id, student_id, term_id, created_at, amount in Invoice.objects.filter(student_id__in=student_ids).order_by(
+            "created_at", "id"
+        ).values_list("id", "student_id", "term_id", "created_at", "amount"):
+            invoice = LedgerInvoice(id, term_id, created_at, amount)
+            self.invoice_by_id[id] = invoice
+            self.invoices[student_id].append(invoice)
+            self.rows += 1
+
+        # Invoice items in the order `invoice.narration.all()` returns them
+        for invoice_id, particular_id, amount, account_id in Invoice.narration.through.objects.filter(
+            invoice_id__in=self.invoice_by_id
+        ).order_by("id").values_list("invoice_id", "feeparticular_id", "feeparticular__amount", "feeparticular__account_id"):
+            items = self.invoice_by_id[invoice_id].items
+            items[particular_id] = items.get(particular_id, ZERO) + amount
+            self.particular_accounts[particular_id] = account_id
+
+        receipt_ids = []
+        for id, student_id, term_id, trans_id, amount in Receipt.objects.filter(student_id__in=student_ids).order_by(
+            "id"
+        ).values_list("id", "student_id", "term_id", "trans_id", "amount"):
+            self.receipts[student_id].append((id, term_id, trans_id, amount))
+            receipt_ids.append(id)
+            self.rows += 1
+
+        # A receipt was allocated when its fee status was written
+        for student_id, purpose, created_at in FeeStatus.objects.filter(student_id__in=student_ids).order_by(
+            "-created_at"
+        ).values_list("student_id", "purpose", "created_at"):
+            self.allocated_at[(student_id, purpose)] = created_at
+
+        for receipt_id, invoice_id, amount in ReceiptAllocation.objects.filter(receipt_id__in=receipt_ids).values_list(
+            "receipt_id", "invoice_id", "amount"
+        ):
+            allocations = self.allocations[receipt_id]
+            allocations[invoice_id] = allocations.get(invoice_id, ZERO) + amount
+            self.rows += 1
+
+        for receipt_id, particular_id, amount in Transaction.objects.filter(receipt_id__in=receipt_ids).values_list(
+            "receipt_id", "account_id", "amount"
+        ).iterator(chunk_size=5000):
+            transactions = self.transactions[receipt_id]
+            transactions[particular_id] = transactions.get(particular_id, ZERO) + amount
+            self.rows += 1
+
+def replay_student(ledger: Ledger, student_id, priorities):
+    """
+    Re-runs `allocate_receipt` for each of the student's receipts, in the order they were
+    allocated, against in-memory invoices.
+
+    Returns:
+        ({receipt_id: {invoice_id: amount}}, {receipt_id: {particular_id: amount}}, [unallocated receipt])
+    """
+    invoices = ledger.invoices[student_id]
+    expected_allocations: Dict[int, Dict[int, Decimal]] = defaultdict(dict)
+    expected_transactions: Dict[int, Dict[int, Decimal]] = defaultdict(dict)
+    paid_by_term: Dict[int, Dict[int, Decimal]] = defaultdict(lambda: defaultdict(lambda: ZERO))
+
+    processed, unallocated = [], []
+    for receipt in ledger.receipts[student_id]:
+        at = ledger.allocated_at.get((student_id, receipt[2]))
+        if at is None:
+            unallocated.append(receipt)
+        else:
+            processed.append((at, receipt))
+    processed.sort(key=lambda item: (item[0], item[1][0]))
+
+    for at, (receipt_id, receipt_term_id, _trans_id, amount) in processed:
+        amount_arrears = amount
+        pending = [invoice for invoice in invoices if not invoice.is_cleared and invoice.created_at <= at]
+
+        for invoice in pending:
+            invoice_due = invoice.amount - invoice.paid
+            if amount_arrears <= 0:
+                break
+
+            allocation = min(invoice_due, amount_arrears)
+            allocations = expected_allocations[receipt_id]
+            allocations[invoice.id] = allocations.get(invoice.id, ZERO) + allocation
+
+            paid = paid_by_term[invoice.term_id]
+            distribution = {
+                particular_id: (expected - paid[particular_id], priorities.get(ledger.particular_accounts[particular_id], 0))
+                for particular_id, expected in invoice.items.items()
+                if paid[particular_id] < expected
+            }
+            for particular_id, allocated in allocate(amount_arrears, distribution).items():
+                if allocated <= ZERO:
+                    continue
+                transactions = expected_transactions[receipt_id]
+                transactions[particular_id] = transactions.get(particular_id, ZERO) + allocated
+                paid_by_term[receipt_term_id][particular_id] += allocated
+
+            invoice.paid += allocation
+            if invoice.paid == invoice.amount:
+                invoice.is_cleared = True
+
+            amount_arrears -= allocation
+
+    return expected_allocations, expected_transactions, unallocated
+
+def reconcile_chunk(student_ids, priorities, report: ReconciliationReport, term_id=None, repair=False) -> None:
+    ledger = Ledger(student_ids)
+    report.students += len(student_ids)
+    report.rows += ledger.rows
+
+    actual_invoices = {
+        id: (paid_amount, is_cleared, state)
+        for id, paid_amount, is_cleared, state in Invoice.objects.filter(id__in=ledger.invoice_by_id).values_list(
+            "id", "paid_amount", "is_cleared", "state"
+        )
+    }
+
+    bad_allocations, bad_transactions, bad_invoices, unallocated_receipts = {}, {}, [], []
+
+    for student_id in student_ids:
+        expected_allocations, expected_transactions, unallocated = replay_student(ledger, student_id, priorities)
+
+        unallocated_ids = set()
+        for receipt_id, receipt_term_id, trans_id, _amount in unallocated:
+            unallocated_ids.add(receipt_id)
+            if term_id and receipt_term_id != term_id:
+                continue
+            report.add("unallocated_receipt", receipt=receipt_id, trans_id=trans_id)
+            unallocated_receipts.append(receipt_id)
+
+        for receipt_id, receipt_term_id, trans_id, _amount in ledger.receipts[student_id]:
+            if receipt_id in unallocated_ids or (term_id and receipt_term_id != term_id):
+                continue
+
+            expected = expected_allocations.get(receipt_id, {})
+            actual = ledger.allocations.get(receipt_id, {})
+            if expected != actual:
+                report.add("allocation", receipt=receipt_id, trans_id=trans_id, expected=expected, actual=actual)
+                bad_allocations[receipt_id] = expected
+
+            expected = expected_transactions.get(receipt_id, {})
+            actual = ledger.transactions.get(receipt_id, {})
+            if expected != actual:
+                report.add("transaction", receipt=receipt_id, trans_id=trans_id, expected=expected, actual=actual)
+                bad_transactions[receipt_id] = expected
+
+        for invoice in ledger.invoices[student_id]:
+            if term_id and invoice.term_id != term_id:
+                continue
+            paid_amount, is_cleared, state = actual_invoices[invoice.id]
+            expected_state = "Cleared" if invoice.is_cleared else "Pending"
+            if paid_amount != invoice.paid or is_cleared != invoice.is_cleared or state != expected_state:
+                report.add(
+                    "invoice", invoice=invoice.id,
+                    expected={"paid_amount": invoice.paid, "state": expected_state},
+                    actual={"paid_amount": paid_amount, "state": state, "is_cleared": is_cleared},
+                )
+                bad_invoices.append(invoice)
+
+    if repair:
+        repair_chunk(bad_allocations, bad_transactions, bad_invoices, unallocated_receipts, report)
+
+def repair_chunk(allocation_receipts, transaction_receipts, invoices, unallocated_receipts, report: ReconciliationReport) -> None:
+    """
+    Replaces wrong allocation and transaction rows with the replayed ones and fixes invoice
+    totals, with one bulk statement per table. Receipts that were never allocated are put
+    back on the job queue instead, so their fee status is written too.
+    """
+    from .application import process_fee_allocation
+
+    with transaction.atomic():
+        if allocation_receipts:
+            ReceiptAllocation.objects.filter(receipt_id__in=allocation_receipts).delete()
+            ReceiptAllocation.objects.bulk_create([
+                ReceiptAllocation(receipt_id=receipt_id, invoice_id=invoice_id, amount=amount)
+                for receipt_id, expected in allocation_receipts.items()
+                for invoice_id, amount in expected.items()
+            ], batch_size=1000)
+            report.repaired["allocation"] += len(allocation_receipts)
+
+        if transaction_receipts:
+            Transaction.objects.filter(receipt_id__in=transaction_receipts).delete()
+            rows = []
+            for receipt_id, expected in transaction_receipts.items():
+                # Same running balance `FeeManager.apply_payment` records
+                running_balance = sum(expected.values(), ZERO)
+                for particular_id, amount in expected.items():
+                    running_balance -= amount
+                    rows.append(Transaction(receipt_id=receipt_id, account_id=particular_id, amount=amount, running_balance=running_balance))
+            Transaction.objects.bulk_create(rows, batch_size=1000)
+            report.repaired["transaction"] += len(transaction_receipts)
+
+        if invoices:
+            updates = []
+            for invoice in invoices:
+                updates.append(Invoice(
+                    id = invoice.id,
+                    paid_amount = invoice.paid,
+                    is_cleared = invoice.is_cleared,
+                    state = "Cleared" if invoice.is_cleared else "Pending",
+                ))
+            Invoice.objects.bulk_update(updates, ["paid_amount", "is_cleared", "state"], batch_size=1000)
+            report.repaired["invoice"] += len(invoices)
+
+        # A receipt whose allocation job already failed or finished gets that job run again;
+        # one still waiting in the queue is not counted as repaired
+        for receipt_id in unallocated_receipts:
+            if requeue(process_fee_allocation, receipt_id, key=f"fee-allocation:{receipt_id}"):
+                report.repaired["unallocated_receipt"] += 1
+
+def reconcile(term_id: Optional[int] = None, chunk_size=500, repair=False, keep=50, progress=None) -> ReconciliationReport:
+    """
+    Checks that receipts, receipt allocations, votehead transactions and invoice totals agree
+    with what `allocate_receipt` would have written, a chunk of students at a time.
+
+    Parameters:
+        term_id: only report receipts and invoices of this term (students' whole ledgers are
+            still replayed, since receipts pay invoices of earlier terms)
+        repair: rewrite the rows that disagree
+        progress: called with the report after each chunk
+
+    Returns:
+        The ReconciliationReport.
+    """
+    report = ReconciliationReport(keep=keep)
+    priorities = get_priorities()
+
+    for student_ids in iter_student_chunks(term_id, chunk_size):
+        reconcile_chunk(student_ids, priorities, report, term_id=term_id, repair=repair)
+        if progress:
+            progress(report)
+
+    return report
@@ -0,0 +1,209 @@
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta #type: ignore
+from django.conf import settings #type: ignore
+from django.core.mail import EmailMessage, get_connection #type: ignore
+from django.utils import timezone #type: ignore
+
+from Core.models import Institution
+
+from .models import FeeAging, PaymentPlan
+from .aging import get_sponsor_arrears, reage_aging
+
+# Messages handed to the mail connection at a time
+SEND_BATCH = 200
+
+PLAN_INTERVALS = {
+    "Daily": relativedelta(days=1),
+    "Weekly": relativedelta(weeks=1),
+    "Monthly": relativedelta(months=1),
+    "Termly": relativedelta(months=4),
+    "Semi-Annually": relativedelta(months=6),
+    "Annually": relativedelta(years=1),
+}
+
+STUDENT_MESSAGE = (
+    "Dear {name},\n\n"
+    "This is a reminder that your fee balance at {institution} is KES {outstanding:,.2f}"
+    "{overdue}.\n\n"
+    "Please clear the balance or contact the finance office.\n\n"
+    "{institution}"
+)
+
+SPONSOR_MESSAGE = (
+    "Dear {sponsor},\n\n"
+    "{students} student(s) you sponsor at {institution} have outstanding fees totalling "
+    "KES {outstanding:,.2f}:\n\n"
+    "  0-30 days:    KES {current:,.2f}\n"
+    "  31-60 days:   KES {days_31_60:,.2f}\n"
+    "  61-90 days:   KES {days_61_90:,.2f}\n"
+    "  Over 90 days: KES {days_over_90:,.2f}\n\n"
+    "{institution}"
+)
+
+def get_next_reminder(plan: PaymentPlan, after):
+    """
+    When the plan's next reminder falls due, stepping from its last due date so reminders
+    keep their day of the week/month, and never in the past.
+    """
+    step = PLAN_INTERVALS.get(plan.plan, PLAN_INTERVALS["Monthly"])
+    next_reminder = plan.datenextreminder or after
+    while next_reminder <= after:
+        next_reminder += step
+    return next_reminder
+
+def get_due_plans(now=None):
+    """
+    Plans whose reminder is due, through the datenextreminder index.
+    """
+    now = now or timezone.now()
+    return (
+        PaymentPlan.objects.filter(datenextreminder__lte=now, is_active=True, is_deleted=False)
+        .exclude(sponsor__state="Inactive")
+        .select_related("sponsor")
+        .order_by("datenextreminder", "id")
+    )
+
+def get_overdue_text(row) -> str:
+    overdue = row["days_31_60"] + row["days_61_90"] + row["days_over_90"]
+    if not overdue:
+        return ""
+    return f", of which KES {overdue:,.2f} has been owed for more than 30 days"
+
+# (sponsor_id, message): the sponsor whose plan hangs on the message, None for student
+# reminders, which never hold a plan back
+Reminder = Tuple[Optional[int], EmailMessage]
+
+def iter_student_reminders(sponsor_ids, institution: str, batch_size=SEND_BATCH) -> Iterator[Reminder]:
+    """
+    One message per student of the sponsors who owes fees and has an email address,
+    streamed from the aging index so memory does not grow with the number of students.
+    A student address that fails is counted and logged, but their sponsor's plan still
+    moves on, so one bouncing address cannot have every student mailed again each run.
+    """
+    rows = (
+        FeeAging.objects.filter(outstanding__gt=0, student__sponsor_id__in=sponsor_ids)
+        .exclude(student__email__isnull=True).exclude(student__email="")
+        .order_by("id")
+        .values("student__fname", "student__sname", "student__email", "outstanding", "days_31_60", "days_61_90", "days_over_90")
+    )
+    for row in rows.iterator(chunk_size=batch_size * 5):
+        yield None, EmailMessage(
+            subject = "Fee Balance Reminder",
+            body = STUDENT_MESSAGE.format(
+                name = f"{row['student__fname']} {row['student__sname']}",
+                institution = institution,
+                outstanding = row["outstanding"],
+                overdue = get_overdue_text(row),
+            ),
+            from_email = settings.DEFAULT_FROM_EMAIL,
+            to = [row["student__email"]],
+        )
+
+def iter_sponsor_reminders(plans: List[PaymentPlan], institution: str) -> Iterator[Reminder]:
+    """
+    A summary of what their students owe for each sponsor with an email address.
+    """
+    arrears = get_sponsor_arrears([plan.sponsor_id for plan in plans])
+    for plan in plans:
+        totals = arrears.get(plan.sponsor_id)
+        if not totals or not plan.sponsor.email:
+            continue
+        yield plan.sponsor_id, EmailMessage(
+            subject = "Sponsored Students Fee Balance Reminder",
+            body = SPONSOR_MESSAGE.format(sponsor=plan.sponsor.name, institution=institution, **totals),
+            from_email = settings.DEFAULT_FROM_EMAIL,
+            to = [plan.sponsor.email],
+        )
+
+def send_batches(reminders: Iterator[Reminder], connection, batch_size: int, stats: dict, failed_sponsors: set) -> None:
+    batch = []
+    for reminder in reminders:
+        batch.append(reminder)
+        if len(batch) == batch_size:
+            send_batch(batch, connection, stats, failed_sponsors)
+            batch = []
+    if batch:
+        send_batch(batch, connection, stats, failed_sponsors)
+
+def send_messages(messages: List[EmailMessage], connection) -> int:
+    try:
+        return connection.send_messages(messages) or 0
+    except Exception as e:
+        recipients = f" to {', '.join(messages[0].to)}" if len(messages) == 1 else ""
+        print(f"[ERROR]: sending {len(messages)} reminder(s){recipients} failed: {e}")
+        connection.close()
+        return 0
+
+def send_batch(batch: List[Reminder], connection, stats: dict, failed_sponsors: set) -> None:
+    """
+    Hands a batch to the connection. Backends do not say which messages of a batch were
+    refused, so a failed batch is sent again one message at a time. Sponsor summaries that
+    still fail add their sponsor to `failed_sponsors`.
+    """
+    sent = send_messages([message for _, message in batch], connection)
+    if sent == len(batch):
+        stats["sent"] += sent
+        return
+
+    for sponsor_id, message in batch:
+        if send_messages([message], connection):
+            stats["sent"] += 1
+        else:
+            stats["failed"] += 1
+            if sponsor_id is not None:
+                failed_sponsors.add(sponsor_id)
+
+def send_plan_reminders(now=None, connection=None, batch_size=SEND_BATCH, dry_run=False) -> dict:
+    """
+    Sends the reminders of every due payment plan over one mail connection, then moves each
+    plan's next reminder on by its interval.
+
+    Sponsors get a summary of their students' arrears; each of their students that owes
+    gets their own balance, aged to today first. A plan is only moved on once its sponsor's
+    summary has been handed to the connection: plans whose summary failed stay due and are
+    sent again next run. Failed student reminders are counted in "failed" and logged.
+
+    Parameters:
+        connection: mail connection to send through (default: EMAIL_BACKEND)
+        dry_run: render the messages but neither send them nor move the plans on
+
+    Returns:
+        {"plans", "sent", "failed", "deferred": plans left due after their summary failed, "seconds", "rate"}
+    """
+    now = now or timezone.now()
+    started = time.monotonic()
+    stats = {"plans": 0, "sent": 0, "failed": 0, "deferred": 0}
+
+    plans = list(get_due_plans(now))
+    stats["plans"] = len(plans)
+    if not plans:
+        return {**stats, "seconds": 0.0, "rate": 0.0}
+
+    # Buckets are only re-aged by a daily job; bring them up to date before quoting them
+    reage_aging(timezone.localdate(now))
+
+    institution = Institution.objects.values_list("name", flat=True).first() or ""
+    if dry_run:
+        connection = get_connection("django.core.mail.backends.dummy.EmailBackend")
+    connection = connection or get_connection()
+
+    failed_sponsors = set()
+    connection.open()
+    try:
+        send_batches(iter_sponsor_reminders(plans, institution), connection, batch_size, stats, failed_sponsors)
+        send_batches(iter_student_reminders([plan.sponsor_id for plan in plans], institution, batch_size), connection, batch_size, stats, failed_sponsors)
+    finally:
+        connection.close()
+
+    sent_plans = [plan for plan in plans if plan.sponsor_id not in failed_sponsors]
+    stats["deferred"] = len(plans) - len(sent_plans)
+    if not dry_run and sent_plans:
+        for plan in sent_plans:
+            plan.datenextreminder = get_next_reminder(plan, now)
+            plan.datelastreminded = now
+        PaymentPlan.objects.bulk_update(sent_plans, ["datenextreminder", "datelastreminded"])
+
+    seconds = time.monotonic() - started
+    return {**stats, "seconds": round(seconds, 3), "rate": round(stats["sent"] / seconds, 1) if seconds else 0.0}
@@ -0,0 +1,225 @@
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Iterable, Optional, Tuple
+
+from django.db import transaction #type: ignore
+from django.db.models import Sum #type: ignore
+from django.db.models.functions import ExtractMonth, ExtractYear #type: ignore
+from django.utils import timezone #type: ignore
+
+from Core.models import Course
+
+from .models import FeeRollup, Invoice, Receipt
+
+ZERO = Decimal("0.00")
+
+# (year, month, term_id, course_id)
+Bucket = Tuple[int, int, int, int]
+
+def get_bucket(moment, term_id, course_id) -> Bucket:
+    moment = timezone.localtime(moment) if timezone.is_aware(moment) else moment
+    return (moment.year, moment.month, term_id, course_id)
+
+def get_month_range(year, month):
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return start, end
+
+def refresh_rollups(buckets: Iterable[Bucket], create=True) -> None:
+    """
+    Re-sums invoices and receipts into each (year, month, term, course) rollup row. With
+    `create` False (deletes) only existing rows are updated, as the term or course may be
+    being deleted along with the ledger row.
+    """
+    buckets = set(buckets)
+    if not buckets:
+        return
+
+    departments = dict(Course.objects.filter(id__in={bucket[3] for bucket in buckets}).values_list("id", "department_id"))
+
+    with transaction.atomic():
+        for year, month, term_id, course_id in buckets:
+            start, end = get_month_range(year, month)
+            invoiced = Invoice.objects.filter(
+                term_id=term_id, student__course_id=course_id, created_at__gte=start, created_at__lt=end
+            ).aggregate(total=Sum("amount"))["total"] or ZERO
+            received = Receipt.objects.filter(
+                term_id=term_id, student__course_id=course_id, dop__gte=start, dop__lt=end
+            ).aggregate(total=Sum("amount"))["total"] or ZERO
+
+            if not create:
+                FeeRollup.objects.filter(year=year, month=month, term_id=term_id, course_id=course_id).update(
+                    invoiced=invoiced, received=received, updated_at=timezone.now()
+                )
+                continue
+
+            FeeRollup.objects.update_or_create(
+                year=year, month=month, term_id=term_id, course_id=course_id,
+                defaults={"department_id": departments[course_id], "invoiced": invoiced, "received": received},
+            )
+
+def get_date_field(model) -> str:
+    return "dop" if model is Receipt else "created_at"
+
+def get_stored_bucket(row) -> Optional[Bucket]:
+    """
+    The bucket an Invoice or Receipt counts in as last saved, read before an edit that may
+    move it to another month, term or course.
+    """
+    stored = type(row).objects.filter(pk=row.pk).values_list(get_date_field(type(row)), "term_id", "student__course_id").first()
+    if not stored or not stored[0]:
+        return None
+    return get_bucket(*stored)
+
+def refresh_row_rollup(row, previous: Optional[Bucket] = None, create=True) -> None:
+    """
+    Refreshes the bucket an Invoice or Receipt counts in, and the one it counted in before
+    an edit.
+    """
+    buckets = {previous} if previous else set()
+    moment = getattr(row, get_date_field(type(row)))
+    if moment:
+        buckets.add(get_bucket(moment, row.term_id, row.student.course_id))
+    refresh_rollups(buckets, create=create)
+
+def refresh_invoice_rollup(invoice: Invoice, previous: Optional[Bucket] = None, create=True) -> None:
+    refresh_row_rollup(invoice, previous, create)
+
+def refresh_receipt_rollup(receipt: Receipt, previous: Optional[Bucket] = None, create=True) -> None:
+    refresh_row_rollup(receipt, previous, create)
+
+def refresh_student_rollups(student_id, course_ids: Iterable[int]) -> None:
+    """
+    Refreshes every bucket of a student's invoices and receipts under each of `course_ids`,
+    after the student moved from one course to another.
+    """
+    periods = set()
+    for model in (Invoice, Receipt):
+        for moment, term_id in model.objects.filter(student_id=student_id).values_list(get_date_field(model), "term_id"):
+            if moment:
+                periods.add(get_bucket(moment, term_id, None)[:3])
+    refresh_rollups({(year, month, term_id, course_id) for year, month, term_id in periods for course_id in course_ids})
+
+def compute_rollups() -> dict:
+    """
+    Aggregates the raw Invoice and Receipt tables into {bucket: {"invoiced", "received", "department_id"}}.
+    """
+    rollups = defaultdict(lambda: {"invoiced": ZERO, "received": ZERO, "department_id": None})
+
+    invoices = Invoice.objects.filter(created_at__isnull=False).annotate(
+        year=ExtractYear("created_at"), month=ExtractMonth("created_at")
+    ).values("year", "month", "term_id", "student__course_id", "student__course__department_id").annotate(
+        total=Sum("amount")
+    ).order_by()
+    for row in invoices:
+        rollup = rollups[(row["year"], row["month"], row["term_id"], row["student__course_id"])]
+        rollup["invoiced"] = row["total"] or ZERO
+        rollup["department_id"] = row["student__course__department_id"]
+
+    receipts = Receipt.objects.filter(dop__isnull=False).annotate(
+        year=ExtractYear("dop"), month=ExtractMonth("dop")
+    ).values("year", "month", "term_id", "student__course_id", "student__course__department_id").annotate(
+        total=Sum("amount")
+    ).order_by()
+    for row in receipts:
+        rollup = rollups[(row["year"], row["month"], row["term_id"], row["student__course_id"])]
+        rollup["received"] = row["total"] or ZERO
+        rollup["department_id"] = row["student__course__department_id"]
+
+    return rollups
+
+def rebuild_rollups(batch_size=1000) -> int:
+    """
+    Replaces the FeeRollup table with a fresh aggregation of the ledger.
+    """
+    rollups = compute_rollups()
+    with transaction.atomic():
+        FeeRollup.objects.all().delete()
+        FeeRollup.objects.bulk_create([
+            FeeRollup(
+                year=year, month=month, term_id=term_id, course_id=course_id,
+                department_id=values["department_id"], invoiced=values["invoiced"], received=values["received"],
+            )
+            for (year, month, term_id, course_id), values in rollups.items()
+        ], batch_size=batch_size)
+    return len(rollups)
+
+def verify_rollups() -> list:
+    """
+    Compares the FeeRollup table with the raw aggregation.
+
+    Returns:
+        [(bucket, stored (invoiced, received), expected (invoiced, received))] for every bucket that differs.
+    """
+    expected = {bucket: (values["invoiced"], values["received"]) for bucket, values in compute_rollups().items()}
+    stored = {
+        (year, month, term_id, course_id): (invoiced, received)
+        for year, month, term_id, course_id, invoiced, received in FeeRollup.objects.values_list(
+            "year", "month", "term_id", "course_id", "invoiced", "received"
+        )
+    }
+
+    mismatches = []
+    for bucket in sorted(set(expected) | set(stored)):
+        have, want = stored.get(bucket, (ZERO, ZERO)), expected.get(bucket, (ZERO, ZERO))
+        if have != want:
+            mismatches.append((bucket, have, want))
+    return mismatches
+
+def get_fee_trend(start: Tuple[int, int], end: Tuple[int, int], by="month", term_id=None, course_id=None,
+                  department_id=None) -> "OrderedDict":
+    """
+    Invoiced and received totals between two (year, month) pairs, inclusive, from the rollups.
+
+    Parameters:
+        by: "month" or "year"
+        term_id, course_id, department_id: optional filters
+
+    Returns:
+        OrderedDict of {(year, month) or year: {"invoiced": Decimal, "received": Decimal}} with
+        every period in the range, including empty ones.
+    """
+    (start_year, start_month), (end_year, end_month) = start, end
+    first, last = start_year * 12 + start_month - 1, end_year * 12 + end_month - 1
+
+    periods = OrderedDict()
+    for index in range(first, last + 1):
+        year, month = divmod(index, 12)
+        key = (year, month + 1) if by == "month" else year
+        periods.setdefault(key, {"invoiced": ZERO, "received": ZERO})
+
+    rollups = FeeRollup.objects.filter(year__gte=start_year, year__lte=end_year)
+    if term_id:
+        rollups = rollups.filter(term_id=term_id)
+    if course_id:
+        rollups = rollups.filter(course_id=course_id)
+    if department_id:
+        rollups = rollups.filter(department_id=department_id)
+
+    for year, month, invoiced, received in rollups.values("year", "month").annotate(
+        invoiced=Sum("invoiced"), received=Sum("received")
+    ).order_by().values_list("year", "month", "invoiced", "received"):
+        if not first <= year * 12 + month - 1 <= last:
+            continue
+        period = periods[(year, month) if by == "month" else year]
+        period["invoiced"] += invoiced or ZERO
+        period["received"] += received or ZERO
+
+    return periods
+
+def parse_period(value: Optional[str], default: Tuple[int, int], end=False) -> Tuple[int, int]:
+    """
+    Parses "YYYY" or "YYYY-MM" into (year, month). A bare year means January, or December
+    when `end` is set. Raises ValueError on anything else.
+    """
+    if not value:
+        return default
+    parts = value.split("-")
+    if len(parts) == 1:
+        return int(parts[0]), 12 if end else 1
+
+    year, month = int(parts[0]), int(parts[1])
+    if len(parts) > 2 or not 1 <= month <= 12:
+        raise ValueError(f"Invalid period {value}")
+    return year, month
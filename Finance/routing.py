@@ -0,0 +1,6 @@
+from django.urls import path #type: ignore
+from .consumers import PaymentStatusConsumer
+
+websocket_urlpatterns = [
+    path("ws/payments/<str:checkout_id>/", PaymentStatusConsumer.as_asgi()),
+]
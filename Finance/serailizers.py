@@ -1,6 +1,7 @@
 from rest_framework import serializers #type: ignore
 from .models import *
-from django.db.models import Sum #type: ignore
+from django.db.models import Sum, Count, OuterRef, Subquery, Value, CharField, DecimalField, IntegerField #type: ignore
+from django.db.models.functions import Coalesce, Concat #type: ignore
 from decimal import Decimal
 
 class AccessTokenSerializer(serializers.ModelSerializer):
@@ -13,6 +14,25 @@ class PaymentMethodSerializer(serializers.ModelSerializer):
         model = PaymentMethod
         fields = '__all__'
 
+def annotate_wallet_stats(queryset):
+    """
+    Adds the figures `WalletSerializer` shows for each wallet (receipt count and total, and
+    the latest receipt) as subqueries, so a page of wallets is listed in one query.
+    """
+    receipts = Receipt.objects.filter(wallet=OuterRef("pk")).order_by()
+    totals = receipts.values("wallet")
+    latest = receipts.order_by("-created_at", "-id")
+
+    return queryset.select_related("payment_method").annotate(
+        receipt_count=Coalesce(Subquery(totals.annotate(count=Count("id")).values("count"), output_field=IntegerField()), 0),
+        receipt_total=Subquery(totals.annotate(total=Sum("amount")).values("total"), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        latest_amount=Subquery(latest.values("amount")[:1], output_field=DecimalField(max_digits=10, decimal_places=2)),
+        latest_date=Subquery(latest.values("created_at")[:1]),
+        latest_sender=Subquery(latest.annotate(
+            sender=Concat("student__fname", Value(" "), "student__mname", Value(" "), "student__sname", output_field=CharField())
+        ).values("sender")[:1]),
+    )
+
 class WalletSerializer(serializers.ModelSerializer):
     latest_transaction = serializers.SerializerMethodField()
     total_transactions = serializers.SerializerMethodField()
@@ -23,7 +43,18 @@ class WalletSerializer(serializers.ModelSerializer):
         model = Wallet
         fields = '__all__'
 
+    # Wallets listed through `annotate_wallet_stats` carry these figures already; a single
+    # wallet (create, update, retrieve) falls back to querying its receipts.
     def get_latest_transaction(self, obj):
+        if hasattr(obj, "latest_amount"):
+            if obj.latest_date is None:
+                return None
+            return {
+                "amount": str(obj.latest_amount.quantize(Decimal("0.01"))),
+                "sender": obj.latest_sender or "Unknown",
+                "date": obj.latest_date.strftime("%d %b %Y, %I:%M %p"),
+            }
+
         latest = Receipt.objects.filter(wallet=obj).order_by('-created_at').first()
         if latest:
             return {
@@ -34,9 +65,13 @@ class WalletSerializer(serializers.ModelSerializer):
         return None
 
     def get_total_transactions(self, obj):
+        if hasattr(obj, "receipt_count"):
+            return obj.receipt_count
         return Receipt.objects.filter(wallet=obj).count()
     
     def get_balance(self, obj):
+        if hasattr(obj, "receipt_total"):
+            return str(obj.receipt_total or Decimal("0.00"))
         total = Receipt.objects.filter(wallet=obj).aggregate(sum=Sum("amount"))["sum"] or Decimal("0.00")
         return str(total)
 
@@ -70,6 +105,19 @@ class FeeStatusSerializer(serializers.ModelSerializer):
         model = FeeStatus
         fields = '__all__'
 
+class FeeAgingSerializer(serializers.ModelSerializer):
+    regno = serializers.CharField(source='student.regno', read_only=True)
+    fname = serializers.CharField(source='student.fname', read_only=True)
+    mname = serializers.CharField(source='student.mname', read_only=True)
+    sname = serializers.CharField(source='student.sname', read_only=True)
+    course_name = serializers.CharField(source='student.course.abbr', read_only=True)
+    branch_name = serializers.CharField(source='student.branch.name', read_only=True)
+    class_name = serializers.CharField(source='student.students.Class.name', read_only=True, default=None)
+
+    class Meta:
+        model = FeeAging
+        exclude = ['open_items']
+
 class ReceiptSerializer(serializers.ModelSerializer):
     fname = serializers.CharField(source='student.fname', read_only=True)
     mname = serializers.CharField(source='student.mname', read_only=True)
@@ -1,9 +1,15 @@
-from django.db.models.signals import m2m_changed, post_save #type: ignore
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete #type: ignore
 from django.dispatch import receiver #type: ignore
 from decimal import Decimal
 
-from .models import Invoice
+from Students.models import Student
+
+from .models import Invoice, Receipt, FeeStatus, FeeParticular, Account, PriorityLevel
 from .fee_manager import FeeManager
+from .balances import refresh_invoiced, refresh_paid, apply_fee_status, refresh_fee_status
+from .rollups import get_stored_bucket, refresh_invoice_rollup, refresh_receipt_rollup, refresh_student_rollups
+from .fee_structures import invalidate_structures, invalidate_all_structures
+from .aging import refresh_aging
 
 @receiver(m2m_changed, sender=Invoice.narration.through)
 def update_invoice_amount(sender, instance, action, **kwargs):
@@ -19,3 +25,115 @@ def update_invoice_amount(sender, instance, action, **kwargs):
 
             manager = FeeManager(student.regno, term.id)
             manager.update_status(receipt = instance.inv_no, amount_paid = Decimal(-instance.amount))
+
+def is_student_deletion(origin) -> bool:
+    """
+    Whether a post_delete comes from deleting students, whose projections are deleted in
+    the same cascade and must not be written again.
+    """
+    return isinstance(origin, Student) or getattr(origin, "model", None) is Student
+
+# Keep the StudentFeeBalance projection in step with the ledger. Deletes only update
+# existing rows: a cascade from a course, term etc. is deleting those rows as well.
+@receiver(post_save, sender=Invoice)
+def sync_balance_invoiced(sender, instance, **kwargs):
+    refresh_invoiced(instance.student_id, instance.term_id, instance.inv_no)
+
+@receiver(post_delete, sender=Invoice)
+def sync_balance_invoiced_deleted(sender, instance, origin=None, **kwargs):
+    if not is_student_deletion(origin):
+        refresh_invoiced(instance.student_id, instance.term_id, instance.inv_no, create=False)
+
+@receiver(post_save, sender=Receipt)
+def sync_balance_paid(sender, instance, **kwargs):
+    refresh_paid(instance.student_id, instance.term_id, instance.trans_id)
+
+@receiver(post_delete, sender=Receipt)
+def sync_balance_paid_deleted(sender, instance, origin=None, **kwargs):
+    if not is_student_deletion(origin):
+        refresh_paid(instance.student_id, instance.term_id, instance.trans_id, create=False)
+
+@receiver(post_save, sender=FeeStatus)
+def sync_balance_status(sender, instance, created, **kwargs):
+    if created:
+        apply_fee_status(instance)
+    else:
+        refresh_fee_status(instance.student_id)
+
+@receiver(post_delete, sender=FeeStatus)
+def sync_balance_status_deleted(sender, instance, origin=None, **kwargs):
+    if not is_student_deletion(origin):
+        refresh_fee_status(instance.student_id)
+
+# Re-age the student's debt after the balance projection has moved
+@receiver(post_save, sender=FeeStatus)
+def sync_fee_aging(sender, instance, **kwargs):
+    refresh_aging([instance.student_id])
+
+@receiver(post_delete, sender=FeeStatus)
+def sync_fee_aging_deleted(sender, instance, origin=None, **kwargs):
+    if not is_student_deletion(origin):
+        refresh_aging([instance.student_id], create=False)
+
+# Keep the FeeRollup trend table in step with invoices and receipts. An edit can move a row
+# to another month, term or course, so the bucket it was saved in is refreshed as well.
+BUCKET_FIELDS = {"created_at", "dop", "term", "student"}
+
+@receiver(pre_save, sender=Invoice)
+@receiver(pre_save, sender=Receipt)
+def remember_rollup_bucket(sender, instance, update_fields=None, **kwargs):
+    instance._rollup_bucket = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and not BUCKET_FIELDS & set(update_fields):
+        return
+    instance._rollup_bucket = get_stored_bucket(instance)
+
+@receiver(post_save, sender=Invoice)
+def sync_invoice_rollup(sender, instance, **kwargs):
+    refresh_invoice_rollup(instance, getattr(instance, "_rollup_bucket", None))
+
+@receiver(post_delete, sender=Invoice)
+def sync_invoice_rollup_deleted(sender, instance, **kwargs):
+    refresh_invoice_rollup(instance, create=False)
+
+@receiver(post_save, sender=Receipt)
+def sync_receipt_rollup(sender, instance, **kwargs):
+    refresh_receipt_rollup(instance, getattr(instance, "_rollup_bucket", None))
+
+@receiver(post_delete, sender=Receipt)
+def sync_receipt_rollup_deleted(sender, instance, **kwargs):
+    refresh_receipt_rollup(instance, create=False)
+
+# A student moving course takes their invoices and receipts to the new course's buckets
+@receiver(pre_save, sender=Student)
+def remember_student_course(sender, instance, update_fields=None, **kwargs):
+    instance._stored_course_id = None
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and "course" not in update_fields:
+        return
+    instance._stored_course_id = Student.objects.filter(pk=instance.pk).values_list("course_id", flat=True).first()
+
+@receiver(post_save, sender=Student)
+def sync_student_rollups(sender, instance, created, **kwargs):
+    stored = getattr(instance, "_stored_course_id", None)
+    if not created and stored and stored != instance.course_id:
+        refresh_student_rollups(instance.pk, [stored, instance.course_id])
+
+# Drop cached fee structures when their particulars or voteheads change
+@receiver(post_save, sender=FeeParticular)
+@receiver(post_delete, sender=FeeParticular)
+def invalidate_fee_structure(sender, instance, created=False, **kwargs):
+    if kwargs.get("signal") is post_save and not created:
+        # An edit may have moved the particular to another course, module or term
+        invalidate_all_structures()
+    else:
+        invalidate_structures([(instance.course_id, instance.module_id, instance.term_id)])
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+@receiver(post_save, sender=PriorityLevel)
+@receiver(post_delete, sender=PriorityLevel)
+def invalidate_fee_structures(sender, instance, **kwargs):
+    invalidate_all_structures()
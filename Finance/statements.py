@@ -0,0 +1,236 @@
+import csv
+from collections import defaultdict
+from decimal import Decimal
+from typing import Iterable, Iterator, List
+
+from Core.models import Term
+
+from .models import FeeStatus, Invoice, Receipt, Transaction
+
+DATE_FORMAT = "%d/%m/%Y %H:%M"
+STATEMENT_COLUMNS = ["Date", "Reference", "Term", "Detail", "Paid In", "Paid Out", "Balance"]
+
+def get_statement_terms(student, term_ids=None) -> List[Term]:
+    """
+    Terms a statement covers, oldest first. `term_ids=None` means every term the student
+    has been invoiced or receipted in.
+    """
+    terms = Term.objects.select_related("name", "year")
+    if term_ids is None:
+        terms = terms.filter(id__in=FeeStatus.objects.filter(student=student).values("term_id"))
+    else:
+        terms = terms.filter(id__in=term_ids)
+    return list(terms.order_by("year__name", "openingDate", "id"))
+
+def load_statement_records(student, terms):
+    """
+    Loads everything a statement needs in four queries, whatever the number of invoices
+    and receipts.
+    """
+    invoices = list(Invoice.objects.filter(student=student, term__in=terms).order_by("created_at"))
+    receipts = list(Receipt.objects.filter(student=student, term__in=terms).order_by("created_at"))
+
+    # The first fee status written for an invoice or receipt is its balance
+    statuses = {}
+    for purpose, arrears in FeeStatus.objects.filter(student=student, term__in=terms).order_by(
+        "-created_at", "-id"
+    ).values_list("purpose", "arrears"):
+        statuses[purpose] = arrears
+
+    transactions = defaultdict(list)
+    for txn in Transaction.objects.filter(receipt__in=receipts).select_related("account__account").order_by("-id"):
+        transactions[txn.receipt_id].append(txn)
+
+    return invoices, receipts, statuses, transactions
+
+def get_receipt_record(receipt, arrears, transactions) -> dict:
+    running_balance = arrears - receipt.amount
+    txn_details = {}
+    sorted_txn_details = {}
+
+    if transactions:
+        if arrears > 0:
+            sorted_txn_details["Overpayment"] = {
+                "paid_out": f"{arrears}",
+                "balance": f"{arrears}"
+            }
+        for txn in transactions:
+            running_balance += txn.amount
+            txn_details[txn.account.account.votehead] = {
+                "paid_out": f"{txn.amount}",
+                "balance": f"{running_balance}",
+            }
+
+        # Voteheads are paid newest transaction last
+        for key in reversed(list(txn_details.keys())):
+            sorted_txn_details[key] = txn_details[key]
+    else:
+        sorted_txn_details["Overpayment"] = {
+            "paid_out": "",
+            "balance": f"{running_balance}"
+        }
+
+    sorted_txn_details["paid_in"] = f"{receipt.amount}"
+    return sorted_txn_details
+
+def build_statement(student, terms: Iterable[Term]) -> List[dict]:
+    """
+    Merges a student's invoices and receipts over `terms` in time order, oldest first, with
+    the balance after each entry. The balance is the fee status written with the entry; where
+    there is none it is carried forward from the previous entry.
+
+    Returns:
+        [{"transaction_id", "date", "term", "balance", "record"}], `record` in the shape
+        `generate_statement` has always returned.
+    """
+    terms = list(terms)
+    term_names = {term.id: str(term) for term in terms}
+    invoices, receipts, statuses, transactions = load_statement_records(student, terms)
+
+    events = [(invoice.created_at, 0, invoice) for invoice in invoices]
+    events += [(receipt.created_at, 1, receipt) for receipt in receipts]
+    events.sort(key=lambda event: (event[0], event[1]))
+
+    balance = Decimal("0.00")
+    statement = []
+    for date, kind, item in events:
+        if kind == 0:
+            balance = statuses.get(item.inv_no, balance - (item.amount or 0))
+            transaction_id = item.inv_no
+            record = {
+                "detail": "New Term Invoice",
+                "paid_in": f"{item.paid_amount} bal b/f",
+                "paid_out": f"{item.amount}",
+                "balance": f"{balance}",
+            }
+        else:
+            balance = statuses.get(item.trans_id, balance + item.amount)
+            transaction_id = item.trans_id
+            record = get_receipt_record(item, balance, transactions.get(item.id, []))
+
+        statement.append({
+            "transaction_id": transaction_id,
+            "date": date,
+            "term": term_names.get(item.term_id),
+            "balance": balance,
+            "record": record,
+        })
+    return statement
+
+def get_statement_rows(statement) -> Iterator[list]:
+    """
+    Flattens statement entries into table rows (see STATEMENT_COLUMNS): one per invoice, and
+    one per receipt followed by a row per votehead it paid.
+    """
+    for entry in statement:
+        date = entry["date"].strftime(DATE_FORMAT)
+        record = entry["record"]
+        if "detail" in record:
+            yield [date, entry["transaction_id"], entry["term"], record["detail"], record["paid_in"], record["paid_out"], record["balance"]]
+            continue
+
+        yield [date, entry["transaction_id"], entry["term"], "Payment", record["paid_in"], "", f"{entry['balance']}"]
+        for votehead, detail in record.items():
+            if votehead != "paid_in":
+                yield ["", "", "", votehead, "", detail["paid_out"], detail["balance"]]
+
+class Echo:
+    """
+    File-like object whose write() returns the line, for streaming csv.writer output.
+    """
+    def write(self, value):
+        return value
+
+def iter_statement_csv(statement) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(STATEMENT_COLUMNS)
+    for row in get_statement_rows(statement):
+        yield writer.writerow(row)
+
+class PDFStream:
+    """
+    Minimal PDF 1.4 writer (Helvetica text only) that yields each object as it is written,
+    so a statement is sent page by page. Only the cross-reference table is held back.
+    """
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+    MARGIN = 40
+    LINE_HEIGHT = 13
+
+    def __init__(self):
+        self.offset = 0
+        self.offsets = {}
+        self.pages = []
+        self.next_id = 5  # 1 catalog, 2 pages, 3 and 4 fonts
+
+    @staticmethod
+    def escape(text) -> str:
+        return str(text).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    def write_object(self, object_id, body: bytes) -> bytes:
+        data = f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n"
+        self.offsets[object_id] = self.offset
+        self.offset += len(data)
+        return data
+
+    def start(self) -> Iterator[bytes]:
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.offset = len(header)
+        yield header
+        yield self.write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield self.write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        yield self.write_object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    def page(self, lines) -> Iterator[bytes]:
+        """
+        Writes one page. `lines` is [(x, y, text, bold)] in points from the top-left corner.
+        """
+        commands = ["BT"]
+        for x, y, text, bold in lines:
+            commands.append(f"/{'F2' if bold else 'F1'} 9 Tf 1 0 0 1 {x} {self.PAGE_HEIGHT - y} Tm ({self.escape(text)}) Tj")
+        commands.append("ET")
+        content = "\n".join(commands).encode("cp1252", errors="replace")
+
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        yield self.write_object(content_id, f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+        yield self.write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        self.pages.append(page_id)
+
+    def finish(self) -> Iterator[bytes]:
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.pages)
+        yield self.write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>".encode())
+
+        xref_offset = self.offset
+        lines = [f"xref\n0 {self.next_id}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[object_id]:010d} 00000 n \n" for object_id in range(1, self.next_id)]
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n")
+        yield "".join(lines).encode()
+
+def iter_statement_pdf(statement, title_lines: List[str]) -> Iterator[bytes]:
+    pdf = PDFStream()
+    columns = [40, 112, 190, 258, 360, 440, 505]
+    rows_per_page = (PDFStream.PAGE_HEIGHT - 2 * PDFStream.MARGIN) // PDFStream.LINE_HEIGHT - len(title_lines) - 3
+
+    def header():
+        lines = [(columns[0], PDFStream.MARGIN + i * 16, text, i == 0) for i, text in enumerate(title_lines)]
+        y = PDFStream.MARGIN + len(title_lines) * 16 + 10
+        lines += [(x, y, column, True) for x, column in zip(columns, STATEMENT_COLUMNS)]
+        return lines, y + PDFStream.LINE_HEIGHT + 4
+
+    yield from pdf.start()
+    lines, y = header()
+    count = 0
+    for row in get_statement_rows(statement):
+        if count == rows_per_page:
+            yield from pdf.page(lines)
+            lines, y = header()
+            count = 0
+        lines += [(x, y, str(value)[:20], False) for x, value in zip(columns, row) if value != ""]
+        y += PDFStream.LINE_HEIGHT
+        count += 1
+
+    yield from pdf.page(lines)
+    yield from pdf.finish()
@@ -1,3 +1,684 @@
-from django.test import TestCase #type: ignore
+import io
+import json
+import random
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User #type: ignore
+from django.core.mail.backends.locmem import EmailBackend #type: ignore
+from django.db import connection, connections #type: ignore
+from django.test import SimpleTestCase, TestCase, TransactionTestCase #type: ignore
+from django.test.utils import CaptureQueriesContext #type: ignore
+from django.utils import timezone #type: ignore
+from rest_framework.test import APIRequestFactory, force_authenticate #type: ignore
+
+from Core.models import AcademicYear, Intake, Term, Institution, Branch, Sponsor, Module, Department, Course, CourseDuration, Class
+from Students.models import Student, Allocate_Student
+
+from .models import PaymentMethod, Wallet, Invoice, Receipt, InvoiceSequence, PaymentAttempt, AccessToken, FeeAging, PaymentPlan
+from .allocation import allocate, allocate_batch, allocate_iterative
+from .application import reserve_invoice_numbers, generate_invoice_number
+from .rollups import get_fee_trend, verify_rollups
+from .reminders import send_plan_reminders
+from .configs import api_settings
+from .mpesa_tokens import token_cache
+from . import views
+
+# ============================== FIXTURES ============================== #
+def create_school(courses=2, classes_per_course=2) -> dict:
+    """
+    An institution with a current term, and `courses` courses of `classes_per_course` classes.
+    """
+    year = AcademicYear.objects.create(name="2025/2026")
+    intake = Intake.objects.create(name="Jan", openingMonth="JANUARY", closingMonth="APRIL")
+    term = Term.objects.create(name=intake, year=year)
+    Institution.objects.create(
+        name="Test College", motto="m", mission="m", vision="v", paddr="p", tel_a=1, email="info@test.ac",
+        current_year=year, current_intake=intake,
+    )
+    branch = Branch.objects.create(code="MAIN", paddr="p", tel_a=1, email="main@test.ac")
+    sponsor = Sponsor.objects.create(name="Self", phone=712345678)
+    module = Module.objects.create(name="Module 1", abbr="M1")
+    department = Department.objects.create(name="ICT", abbr="ICT")
+    method = PaymentMethod.objects.create(name="MPesa", code="MPESA")
+    wallet = Wallet.objects.create(name="Paybill", payment_method=method, logo="x.png", paybill="174379", cardNumber="1", cardHolder="x")
+
+    classes = []
+    for c in range(courses):
+        course = Course.objects.create(code=100 + c, name=f"Course {c}", abbr=f"C{c}", department=department)
+        CourseDuration.objects.create(course=course, module=module, duration=3)
+        for k in range(classes_per_course):
+            classes.append(Class.objects.create(
+                name=f"{course.abbr}-{k}", course=course, intake=term, reg_intake=term, branch=branch, module=module,
+            ))
+
+    return {
+        "year": year, "intake": intake, "term": term, "branch": branch, "sponsor": sponsor, "module": module,
+        "department": department, "wallet": wallet, "classes": classes,
+    }
+
+def create_students(school: dict, count: int, start: int = 0) -> list:
+    """
+    `count` students allocated round-robin to the school's classes.
+    """
+    classes = school["classes"]
+    Student.objects.bulk_create([
+        Student(
+            regno=f"JI/{i:06d}", fname=f"F{i}", mname="M", sname="S", gender="Male", dob=timezone.now(), nat_id=i,
+            phone=712345678, email=f"s{i}@test.ac", course=classes[i % len(classes)].course, branch=school["branch"],
+            year=school["year"], intake=school["intake"], sponsor=school["sponsor"],
+        )
+        for i in range(start, start + count)
+    ], batch_size=1000)
+    students = list(Student.objects.filter(regno__in=[f"JI/{i:06d}" for i in range(start, start + count)]).order_by("id"))
+    Allocate_Student.objects.bulk_create([
+        Allocate_Student(
+            studentno=student, module=school["module"], term=school["term"], Class=classes[i % len(classes)],
+            level=1, state="Allocated",
+        )
+        for i, student in enumerate(students)
+    ], batch_size=1000)
+    return students
+
+def create_ledger(school: dict, students: list, invoiced=Decimal("1000.00"), paid=Decimal("400.00")) -> None:
+    """
+    One invoice and one receipt per student, written without the per-row signals.
+    """
+    Invoice.objects.bulk_create([
+        Invoice(inv_no=f"INV/{student.id}", student=student, term=school["term"], amount=invoiced)
+        for student in students
+    ], batch_size=1000)
+    Receipt.objects.bulk_create([
+        Receipt(trans_id=f"TX{student.id}", student=student, wallet=school["wallet"], term=school["term"], amount=paid, cashier="test")
+        for student in students
+    ], batch_size=1000)
+
+def get_staff_user() -> User:
+    return User.objects.create_user(username="bursar", password="x", is_staff=True, is_superuser=True)
+
+# ============================== ALLOCATION ============================== #
+class AllocationEquivalenceTests(SimpleTestCase):
+    """
+    allocate and allocate_batch must give exactly what the original iterative loop
+    (allocate_iterative) gives, to the cent and in the same order.
+    """
+    PRIORITIES = [100, 100, 90, 75, 50, 30, 20, 10, 5, 1, 0]
+    EDGE_CASES = [
+        ("zero amount", Decimal("0.00"), {"tuition": (Decimal("1000.00"), 50), "exam": (Decimal("500.00"), 100)}),
+        ("negative amount", Decimal("-50.00"), {"tuition": (Decimal("1000.00"), 50), "exam": (Decimal("500.00"), 100)}),
+        ("overpayment", Decimal("2000.00"), {"tuition": (Decimal("1000.00"), 50), "exam": (Decimal("500.00"), 100)}),
+        ("exact payment", Decimal("1500.00"), {"tuition": (Decimal("1000.00"), 50), "exam": (Decimal("500.00"), 100)}),
+        ("all zero priorities", Decimal("300.00"), {"tuition": (Decimal("1000.00"), 0), "exam": (Decimal("500.00"), 0)}),
+        ("single votehead", Decimal("333.33"), {"tuition": (Decimal("1000.00"), 40)}),
+        ("single full priority votehead", Decimal("333.33"), {"tuition": (Decimal("1000.00"), 100)}),
+        ("cents needing a remainder split", Decimal("0.10"), {"a": (Decimal("1.00"), 50), "b": (Decimal("1.00"), 50), "c": (Decimal("1.00"), 50)}),
+        ("one cent over three voteheads", Decimal("0.01"), {"a": (Decimal("0.33"), 90), "b": (Decimal("0.33"), 90), "c": (Decimal("0.34"), 90)}),
+        ("odd cents after full priority", Decimal("100.07"), {"exam": (Decimal("100.00"), 100), "a": (Decimal("33.33"), 30), "b": (Decimal("66.67"), 30)}),
+    ]
+
+    def make_corpus(self, cases=1000, max_voteheads=8, seed=2025):
+        rng = random.Random(seed)
+        corpus = []
+        for _ in range(cases):
+            distribution = {}
+            for votehead in range(rng.randint(1, max_voteheads)):
+                balance = Decimal(rng.choice([rng.randint(1, 500) * 100, rng.randint(1, 5_000_000)])) / 100
+                distribution[f"votehead-{votehead}"] = (balance, rng.choice(self.PRIORITIES))
+
+            total = sum(balance for balance, _ in distribution.values())
+            amount = (total * Decimal(rng.choice(["0.001", "0.01", "0.1", "0.3", "0.5", "0.9", "1.1"]))).quantize(Decimal("0.01"))
+            corpus.append((amount, distribution))
+        return corpus
+
+    def assertSameAllocation(self, result, expected, msg):
+        # str() so 0 and 0.00 count as different, as they would on a receipt
+        self.assertEqual(
+            [(account, str(value)) for account, value in result.items()],
+            [(account, str(value)) for account, value in expected.items()],
+            msg,
+        )
+
+    def test_seeded_corpus_matches_iterative(self):
+        corpus = self.make_corpus()
+        # Repeat each shape under other account keys, so allocate_batch reuses its results
+        corpus += [
+            (amount, {f"{account}-again": value for account, value in distribution.items()})
+            for amount, distribution in corpus[:50]
+        ]
+
+        batched = allocate_batch(corpus)
+        for index, (amount, distribution) in enumerate(corpus):
+            expected = allocate_iterative(amount, distribution)
+            self.assertSameAllocation(allocate(amount, distribution), expected, f"allocate, case {index}: {amount} over {distribution}")
+            self.assertSameAllocation(batched[index], expected, f"allocate_batch, case {index}: {amount} over {distribution}")
+
+    def test_edge_cases_match_iterative(self):
+        batched = allocate_batch([(amount, distribution) for _, amount, distribution in self.EDGE_CASES])
+        for (name, amount, distribution), batch_result in zip(self.EDGE_CASES, batched):
+            expected = allocate_iterative(amount, distribution)
+            self.assertSameAllocation(allocate(amount, distribution), expected, f"allocate: {name}")
+            self.assertSameAllocation(batch_result, expected, f"allocate_batch: {name}")
+
+# ============================== FEE SUMMARIES ============================== #
+class InstitutionFeeSummaryQueryTests(TestCase):
+    """
+    institution_fee_summary must cost the same number of queries however many students
+    are enrolled.
+    """
+
+    def setUp(self):
+        self.school = create_school()
+        self.user = get_staff_user()
+        self.factory = APIRequestFactory()
+        self.enrolled = 0
+
+    def enrol(self, total: int) -> None:
+        students = create_students(self.school, total - self.enrolled, start=self.enrolled)
+        create_ledger(self.school, students)
+        self.enrolled = total
+
+    def count_queries(self):
+        request = self.factory.get("/finance/api/institution-fee-summary/")
+        force_authenticate(request, user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = views.institution_fee_summary(request)
+        self.assertEqual(response.status_code, 200, response.data)
+        return len(queries), response.data
+
+    def test_query_count_is_flat_from_100_to_10000_students(self):
+        counts = {}
+        for total in [100, 1000, 10000]:
+            self.enrol(total)
+            counts[total], data = self.count_queries()
+            self.assertEqual(Decimal(str(data["summary"]["totalInvoiced"])), Decimal("1000.00") * total)
+            self.assertEqual(Decimal(str(data["summary"]["totalBalance"])), Decimal("600.00") * total)
+
+        self.assertEqual(counts[100], counts[1000], counts)
+        self.assertEqual(counts[100], counts[10000], counts)
+
+# ============================== WALLETS ============================== #
+class WalletListQueryTests(TestCase):
+    """
+    Listing wallets with their receipt figures must cost the same queries for 10 wallets
+    as for 50, in every list mode.
+    """
+
+    # query parameters: queries (a paginated page adds the count query)
+    MODES = [
+        ({"all": "true"}, 1),
+        ({"all": "active"}, 1),
+        ({"no_pagination": "true"}, 1),
+        ({}, 2),
+    ]
+
+    def setUp(self):
+        self.school = create_school(courses=1, classes_per_course=1)
+        self.students = create_students(self.school, 3)
+        self.user = get_staff_user()
+        self.method = self.school["wallet"].payment_method
+        self.view = views.WalletViewSet.as_view({"get": "list"})
+
+    def add_wallets(self, total: int) -> None:
+        """
+        Wallets up to `total`, each with one receipt from every student.
+        """
+        wallets = Wallet.objects.bulk_create([
+            Wallet(name=f"Wallet {i}", payment_method=self.method, logo="x.png", paybill=str(100000 + i), cardNumber=str(i), cardHolder="x")
+            for i in range(Wallet.objects.count(), total)
+        ])
+        Receipt.objects.bulk_create([
+            Receipt(
+                trans_id=f"TX{wallet.id}-{student.id}", student=student, wallet=wallet, term=self.school["term"],
+                amount=Decimal(100 * (i + 1)), cashier="test",
+            )
+            for wallet in wallets for i, student in enumerate(self.students)
+        ])
+
+    def list_wallets(self, params: dict):
+        request = APIRequestFactory().get("/finance/api/wallets/", params)
+        force_authenticate(request, user=self.user)
+        response = self.view(request)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_query_count_is_flat_from_10_to_50_wallets(self):
+        for total in [10, 50]:
+            self.add_wallets(total)
+            for params, queries in self.MODES:
+                with self.subTest(wallets=total, **params), self.assertNumQueries(queries):
+                    self.list_wallets(params)
+
+        rows = self.list_wallets({"all": "true"})["results"]
+        self.assertEqual(len(rows), 50)
+        row = rows[-1]
+        self.assertEqual(row["total_transactions"], 3)
+        self.assertEqual(Decimal(row["balance"]), Decimal("600.00"))
+        self.assertEqual(row["latest_transaction"]["amount"], "300.00")
+        self.assertEqual(row["wallet_type"], self.method.name)
+
+# ============================== EXPORTS ============================== #
+class ExportMemoryTests(TestCase):
+    """
+    Ledger exports are streamed: peak memory while one is read must not grow with the
+    number of rows exported.
+    """
+
+    SMALL = 4000
+    LARGE = 20000
+    STUDENTS = 100
+
+    def setUp(self):
+        self.school = create_school(courses=1, classes_per_course=1)
+        self.students = create_students(self.school, self.STUDENTS)
+        self.user = get_staff_user()
+        self.receipts = 0
+
+    def add_receipts(self, total: int) -> None:
+        Receipt.objects.bulk_create([
+            Receipt(
+                trans_id=f"TX{i:07d}", student=self.students[i % self.STUDENTS], wallet=self.school["wallet"],
+                term=self.school["term"], amount=Decimal("1234.50"), cashier="test",
+            )
+            for i in range(self.receipts, total)
+        ], batch_size=2000)
+        self.receipts = total
+
+    def export(self, export_format: str):
+        """
+        Reads a receipts export to the end without keeping it. Returns (peak traced bytes,
+        bytes streamed, newlines streamed).
+        """
+        request = APIRequestFactory().get("/finance/api/export/receipts/", {"export": export_format})
+        force_authenticate(request, user=self.user)
+
+        size = lines = 0
+        tracemalloc.start()
+        try:
+            response = views.export_records(request, "receipts")
+            self.assertEqual(response.status_code, 200)
+            for chunk in response.streaming_content:
+                size += len(chunk)
+                lines += chunk.count(b"\n")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return peak, size, lines
+
+    def test_peak_memory_is_flat_from_4000_to_20000_rows(self):
+        peaks = {}
+        for total in [self.SMALL, self.LARGE]:
+            self.add_receipts(total)
+            for export_format in ["csv", "ndjson", "xlsx"]:
+                peak, size, lines = self.export(export_format)
+                peaks[(export_format, total)] = peak
+                self.assertGreater(size, 0)
+                if export_format == "csv":
+                    self.assertEqual(lines, total + 1)
+                elif export_format == "ndjson":
+                    self.assertEqual(lines, total)
+
+        for export_format in ["csv", "ndjson", "xlsx"]:
+            small, large = peaks[(export_format, self.SMALL)], peaks[(export_format, self.LARGE)]
+            # Five times the rows, within half again the memory
+            self.assertLess(large, small * 1.5, f"{export_format} export peak: {small / 2**20:.1f}MB at {self.SMALL} rows, {large / 2**20:.1f}MB at {self.LARGE}")
+
+# ============================== FEE TRENDS ============================== #
+def get_moment(year, month, day=15):
+    return timezone.make_aware(datetime(year, month, day, 12))
+
+class FeeTrendTests(TestCase):
+    """
+    get_fee_trend reads the FeeRollup table kept up by signals; over any range and filter it
+    must agree with grouping the invoices and receipts themselves, also after edits that
+    move rows between months, terms and courses.
+    """
+
+    RANGES = [
+        ((2025, 11), (2027, 2)), # everything
+        ((2026, 3), (2026, 3)), # one month
+        ((2026, 12), (2027, 1)), # across a year end
+        ((2026, 2), (2026, 9)), # part of a year
+        ((2024, 1), (2024, 12)), # nothing
+    ]
+
+    def setUp(self):
+        self.school = create_school(courses=2, classes_per_course=1)
+        intake = Intake.objects.create(name="May", openingMonth="MAY", closingMonth="AUGUST")
+        self.term2 = Term.objects.create(name=intake, year=self.school["year"])
+        self.students = create_students(self.school, 6)
+        self.courses = [school_class.course for school_class in self.school["classes"]]
+
+        # One receipt a month over 16 months, and an invoice every other month, spread over
+        # the students and both terms
+        for index in range(16):
+            year, month = divmod(2025 * 12 + 10 + index, 12)
+            student = self.students[index % len(self.students)]
+            term = self.school["term"] if index % 3 else self.term2
+            Receipt.objects.create(
+                trans_id=f"TX{index}", student=student, wallet=self.school["wallet"], term=term,
+                amount=Decimal(100 + index), cashier="test", dop=get_moment(year, month + 1),
+            )
+            if index % 2 == 0:
+                invoice = Invoice.objects.create(inv_no=f"INV/{index}", student=student, term=term, amount=Decimal(1000 + index))
+                invoice.created_at = get_moment(year, month + 1, 3)
+                invoice.save()
+
+    def get_raw_trend(self, start, end, by="month", term_id=None, course_id=None, department_id=None):
+        first, last = start[0] * 12 + start[1] - 1, end[0] * 12 + end[1] - 1
+        periods = OrderedDict()
+        for index in range(first, last + 1):
+            year, month = divmod(index, 12)
+            periods.setdefault((year, month + 1) if by == "month" else year, {"invoiced": Decimal("0.00"), "received": Decimal("0.00")})
+
+        for model, field, total in ((Invoice, "created_at", "invoiced"), (Receipt, "dop", "received")):
+            rows = model.objects.all()
+            if term_id:
+                rows = rows.filter(term_id=term_id)
+            if course_id:
+                rows = rows.filter(student__course_id=course_id)
+            if department_id:
+                rows = rows.filter(student__course__department_id=department_id)
+            for moment, amount in rows.values_list(field, "amount"):
+                moment = timezone.localtime(moment)
+                if first <= moment.year * 12 + moment.month - 1 <= last:
+                    periods[(moment.year, moment.month) if by == "month" else moment.year][total] += amount
+        return periods
+
+    def assertTrendsMatch(self):
+        filters = [
+            {}, {"term_id": self.school["term"].id}, {"term_id": self.term2.id},
+            {"course_id": self.courses[0].id}, {"course_id": self.courses[1].id},
+            {"department_id": self.school["department"].id},
+        ]
+        for start, end in self.RANGES:
+            for by in ("month", "year"):
+                for options in filters:
+                    with self.subTest(start=start, end=end, by=by, **options):
+                        self.assertEqual(get_fee_trend(start, end, by=by, **options), self.get_raw_trend(start, end, by=by, **options))
+        self.assertEqual(verify_rollups(), [])
+
+    def test_trend_matches_ledger(self):
+        self.assertTrendsMatch()
+        trend = get_fee_trend((2026, 1), (2026, 12), by="year")
+        self.assertEqual(list(trend), [2026])
+        self.assertGreater(trend[2026]["received"], 0)
+
+    def test_edits_move_rows_between_buckets(self):
+        receipt = Receipt.objects.get(trans_id="TX11") # October 2026
+        self.assertEqual(timezone.localtime(receipt.dop).month, 10)
+        receipt.dop = get_moment(2026, 8)
+        receipt.save()
+        self.assertTrendsMatch()
+
+        receipt.term = self.term2 if receipt.term_id == self.school["term"].id else self.school["term"]
+        receipt.save()
+        self.assertTrendsMatch()
+
+        receipt.student = next(student for student in self.students if student.course_id != receipt.student.course_id)
+        receipt.save()
+        self.assertTrendsMatch()
+
+        invoice = Invoice.objects.get(inv_no="INV/4")
+        invoice.term = self.term2
+        invoice.student = next(student for student in self.students if student.course_id != invoice.student.course_id)
+        invoice.save(update_fields=["term", "student"])
+        self.assertTrendsMatch()
+
+        invoice.created_at = get_moment(2027, 2)
+        invoice.save()
+        self.assertTrendsMatch()
+
+    def test_student_changing_course_moves_their_rows(self):
+        student = self.students[0]
+        student.course = next(course for course in self.courses if course.id != student.course_id)
+        student.save()
+        self.assertTrendsMatch()
+
+    def test_deletes_are_removed_from_the_trend(self):
+        Receipt.objects.get(trans_id="TX5").delete()
+        Invoice.objects.get(inv_no="INV/6").delete()
+        self.assertTrendsMatch()
+
+# ============================== REMINDERS ============================== #
+class RefusingBackend(EmailBackend):
+    """
+    locmem backend that refuses any batch with a message to one of `refused`.
+    """
+
+    def __init__(self, refused, **kwargs):
+        super().__init__(**kwargs)
+        self.refused = set(refused)
+
+    def send_messages(self, messages):
+        if any(self.refused & set(message.to) for message in messages):
+            raise OSError("550 mailbox unavailable")
+        return super().send_messages(messages)
+
+class PlanReminderTests(TestCase):
+    """
+    A due plan moves on once its sponsor's summary is sent; failing student addresses are
+    counted but must not keep the plan due and get its other students mailed again.
+    """
+
+    def setUp(self):
+        self.school = create_school(courses=1, classes_per_course=1)
+        self.students = create_students(self.school, 10)
+        sponsor = self.school["sponsor"]
+        sponsor.email = "sponsor@test.ac"
+        sponsor.save()
+
+        today = timezone.localdate()
+        FeeAging.objects.bulk_create([
+            FeeAging(student=student, outstanding=Decimal("500.00"), current=Decimal("500.00"), aged_on=today)
+            for student in self.students
+        ])
+        self.now = timezone.now()
+        self.plan = PaymentPlan.objects.create(sponsor=sponsor, plan="Monthly", datenextreminder=self.now - timedelta(hours=1))
+
+    def send(self, refused):
+        log = io.StringIO()
+        with redirect_stdout(log):
+            stats = send_plan_reminders(now=self.now, connection=RefusingBackend(refused), batch_size=4)
+        self.plan.refresh_from_db()
+        return stats, log.getvalue()
+
+    def test_failed_student_address_does_not_hold_the_plan(self):
+        stats, log = self.send(["s3@test.ac"])
+
+        self.assertEqual((stats["sent"], stats["failed"], stats["deferred"]), (10, 1, 0))
+        self.assertIn("s3@test.ac", log)
+        self.assertGreater(self.plan.datenextreminder, self.now)
+
+        # Nothing is due on the next run, so nobody is mailed twice
+        stats, _ = self.send(["s3@test.ac"])
+        self.assertEqual((stats["plans"], stats["sent"]), (0, 0))
+
+    def test_failed_summary_keeps_the_plan_due(self):
+        stats, log = self.send(["sponsor@test.ac"])
+
+        self.assertEqual((stats["sent"], stats["failed"], stats["deferred"]), (10, 1, 1))
+        self.assertIn("sponsor@test.ac", log)
+        self.assertLessEqual(self.plan.datenextreminder, self.now)
+
+# ============================== INVOICE NUMBERS ============================== #
+class InvoiceNumberConcurrencyTests(TransactionTestCase):
+    """
+    Invoice numbers handed out to concurrent writers (M-Pesa callbacks, bulk invoicing)
+    must never repeat. TransactionTestCase so each thread commits on its own connection.
+    """
+
+    THREADS = 16
+    INVOICES_PER_THREAD = 25
+    BLOCK = 50
+
+    def setUp(self):
+        self.school = create_school(courses=1, classes_per_course=1)
+        self.students = create_students(self.school, self.THREADS)
+
+    def run_threads(self, target) -> float:
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def run(index):
+            try:
+                start.wait()
+                target(index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.THREADS)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(errors, [])
+        return elapsed
+
+    def test_concurrent_invoices_get_unique_numbers(self):
+        term = self.school["term"]
+
+        def create_invoices(index):
+            for _ in range(self.INVOICES_PER_THREAD):
+                Invoice.objects.create(inv_no=generate_invoice_number(term), student=self.students[index], term=term, amount=Decimal("100.00"))
+
+        elapsed = self.run_threads(create_invoices)
+
+        total = self.THREADS * self.INVOICES_PER_THREAD
+        numbers = list(Invoice.objects.values_list("inv_no", flat=True))
+        rate = f"{total} invoices from {self.THREADS} threads at {total / elapsed:.0f} invoices/s"
+        self.assertEqual(len(numbers), total, rate)
+        self.assertEqual(len(set(numbers)), total, rate)
+        self.assertEqual(InvoiceSequence.objects.get().last_value, total, rate)
+
+    def test_concurrent_reservations_do_not_overlap(self):
+        term = self.school["term"]
+        reserved = [None] * self.THREADS
+
+        def reserve(index):
+            reserved[index] = [number for _ in range(self.INVOICES_PER_THREAD) for number in reserve_invoice_numbers(term, self.BLOCK)]
+
+        elapsed = self.run_threads(reserve)
+
+        total = self.THREADS * self.INVOICES_PER_THREAD * self.BLOCK
+        numbers = [number for block in reserved for number in block]
+        rate = f"{total} numbers in blocks of {self.BLOCK} from {self.THREADS} threads at {total / elapsed:.0f} numbers/s"
+        self.assertEqual(len(numbers), total, rate)
+        self.assertEqual(len(set(numbers)), total, rate)
+        self.assertEqual(InvoiceSequence.objects.get().last_value, total, rate)
+
+# ============================== M-PESA TOKENS ============================== #
+class StubDaraja(BaseHTTPRequestHandler):
+    """
+    Local stand-in for Safaricom: GET is the OAuth endpoint, POST the STK push. Counts calls
+    on the server.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls["oauth"] += 1
+        time.sleep(0.2) # slow enough for every request to arrive while the token is fetched
+        self.reply({"access_token": "stub-token", "expires_in": "3599"})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.calls["stkpush"] += 1
+            number = self.server.calls["stkpush"]
+        if self.headers.get("Authorization") != "Bearer stub-token":
+            self.reply({"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+            return
+        self.reply({
+            "ResponseCode": "0", "CustomerMessage": "Success", "CheckoutRequestID": f"ws_CO_{number}",
+            "MerchantRequestID": f"M{number}",
+        })
+
+class StubServer(ThreadingHTTPServer):
+    request_queue_size = 128 # the default backlog of 5 resets connections under load
+    daemon_threads = True
+
+class MpesaTokenConcurrencyTests(TransactionTestCase):
+    """
+    Concurrent STK pushes must share one OAuth token fetch.
+    """
+
+    PAYMENTS = 100
+
+    def setUp(self):
+        self.school = create_school(courses=1, classes_per_course=1)
+        self.students = create_students(self.school, self.PAYMENTS)
+        self.user = get_staff_user()
+
+        self.server = StubServer(("127.0.0.1", 0), StubDaraja)
+        self.server.calls = {"oauth": 0, "stkpush": 0}
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        for name, value in {
+            "SAFARICOM_API": f"http://127.0.0.1:{self.server.server_port}", "MPESA_CONSUMER_KEY": "test-key",
+            "MPESA_CONSUMER_SECRET": "test-secret", "MPESA_PASSKEY": "test-passkey", "MPESA_SHORTCODE": "174379",
+        }.items():
+            patcher = mock.patch.object(api_settings, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        token_cache.tokens.clear()
+        token_cache.failures.clear()
+        self.addCleanup(token_cache.tokens.clear)
+
+    def pay(self, student, responses):
+        try:
+            request = APIRequestFactory().post(
+                "/finance/api/request-payment/",
+                {"student_id": student.id, "wallet_id": self.school["wallet"].id, "amount": 100},
+                format="json",
+            )
+            force_authenticate(request, user=self.user)
+            responses.append(views.request_payment(request))
+        finally:
+            connections.close_all()
+
+    def test_concurrent_payments_fetch_one_token(self):
+        responses = []
+        threads = [threading.Thread(target=self.pay, args=(student, responses)) for student in self.students]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [200] * self.PAYMENTS)
+        self.assertEqual(self.server.calls, {"oauth": 1, "stkpush": self.PAYMENTS})
+        self.assertEqual(PaymentAttempt.objects.count(), self.PAYMENTS)
+        self.assertEqual(AccessToken.objects.count(), 1)
+
+    def test_stored_token_is_reused_by_another_process(self):
+        self.pay(self.students[0], [])
+        # A process starting with an empty cache reads the stored token instead of fetching one
+        token_cache.tokens.clear()
+        self.pay(self.students[1], [])
+
+        self.assertEqual(self.server.calls, {"oauth": 1, "stkpush": 2})
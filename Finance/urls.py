@@ -10,6 +10,7 @@ router.register(r'prioritylevel', PriorityLevelViewSet, basename='prioritylevel'
 router.register(r'accounts', AccountViewSet, basename='accounts')
 router.register(r'feeparticular', FeeParticularViewSet, basename='feeparticular')
 router.register(r'feestatus', FeeStatusViewSet, basename='feestatus')
+router.register(r'feeaging', FeeAgingViewSet, basename='feeaging')
 router.register(r'receipts', ReceiptViewSet, basename='receipts')
 router.register(r'transaction', TransactionViewSet, basename='transaction')
 router.register(r'paymentattempt', PaymentAttemptViewSet, basename='paymentattempt')
@@ -20,9 +21,14 @@ urlpatterns = [
     path('bank/payment/webhook/', bank_payment_webhook, name='bank_payment_webhook'),
     path("api/payments/mpesa-stk/", request_payment, name="mpesa-stk"),
     path("api/payments/stk-status/", check_stk_status, name="mpesa-stk"),
+    path("api/payments/mpesa-stk-async/", request_payment_async, name="mpesa-stk-async"),
     path("api/payments/stk-callback/", mpesa_c2b_confirmation, name = "stk-callback"),
+    path("api/payments/stk-result/", mpesa_stk_callback, name = "stk-result"),
+    path("api/payments/gateway-metrics/", gateway_metrics, name = "gateway-metrics"),
     path('api/dashboard/kpi/', kpi_dashboard, name = "kpi"),
     path('api/statement/', generate_statement, name = "statements"),
+    path('api/statement/export/', export_statement, name = "statement-export"),
+    path('api/export/<str:dataset>/', export_records, name = "export-records"),
     path('api/logs/', generate_logs, name = "logs"),
     path('api/student-receipts/', student_receipts, name = "receipts"),
     path('api/fee-structure/', fee_structure, name = "fee-structure"),
@@ -51,6 +57,7 @@ urlpatterns = [
     path('api/create-invoices-course-append/', create_invoice_course_append, name='create-invoice-course-append'),
     path('api/create-invoices-course-overide/', create_invoice_course_overide, name='create-invoice-course-overide'),
     path('api/create-invoices-course-new/', create_invoice_course_new, name='create-invoice-course-new'),
+    path('api/term-rollover/', term_rollover, name='term-rollover'),
 
 
 ]
@@ -3,31 +3,44 @@ from rest_framework import viewsets, status, permissions #type: ignore
 from rest_framework.response import Response #type: ignore
 from rest_framework.decorators import api_view, permission_classes #type: ignore
 from rest_framework.permissions import IsAuthenticated, AllowAny #type: ignore
+from rest_framework.exceptions import AuthenticationFailed #type: ignore
+from rest_framework_simplejwt.authentication import JWTAuthentication #type: ignore
+from asgiref.sync import sync_to_async #type: ignore
+from django.db import transaction #type: ignore
 from django.views.decorators.csrf import csrf_exempt #type: ignore
-from django.http import JsonResponse #type: ignore
+from django.http import JsonResponse, StreamingHttpResponse #type: ignore
 from rest_framework.pagination import PageNumberPagination #type: ignore
-import json
+import json, requests
 from decimal import Decimal
 from django.db.models import OuterRef, Subquery, F, DecimalField, Sum, Value as V#type: ignore
-from django.db.models.functions import Coalesce, ExtractYear, TruncMonth #type: ignore
+from django.db.models.functions import Coalesce #type: ignore
 from django.views.decorators.http import require_POST #type: ignore
 from collections import defaultdict, OrderedDict
 from datetime import date
 import calendar
 
-from threading import Thread
-from django.utils.dateparse import parse_datetime # type: ignore
-
-from Core.models import Class, Department, CourseDuration, Course
+from Core.models import Class, Department, CourseDuration, Course, Job
 from Students.models import Student, Allocate_Student
-from Students.views import predict_applications
 
 from Core.application import is_admin_user, is_student_user, is_rep_user
+from Core.jobs import enqueue, get_job_status, get_task_name
 
 from .models import *
 from .filters import *
 from .serailizers import *
 from .application import *
+from .forecasting import get_fee_forecast
+from .invoicing import create_invoice, create_new_invoices, create_newterm_invoices, invoice_term_rollover, start_term_rollover
+from .fee_aggregator import FeeAggregator
+from .balances import get_pending_dues
+from .gateway import daraja
+from .payments import settle_stk_result, get_payment_channel, stk_push_executor
+from .statements import build_statement, get_statement_terms, iter_statement_csv, iter_statement_pdf
+from .rollups import get_fee_trend, parse_period
+from .callbacks import receive_callback
+from .exports import EXPORTS, EXPORT_FORMATS, get_export_queryset, iter_export
+from .fee_structures import get_structure, get_structures
+from .aging import get_aging_queryset, get_aging_summary, schedule_reaging
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 5
@@ -42,6 +55,103 @@ class StandardResultsSetPagination(PageNumberPagination):
             'count': self.page.paginator.count,
         })
  
+def get_payment_request(user, body):
+    """
+    Validates an STK push request and resolves who is paying into which wallet.
+
+    Returns:
+        (details, None) with the requesting user, student, wallet, amount, phone and payer name, or
+        (None, JsonResponse) with the error to return.
+    """
+    student_id = body.get("student_id")
+
+    if is_student_user(user) or is_rep_user(user):
+        student_id = Student.objects.get(regno=body.get("student_id")).id
+    wallet_id = body.get("wallet_id")
+    amount = int(body.get("amount", 0))
+
+    if not student_id or not wallet_id or amount <= 0:
+        return None, JsonResponse({"message": "Missing or invalid data."}, status=400)
+    
+    # Fetch Student
+    try:
+        student = Student.objects.select_related("sponsor").get(id=student_id)
+    except Student.DoesNotExist:
+        return None, JsonResponse({"message": "Student not found."}, status=404)
+
+    # Determine phone number
+    if student.sponsor.name.upper() == "SELF":
+        phone = student.phone
+        payer_name = student.get_full_name()
+    else:
+        phone = student.sponsor.phone  # Ensure this field exists
+        payer_name = student.sponsor.name
+
+    if not phone:
+        return None, JsonResponse({"message": "Phone number not available."}, status=400)
+
+    # Fetch wallet to determine payment method
+    try:
+        wallet = Wallet.objects.select_related("payment_method").get(id=wallet_id)
+    except Wallet.DoesNotExist:
+        return None, JsonResponse({"message": "Wallet not found."}, status=404)
+
+    if wallet.payment_method.name.upper() == "BANK":
+        return None, JsonResponse({"message": "Bank payments not supported yet."}, status=400)
+
+    return {"user": user, "student": student, "wallet": wallet, "amount": amount, "phone": phone, "payer_name": payer_name}, None
+
+def get_stk_push_args(details) -> dict:
+    student = details["student"]
+    return {
+        "phone_number": details["phone"],
+        "amount": details["amount"],
+        "paybill": details["wallet"].paybill,
+        "account_reference": f"{student.regno} SchoolFee",
+        "transaction_desc": f"Fee Payment by {student.fname} {student.sname}",
+    }
+
+def record_payment_attempt(details, mpesa_response) -> JsonResponse:
+    """
+    Stores a pending PaymentAttempt for an accepted STK push and builds the response.
+    """
+    if "errorCode" in mpesa_response:
+        return JsonResponse({
+            "success": False,
+            "message": mpesa_response.get("errorMessage", "M-Pesa Error"),
+            "errorCode": mpesa_response.get("errorCode"),
+        }, status=400)
+
+    if mpesa_response.get("ResponseCode") == "0":
+        PaymentAttempt.objects.create(
+            student = details["student"],
+            requested_by = details["user"],
+            wallet = details["wallet"],
+            amount = details["amount"],
+            ref_id = mpesa_response.get("CheckoutRequestID"),
+            payer_name = details["payer_name"],
+            account_number = details["phone"],
+            status = "Pending",
+            merchant_request_id=mpesa_response.get("MerchantRequestID"),
+            checkout_request_id=mpesa_response.get("CheckoutRequestID"),
+            response_payload=json.dumps(mpesa_response)
+        )
+
+        return JsonResponse({
+            "success": True,
+            "message": mpesa_response.get("CustomerMessage"),
+            "checkout_id": mpesa_response.get("CheckoutRequestID"),
+            "merchant_id": mpesa_response.get("MerchantRequestID"),
+            "channel": get_payment_channel(mpesa_response.get("CheckoutRequestID")),
+        })
+
+    # Unexpected fallback
+    return JsonResponse({
+        "success": False,
+        "message": "Unexpected response from M-Pesa",
+        "raw": mpesa_response
+    }, status=500)
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def request_payment(request):
@@ -49,97 +159,106 @@ def request_payment(request):
         if not request.user.is_authenticated:
             return JsonResponse({"message": "Unauthorized"}, status=401)
         
-        user = request.user
-        body = json.loads(request.body)
-        student_id = body.get("student_id")
-        
-        if is_student_user(user) or is_rep_user(user):
-            student_id = Student.objects.get(regno=body.get("student_id")).id
-        wallet_id = body.get("wallet_id")
-        amount = int(body.get("amount", 0))
+        details, error = get_payment_request(request.user, json.loads(request.body))
+        if error:
+            return error
 
-        if not student_id or not wallet_id or amount <= 0:
-            return JsonResponse({"message": "Missing or invalid data."}, status=400)
-        
-        # Fetch Student
-        try:
-            student = Student.objects.get(id=student_id)
-        except Student.DoesNotExist:
-            return JsonResponse({"message": "Student not found."}, status=404)
-
-        # Determine phone number
-        if student.sponsor.name.upper() == "SELF":
-            phone = student.phone
-            payer_name = student.get_full_name()
-        else:
-            phone = student.sponsor.phone  # Ensure this field exists
-            payer_name = student.sponsor.name
-
-        if not phone:
-            return JsonResponse({"message": "Phone number not available."}, status=400)
+        # Initiate M-Pesa STK Push
+        mpesa_response = initiate_stk_push(**get_stk_push_args(details))
+        return record_payment_attempt(details, mpesa_response)
 
-        # Fetch wallet to determine payment method
-        try:
-            wallet = Wallet.objects.get(id=wallet_id)
-        except Wallet.DoesNotExist:
-            return JsonResponse({"message": "Wallet not found."}, status=404)
+    except ValueError:
+        return JsonResponse({"message": "Invalid amount or payload."}, status=400)
+    except requests.RequestException as e:
+        print("M-Pesa gateway error:", str(e))
+        return JsonResponse({"message": "M-Pesa is not reachable right now, please try again shortly."}, status=503)
+    except Exception as e:
+        print("Unexpected error:", str(e))
+        return JsonResponse({"message": "Something went wrong."}, status=500)
 
-        if wallet.payment_method.name.upper() == "BANK":
-            return JsonResponse({"message": "Bank payments not supported yet."}, status=400)
+def get_jwt_user(request):
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return authenticated[0] if authenticated else None
 
-        # Initiate M-Pesa STK Push
-        mpesa_response = initiate_stk_push(
-            phone_number = phone,
-            amount = amount,
-            paybill = wallet.paybill,
-            account_reference = f"{student.regno} SchoolFee",
-            transaction_desc=f"Fee Payment by {student.fname} {student.sname}"
-        )
+@csrf_exempt
+async def request_payment_async(request):
+    """
+    Same as `request_payment`, served from the event loop under ASGI: the Safaricom round trip
+    runs in a worker thread, so a slow STK push holds no request worker while it waits.
+    Clients follow the result on the websocket in the response's `channel`.
+    """
+    if request.method != "POST":
+        return JsonResponse({"message": "Method not allowed"}, status=405)
 
-        if "errorCode" in mpesa_response:
-            return JsonResponse({
-                "success": False,
-                "message": mpesa_response.get("errorMessage", "M-Pesa Error"),
-                "errorCode": mpesa_response.get("errorCode"),
-            }, status=400)
-
-        if mpesa_response.get("ResponseCode") == "0":
-            PaymentAttempt.objects.create(
-                student = student,
-                wallet = wallet,
-                amount = amount,
-                ref_id = mpesa_response.get("CheckoutRequestID"),
-                payer_name = payer_name,
-                account_number = phone,
-                status = "Pending",
-                merchant_request_id=mpesa_response.get("MerchantRequestID"),
-                checkout_request_id=mpesa_response.get("CheckoutRequestID"),
-                response_payload=json.dumps(mpesa_response)
-            )
+    try:
+        user = await sync_to_async(get_jwt_user)(request)
+        if not user:
+            return JsonResponse({"message": "Unauthorized"}, status=401)
 
-            return JsonResponse({
-                "success": True,
-                "message": mpesa_response.get("CustomerMessage"),
-                "checkout_id": mpesa_response.get("CheckoutRequestID"),
-                "merchant_id": mpesa_response.get("MerchantRequestID")
-            })
+        details, error = await sync_to_async(get_payment_request)(user, json.loads(request.body))
+        if error:
+            return error
 
-        # Unexpected fallback
-        return JsonResponse({
-            "success": False,
-            "message": "Unexpected response from M-Pesa",
-            "raw": mpesa_response
-        }, status=500)
+        # Warm the token cache on the request thread so the push thread does not touch the database
+        await sync_to_async(get_mpesa_access_token)()
+        mpesa_response = await sync_to_async(initiate_stk_push, thread_sensitive=False, executor=stk_push_executor)(**get_stk_push_args(details))
+        return await sync_to_async(record_payment_attempt)(details, mpesa_response)
 
     except ValueError:
         return JsonResponse({"message": "Invalid amount or payload."}, status=400)
+    except requests.RequestException as e:
+        print("M-Pesa gateway error:", str(e))
+        return JsonResponse({"message": "M-Pesa is not reachable right now, please try again shortly."}, status=503)
     except Exception as e:
         print("Unexpected error:", str(e))
         return JsonResponse({"message": "Something went wrong."}, status=500)
 
+@csrf_exempt
+def mpesa_stk_callback(request):
+    """
+    Safaricom posts the outcome of every STK push here (MPESA_CALLBACK_URL). The result is
+    recorded and pushed to the payer's websocket (see `get_payment_channel`); clients without
+    a socket still poll check_stk_status.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid request method"})
+
+    try:
+        callback = json.loads(request.body.decode('utf-8'))["Body"]["stkCallback"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid payload"})
+
+    try:
+        attempt = PaymentAttempt.objects.select_related("student").filter(
+            checkout_request_id=callback.get("CheckoutRequestID")
+        ).first()
+        if not attempt:
+            return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted but unmatched"})
+
+        metadata = {
+            item.get("Name"): item.get("Value")
+            for item in callback.get("CallbackMetadata", {}).get("Item", [])
+        }
+        with transaction.atomic():
+            attempt = PaymentAttempt.objects.select_for_update().get(id=attempt.id)
+            settle_stk_result(attempt, callback.get("ResultCode"), callback.get("ResultDesc", "Unknown"), metadata.get("MpesaReceiptNumber"))
+
+        return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+    except Exception as e:
+        print(f"[ERROR]: STK callback failed: {e}")
+        return JsonResponse({"ResultCode": 1, "ResultDesc": f"Error: {str(e)}"})
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def mpesa_c2b_confirmation(request):
+    """
+    Acknowledges a C2B confirmation as soon as it is in the payment callback inbox; the
+    receipt is created by the inbox job (see Finance.callbacks).
+    """
     if request.method != 'POST':
         return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid request method"})
 
@@ -149,51 +268,14 @@ def mpesa_c2b_confirmation(request):
         return JsonResponse({"ResultCode": 1, "ResultDesc": "Invalid JSON"})
 
     try:
-        trans_id = data.get('TransID')
-        trans_time = data.get('TransTime')
-        trans_amount = float(data.get('TransAmount', 0))
-        msisdn = data.get('MSISDN')  # Phone number
-        account_number = data.get('BillRefNumber')  # Admission number
-
-        # Match student
-        student = Student.objects.filter(regno=account_number).first()
-
-        if not student:
-            # Optionally: log to UnmatchedPayment
-            # UnmatchedPayment.objects.create(...)
-            return JsonResponse({"ResultCode": 0, "ResultDesc": "Accepted but unmatched"})
-
-        # Cleanly format name
-        first = data.get("FirstName", "")
-        middle = data.get("MiddleName", "")
-        last = data.get("LastName", "")
-        payer_name = " ".join(filter(None, [first, middle, last]))
-
-        wallet = Wallet.objects.filter(name__contains = "MPesa").first()
-
-        if PaymentAttempt.objects.filter(ref_id=trans_id).exists():
+        callback, created = receive_callback("mpesa-c2b", data)
+        if not created:
             return JsonResponse({"ResultCode": 0, "ResultDesc": "Duplicate transaction"})
 
-        attempt = PaymentAttempt.objects.create(
-            wallet = wallet,
-            status="Success",
-            account_number=msisdn,
-            payer_name=payer_name,
-            ref_id=trans_id,
-            merchant_request_id=trans_id,
-            checkout_request_id=trans_id,
-            student=student,
-            amount=trans_amount,
-            response_payload=json.dumps(data)
-        )
-
-        rcpt = create_receipt(attempt.id)
-        Thread(target=process_fee_allocation, args=(rcpt.id,)).start()
-
         return JsonResponse({
             "ResultCode": 0,
             "ResultDesc": "Accepted",
-            "transaction_id": trans_id,
+            "transaction_id": callback.trans_id,
         })
 
     except Exception as e:
@@ -221,49 +303,9 @@ def check_stk_status(request):
         result_code = str(response.get("ResultCode", "9999"))
         result_desc = response.get("ResultDesc", "Unknown")
 
-        attempt.response_payload += f"\n\n{result_desc}"
-
-        if result_code == "0":
-            attempt.status = "Success"
-            attempt.ref_id = response.get("TransID", attempt.ref_id)
-            attempt.save()
-
-            rcpt = create_receipt(attempt.id)
-            Thread(target=process_fee_allocation, args=(rcpt.id,)).start()
-
-            return JsonResponse({
-                "success": True,
-                "status": "SUCCESS",
-                "transaction_id": attempt.ref_id,
-                "payer": attempt.student.get_full_name(),
-                "amount": attempt.amount
-            })
-
-        elif result_code in ["1", "1032", "1037", "2001"]:
-            attempt.status = "Failed"
-            attempt.save()
-
-            message_map = {
-                "1": "Insufficient funds.",
-                "1032": "User cancelled the payment.",
-                "1037": "User unreachable.",
-                "2001": "Wrong M-Pesa PIN entered."
-            }
-
-            return JsonResponse({
-                "success": True,
-                "status": "FAILED",
-                "message": message_map.get(result_code, "Transaction failed.")
-            })
-
-        else:
-            # Still pending
-            attempt.save()
-            return JsonResponse({
-                "success": True,
-                "status": "PENDING",
-                "message": result_desc
-            })
+        with transaction.atomic():
+            attempt = PaymentAttempt.objects.select_for_update().get(id=attempt.id)
+            return JsonResponse(settle_stk_result(attempt, result_code, result_desc, response.get("TransID")))
 
     except Exception as e:
         return JsonResponse({"success": False, "message": str(e)}, status=500)
@@ -272,52 +314,14 @@ def check_stk_status(request):
 def bank_payment_webhook(request):
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
-
-            trans_id = data.get('trans_id')
-            account_number = data.get('account_number')
-            bank_name = data.get('bank_name')
-            amount = data.get('amount')
-            student_reg = data.get('reference_number')  # Your custom field (e.g., reg number)
-            trans_time = parse_datetime(data.get('trans_time')) or timezone.now()
-
-            # Check if student exists
-            try:
-                student = Student.objects.get(registration_number=student_reg)
-            except Student.DoesNotExist:
-                student = None
-
-            # Save the transaction
-            bank_txn, created = Transaction.objects.get_or_create(
-                trans_id=trans_id,
-                defaults={
-                    'bank_name': bank_name,
-                    'account_number': account_number,
-                    'amount': amount,
-                    'trans_time': trans_time,
-                    'reference_number': student_reg,
-                    'status': 'CONFIRMED'
-                }
-            )
-
-            # Optionally auto-create a Receipt
-            if student and created:
-                payment_method, _ = PaymentMethod.objects.get_or_create(name=bank_name, code=bank_name.upper())
-                mode, _ = Wallet.objects.get_or_create(payment_method = payment_method)
-
-                Receipt.objects.create(
-                    student=student,
-                    term=Term.objects.latest("start_date"),
-                    amount_paid=amount,
-                    balance=0,
-                    pay_mode=mode,
-                    cashier="System",
-                )
+            callback, created = receive_callback("bank", json.loads(request.body))
+            if not created:
+                return JsonResponse({'message': 'Duplicate transaction'}, status=200)
 
             return JsonResponse({
-                'message': 'Transaction processed',
-                'transaction_id': bank_txn.id
-            }, status=201 if created else 200)
+                'message': 'Transaction received',
+                'transaction_id': callback.trans_id
+            }, status=201)
 
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
@@ -367,6 +371,12 @@ class WalletViewSet(viewsets.ModelViewSet):
     serializer_class = WalletSerializer
     queryset = Wallet.objects.all().order_by('id')
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == "list":
+            queryset = annotate_wallet_stats(queryset)
+        return queryset
+
     def list(self, request, *args, **kwargs):
         query_param = request.query_params.get("all")
 
@@ -458,6 +468,46 @@ class FeeStatusViewSet(viewsets.ModelViewSet):
     
     serializer_class = FeeStatusSerializer
 
+class FeeAgingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Students owing fees with their debt split into aging buckets. Filters: `branch`, `class`,
+    `course`, `min_amount`, `min_days`, `bucket`; sorted by `ordering` (default -outstanding).
+    """
+    pagination_class = StandardResultsSetPagination
+    serializer_class = FeeAgingSerializer
+
+    def get_queryset(self):
+        if self.action != "list":
+            return FeeAging.objects.select_related("student", "student__course", "student__branch", "student__students__Class")
+
+        params = self.request.query_params
+        return get_aging_queryset(
+            branch_id = params.get("branch"),
+            class_id = params.get("class"),
+            course_id = params.get("course"),
+            min_amount = params.get("min_amount"),
+            min_days = params.get("min_days"),
+            bucket = params.get("bucket"),
+            ordering = params.get("ordering"),
+        )
+
+    def list(self, request, *args, **kwargs):
+        schedule_reaging()
+        try:
+            queryset = self.get_queryset()
+        except (ValueError, ArithmeticError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if request.query_params.get("summary") == "true":
+            return Response(get_aging_summary(queryset))
+        if request.query_params.get('no_pagination') == 'true':
+            self.pagination_class = None  # disables pagination for this request
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response({'results': self.get_serializer(queryset, many=True).data})
+
 class ReceiptViewSet(viewsets.ModelViewSet):
     filter_backends = [ExtendedMultiKeywordSearchFilter]
     pagination_class = StandardResultsSetPagination
@@ -536,18 +586,8 @@ def kpi_dashboard(request):
     # Total collected (all transactions)
     total_collected = Receipt.objects.aggregate(total=models.Sum('amount'))['total'] or Decimal("0.00")
 
-    students = Student.objects.all()
-    latest_statuses = []
-    for student in students:
-        latest_status = FeeStatus.objects.filter(student=student).order_by('-created_at').first()   
-        if latest_status:
-            latest_statuses.append(latest_status) 
-
-    # Filter and sum arrears for NOT-CLEARED only
-    pending_dues = Decimal("0.00")
-    for status in latest_statuses:
-        if status.status == "Not-Cleared":
-            pending_dues += status.arrears
+    # Sum arrears for students whose latest position is NOT-CLEARED
+    pending_dues = get_pending_dues()
 
     # Total students
     total_students = Student.objects.count()
@@ -576,99 +616,79 @@ def kpi_dashboard(request):
 
 def create_invoice_for_new_student(mode):
     if mode == "all":
-        excluded_states = ["Cleared", "Suspended", "Expelled", "Graduated", "Differ"]
-        eligible_students = Student.objects.exclude(state__in=excluded_states)
-        for student in eligible_students:
-            target_term = Term.objects.get(name=Institution.objects.first().current_intake, year=Institution.objects.first().current_year)
-            create_newterm_invoice(student.regno, term_id=target_term.id)
+        # Invoiced in bulk by a background job; see `term_rollover` for its progress
+        institution = Institution.objects.first()
+        target_term = Term.objects.get(name=institution.current_intake, year=institution.current_year)
+        return start_term_rollover(target_term)
 
     else:
         # Handle specific mode logic here
         pass
         
-@api_view(['GET'])
+@api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
-def generate_statement(request):
+def term_rollover(request):
+    """
+    POST queues new-term invoicing for every billable student (`term_id`, default the current
+    term) and returns the job; GET returns the latest rollover job for the term and its progress.
+    """
+    term_id = request.data.get("term_id") if request.method == "POST" else request.query_params.get("term_id")
+
     try:
-        student_regno = request.query_params.get('student_regno')
-        student = Student.objects.get(regno=student_regno) if student_regno else Student.objects.first()
+        if term_id:
+            term = Term.objects.get(id=term_id)
+        else:
+            institution = Institution.objects.first()
+            term = Term.objects.get(name=institution.current_intake, year=institution.current_year)
+    except Term.DoesNotExist:
+        return Response({"error": "Term not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        term_id = request.query_params.get('term_id')
-        institution = Institution.objects.first()
-        term = (
-            Term.objects.get(name=institution.current_intake, year=institution.current_year)
-            if not term_id else Term.objects.get(id=term_id)
-        )
+    if request.method == "POST":
+        job = start_term_rollover(term)
+        return Response(get_job_status(job), status=status.HTTP_202_ACCEPTED)
 
-        # Gather invoices and receipts
-        invoices = Invoice.objects.filter(student = student, term = term).order_by('created_at')
-        receipts = Receipt.objects.filter(student = student, term = term).order_by('created_at')
-        status = FeeStatus.objects.filter(student = student, term = term).order_by('created_at')
+    job = Job.objects.filter(name=get_task_name(invoice_term_rollover), payload__args=[term.id]).order_by("-id").first()
+    if not job:
+        return Response({"error": "No rollover has been started for this term"}, status=status.HTTP_404_NOT_FOUND)
+    return Response(get_job_status(job))
 
-        statement = []
+def get_statement_request(request):
+    """
+    Resolves the student and terms of a statement request. `term_ids` is a comma separated
+    list of terms or "all"; `term_id` a single term; the default is the current term.
+    """
+    student_regno = request.query_params.get('student_regno')
+    student = Student.objects.get(regno=student_regno) if student_regno else Student.objects.first()
 
-        # === Add Invoices ===
-        for invoice in invoices:
-            statement.append({
-                "transaction_id": invoice.inv_no,
-                "date": invoice.created_at,  # will be formatted later
-                "record": {
-                    "detail": "New Term Invoice",
-                    "paid_in": f"{invoice.paid_amount} bal b/f",
-                    "paid_out": f"{invoice.amount}",
-                    "balance": f"{status.filter(purpose = invoice.inv_no).first().arrears}",
-                }
-            })
+    term_ids = request.query_params.get('term_ids')
+    term_id = request.query_params.get('term_id')
+    if term_ids == "all":
+        terms = get_statement_terms(student)
+    elif term_ids:
+        terms = get_statement_terms(student, [int(term) for term in term_ids.split(",")])
+    elif term_id:
+        terms = [Term.objects.select_related("name", "year").get(id=term_id)]
+    else:
+        institution = Institution.objects.first()
+        terms = [Term.objects.select_related("name", "year").get(name=institution.current_intake, year=institution.current_year)]
 
-        # === Add Receipts with grouped voteheads ===
-        for receipt in receipts:
-            running_balance = status.filter(purpose = receipt.trans_id).first().arrears  - receipt.amount
-            txns = Transaction.objects.filter(receipt=receipt).order_by("-id")
-            txn_details = {}
-            sorted_txn_details = {}
-            if txns:
-                pre_running_balance = status.filter(purpose = receipt.trans_id).first().arrears
-                if pre_running_balance>0:
-                    sorted_txn_details["Overpayment"] = {
-                        "paid_out": f"{pre_running_balance}",
-                        "balance": f"{pre_running_balance}"
-                    }
-                for txn in txns:
-                    running_balance += txn.amount
-                    txn_details[txn.account.account.votehead] = {
-                        "paid_out": f"{txn.amount}",
-                        "balance": f"{running_balance}",
-                    }
-
-                # Sort txn_details in reverse
-                key_list = list(txn_details.keys())
-                key_list.reverse()
-                for keys in key_list:
-                    sorted_txn_details[keys] = txn_details[keys]
+    return student, terms
 
-            else:
-                sorted_txn_details["Overpayment"] = {
-                    "paid_out": "",
-                    "balance": f"{running_balance}"
-                }
-
-            # Add paid_in inside the record
-            sorted_txn_details["paid_in"] = f"{receipt.amount}"
-
-            statement.append({
-                "transaction_id": receipt.trans_id,
-                "date": receipt.created_at,  # will be formatted later
-                "record": sorted_txn_details
-            })
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def generate_statement(request):
+    try:
+        student, terms = get_statement_request(request)
 
-        # === Sort by datetime then format date ===
-        sorted_statement = sorted(statement, key=lambda x: x['date'], reverse=True)
-        for item in sorted_statement:
+        statement = build_statement(student, terms)
+        statement.reverse()
+        for item in statement:
             item["date"] = item["date"].strftime("%d/%m/%Y %H:%M")
+            del item["balance"]
 
         return JsonResponse({
             "student": student.get_full_name(),
-            "statement": sorted_statement
+            "statement": statement
         }, status=200)
 
     except Student.DoesNotExist:
@@ -676,6 +696,77 @@ def generate_statement(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_statement(request):
+    """
+    Streams a student's statement, oldest entry first, as CSV (`?export=csv`, the default)
+    or PDF (`?export=pdf`). Takes the same parameters as `generate_statement`.
+    """
+    try:
+        student, terms = get_statement_request(request)
+        export_format = request.query_params.get('export', 'csv').lower()
+        statement = build_statement(student, terms)
+        filename = f"statement_{student.regno}".replace("/", "-")
+
+        if export_format == "pdf":
+            institution = Institution.objects.first()
+            title = [
+                f"{institution.name if institution else ''} - Fee Statement",
+                f"{student.get_full_name()} ({student.regno})",
+                ", ".join(str(term) for term in terms),
+            ]
+            response = StreamingHttpResponse(iter_statement_pdf(statement, title), content_type="application/pdf")
+            response["Content-Disposition"] = f'attachment; filename="{filename}.pdf"'
+            return response
+
+        if export_format != "csv":
+            return JsonResponse({"error": "export must be csv or pdf"}, status=400)
+
+        response = StreamingHttpResponse(iter_statement_csv(statement), content_type="text/csv")
+        response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+        return response
+
+    except (Student.DoesNotExist, Term.DoesNotExist):
+        return JsonResponse({"error": "Student or term not found"}, status=404)
+    except ValueError:
+        return JsonResponse({"error": "Invalid term_ids"}, status=400)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_records(request, dataset):
+    """
+    Streams a whole ledger table for auditors: receipts, transactions, invoices or
+    fee-statuses, as `?export=csv` (default), `xlsx` or `ndjson`. Rows are read from the
+    database in chunks and written out as they arrive.
+
+    Filters: start / end (YYYY-MM-DD, inclusive; date of payment for receipts, creation date
+    otherwise), term, course.
+    """
+    export_format = request.query_params.get('export', 'csv').lower()
+    if dataset not in EXPORTS:
+        return JsonResponse({"error": f"Unknown export {dataset}"}, status=404)
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({"error": "export must be csv, xlsx or ndjson"}, status=400)
+
+    try:
+        queryset = get_export_queryset(
+            dataset,
+            start=request.query_params.get('start'),
+            end=request.query_params.get('end'),
+            term_id=request.query_params.get('term'),
+            course_id=request.query_params.get('course'),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iter_export(dataset, export_format, queryset), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{dataset}_{timezone.localdate():%Y%m%d}.{extension}"'
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def generate_logs(request):
@@ -811,7 +902,7 @@ def reciept_summary(request):
         total_receipt = sum(r.amount for r in receipts)
 
         # Get current fee status
-        status_obj = FeeStatus.objects.filter(student=student, term=term).last()
+        status_obj = StudentFeeBalance.objects.filter(student=student, term=term).first()
         status = {
             "status": status_obj.status if status_obj else "",
             "arrears": float(status_obj.arrears) if status_obj and status_obj.arrears is not None else ""
@@ -877,20 +968,24 @@ def view_receipts(request):
 @permission_classes([IsAuthenticated])
 def class_fee_report(request):
     try:
-        class_id = request.param_query.get("class_id")
-        term_id = request.param_query.get("term_id")
-        classroom = Allocate_Student.objects.get(Class__id = class_id, term__id = term_id)
-        students = classroom.students.all() 
+        class_id = request.query_params.get("class_id")
+        term_id = request.query_params.get("term_id")
+        classroom = Class.objects.get(id = class_id)
+        term = Term.objects.get(id = term_id)
+
+        allocations = Allocate_Student.objects.filter(Class = classroom).select_related("studentno")
+        aggregator = FeeAggregator(term, students=Student.objects.filter(students__Class=classroom))
 
         report = []
 
-        for student in students:
-            invoices = Invoice.objects.filter(student=student)
+        for alloc in allocations:
+            student = alloc.studentno
+            student_totals = aggregator.get("student", student.id)
 
-            total_invoiced = sum(inv.total_amount for inv in invoices)
-            total_paid = sum(inv.total_paid for inv in invoices)  # or use related payments
+            total_invoiced = student_totals["invoiced"]
+            total_paid = student_totals["paid"]
 
-            balance = total_invoiced - total_paid
+            balance = student_totals["balance"]
             if balance <= 0:
                 status = "Paid"
             elif total_paid == 0:
@@ -900,7 +995,7 @@ def class_fee_report(request):
 
             report.append({
                 "regno": student.regno,
-                "name": student.fullname,
+                "name": student.get_full_name(),
                 "total_invoiced": total_invoiced,
                 "total_paid": total_paid,
                 "balance": balance,
@@ -911,8 +1006,10 @@ def class_fee_report(request):
             "class": classroom.name,
             "students": report
         })
-    except Allocate_Student.DoesNotExist:
+    except Class.DoesNotExist:
         return Response({"error": "Class not found"}, status=404)
+    except Term.DoesNotExist:
+        return Response({"error": "Term not found"}, status=404)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -944,17 +1041,19 @@ def view_course_invoices(request):
         module_fees = {}
         modules = Module.objects.all().order_by("id")
 
+        structures = get_structures([(course.id, module.id, term.id) for module in modules])
+
         for module in modules:
-            fee_particulars = FeeParticular.objects.filter(course=course, term=term, module=module, target="Course")
+            fee_particulars = structures[(course.id, module.id, term.id)].course_items
 
-            if not fee_particulars.exists():
+            if not fee_particulars:
                 continue
 
             fee_data = []
             total = 0
             for fee in fee_particulars:
                 fee_data.append({
-                    "votehead": fee.account.votehead,
+                    "votehead": fee.votehead,
                     "amount": float(fee.amount)
                 })
                 total += float(fee.amount)
@@ -1003,32 +1102,18 @@ def class_income_statement(request):
             intake = term,   # 🔁 Change this line if you use a different term-related field
         ).order_by("branch", "name")
 
-        # Group students by class
-        allocations = Allocate_Student.objects.filter(Class__in=course_classes).select_related("studentno", "Class")
-        student_map = defaultdict(list)
-
-        for alloc in allocations:
-            student_map[str(alloc.Class.id)].append(alloc.studentno)
+        # Totals per class for the term, grouped in the database
+        aggregator = FeeAggregator(term, students=Student.objects.filter(students__Class__in=course_classes))
 
         response_data = []
 
-        for cls in course_classes:
+        for cls in course_classes.select_related("branch"):
             class_id = str(cls.id)
-            students = student_map.get(class_id, [])
-
-            total_invoiced = Decimal("0.00")
-            total_paid = Decimal("0.00")
+            class_totals = aggregator.get("class", cls.id)
 
-            for student in students:
-                invoices = Invoice.objects.filter(student=student, term=term)
-                receipts = Receipt.objects.filter(student=student, term=term)
-                
-                total_invoiced += sum(inv.amount for inv in invoices)
-                total_paid += sum(rcp.amount for rcp in receipts)
-                # # Add Overpayments to total_paid
-                # total_paid += sum(inv.paid_amount for inv in invoices if inv.paid_amount is not None)
-
-            balance = total_invoiced - total_paid
+            total_invoiced = class_totals["invoiced"]
+            total_paid = class_totals["paid"]
+            balance = class_totals["balance"]
 
             if balance == 0 and total_invoiced == 0:
                 status_label = "No Data"
@@ -1079,19 +1164,17 @@ def class_student_breakdown(request):
 
         # Get students in class
         allocations = Allocate_Student.objects.filter(Class=classroom).select_related("studentno")
+        aggregator = FeeAggregator(term, students=Student.objects.filter(students__Class=classroom))
 
         student_data = []
 
         for alloc in allocations:
             student = alloc.studentno
-            invoices = Invoice.objects.filter(student=student, term=term)
-            receipts = Receipt.objects.filter(student=student, term=term)
+            student_totals = aggregator.get("student", student.id)
 
-            invoice_total = sum(inv.amount for inv in invoices)
-            paid_total = sum(rc.amount for rc in receipts)
-            # # Add Overpayments to paid_total
-            # paid_total += sum(inv.paid_amount for inv in invoices if inv.paid_amount is not None)
-            balance = invoice_total - paid_total
+            invoice_total = student_totals["invoiced"]
+            paid_total = student_totals["paid"]
+            balance = student_totals["balance"]
 
             if balance == 0:
                 status_label = "Cleared"
@@ -1180,58 +1263,30 @@ def institution_fee_summary(request):
             return Response({"error": "Current term not found"}, status=400)
 
         # Current term data
-        invoices = Invoice.objects.filter(term=current_term)
-        receipts = Receipt.objects.filter(term=current_term)
+        aggregator = FeeAggregator(current_term)
+        current_totals = aggregator.totals()
 
-        total_invoiced = invoices.aggregate(total=Coalesce(Sum('amount'), V(0), output_field=DecimalField()))['total']
-        total_paid = receipts.aggregate(total=Coalesce(Sum('amount'), V(0), output_field=DecimalField()))['total']
-        total_balance = total_invoiced - total_paid
+        total_invoiced = current_totals["invoiced"]
+        total_paid = current_totals["paid"]
+        total_balance = current_totals["balance"]
 
         # Previous term comparison data
         prev_invoiced, prev_paid, prev_balance = 0, 0, 0
         if previous_term:
-            prev_invoiced = Invoice.objects.filter(term=previous_term).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            prev_paid = Receipt.objects.filter(term=previous_term).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            prev_balance = prev_invoiced - prev_paid
+            previous_totals = FeeAggregator(previous_term).totals()
+            prev_invoiced = previous_totals["invoiced"]
+            prev_paid = previous_totals["paid"]
+            prev_balance = previous_totals["balance"]
 
-        cleared, owing, overpaid = 0, 0, 0
-        student_balances = defaultdict(Decimal)
-
-        for student in Student.objects.all():
-            stu_invoiced = invoices.filter(student=student).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            stu_paid = receipts.filter(student=student).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            balance = stu_invoiced - stu_paid
-
-            if balance == 0:
-                cleared += 1
-            elif balance > 0:
-                owing += 1
-            else:
-                overpaid += 1
+        counts = aggregator.balance_counts(Student.objects.count())
+        cleared, owing, overpaid = counts["cleared"], counts["owing"], counts["overpaid"]
 
         # Top classes
         class_balances = []
-        for cls in Class.objects.all():
-            student_ids = Allocate_Student.objects.filter(Class=cls).values_list("studentno", flat=True)
-            cls_invoiced = invoices.filter(student_id__in=student_ids).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            cls_paid = receipts.filter(student_id__in=student_ids).aggregate(
-                total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-            )['total']
-            balance = cls_invoiced - cls_paid
-
+        for cls in Class.objects.only("id", "name"):
             class_balances.append({
                 "name": cls.name,
-                "balance": float(balance)
+                "balance": float(aggregator.get("class", cls.id)["balance"])
             })
 
         top_classes = sorted([c for c in class_balances if c["balance"] > 0], key=lambda x: -x["balance"])[:5]
@@ -1239,23 +1294,20 @@ def institution_fee_summary(request):
         overpaid_classes = sorted([c for c in class_balances if c["balance"] < 0], key=lambda x: x["balance"])[:5]
 
         # By department
+        dept_courses = defaultdict(list)
+        for course in Course.objects.all():
+            dept_courses[course.department_id].append(course)
+
         dept_data = []
         for dept in Department.objects.all():
-            dept_courses = Course.objects.filter(department=dept)
             dept_invoiced, dept_paid = 0, 0
             course_list = []
 
-            for course in dept_courses:
-                class_ids = Class.objects.filter(course=course).values_list("id", flat=True)
-                student_ids = Allocate_Student.objects.filter(Class_id__in=class_ids).values_list("studentno", flat=True)
-
-                course_invoiced = invoices.filter(student_id__in=student_ids).aggregate(
-                    total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-                )['total']
-                course_paid = receipts.filter(student_id__in=student_ids).aggregate(
-                    total=Coalesce(Sum('amount'), V(0), output_field=DecimalField())
-                )['total']
-                balance = course_invoiced - course_paid
+            for course in dept_courses.get(dept.id, []):
+                course_totals = aggregator.get("course", course.id)
+                course_invoiced = course_totals["invoiced"]
+                course_paid = course_totals["paid"]
+                balance = course_totals["balance"]
 
                 if balance == 0:
                     status = "Cleared"
@@ -1317,89 +1369,64 @@ def institution_fee_summary(request):
         print("Error in institution_fee_summary:", e)
         return Response({"error": str(e)}, status=500)
 
+def get_rollup_filters(request) -> dict:
+    return {
+        "term_id": request.query_params.get("term"),
+        "course_id": request.query_params.get("course"),
+        "department_id": request.query_params.get("department"),
+    }
+
 class InstitutionFeeTrendAPIView(APIView):
+    """
+    Yearly invoiced and received totals, from the fee rollups. Defaults to the past five
+    years; `start`/`end` (YYYY or YYYY-MM) pick any range, `term`, `course` and `department` filter.
+    """
     def get(self, request):
         current_year = date.today().year
-        start_year = current_year - 4  # Past 5 years
-
-        # Annotate and aggregate invoice totals by year
-        invoice_data = (
-            Invoice.objects.filter(created_at__year__gte=start_year)
-            .annotate(year=ExtractYear("created_at"))
-            .values("year")
-            .annotate(total=Sum("amount"))
-            .order_by("year")
-        )
 
-        # Annotate and aggregate receipt totals by year
-        receipt_data = (
-            Receipt.objects.filter(dop__year__gte = start_year)
-            .annotate(year=ExtractYear("dop"))
-            .values("year")
-            .annotate(total=Sum("amount"))
-            .order_by("year")
-        )
+        try:
+            start = parse_period(request.query_params.get("start"), (current_year - 4, 1))
+            end = parse_period(request.query_params.get("end"), (current_year, 12), end=True)
+        except ValueError:
+            return Response({"error": "start and end must be YYYY or YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Convert to dict: {year: amount}
-        invoice_map = {str(i["year"]): float(i["total"]) for i in invoice_data}
-        receipt_map = {str(r["year"]): float(r["total"]) for r in receipt_data}
-
-        # Combine into trend list
-        trend = []
-        for year in range(start_year, current_year + 1):
-            y = str(year)
-            trend.append({
-                "year": y,
-                "invoiced": round(invoice_map.get(y, 0)),
-                "received": round(receipt_map.get(y, 0)),
-            })
+        periods = get_fee_trend(start, end, by="year", **get_rollup_filters(request))
+
+        trend = [
+            {
+                "year": str(year),
+                "invoiced": round(float(totals["invoiced"])),
+                "received": round(float(totals["received"])),
+            }
+            for year, totals in periods.items()
+        ]
 
         return Response(trend)
 
 class InstitutionMonthlyFeeSummary(APIView):
+    """
+    Monthly invoiced and paid totals, from the fee rollups. Defaults to the current year;
+    takes the same `start`/`end` and filters as `InstitutionFeeTrendAPIView`.
+    """
     def get(self, request):
         current_year = date.today().year
 
-        # Get invoiced per month
-        invoices = (
-            Invoice.objects.filter(created_at__year = current_year)
-            .annotate(month=TruncMonth("created_at"))
-            .values("month")
-            .annotate(total_invoiced=Sum("amount"))
-            .order_by("month")
-        )
-
-        # Get paid per month
-        payments = (
-            Receipt.objects.filter(created_at__year = current_year)
-            .annotate(month=TruncMonth("created_at"))
-            .values("month")
-            .annotate(total_paid=Sum("amount"))
-            .order_by("month")
-        )
-
-        # Build month map
-        month_map = OrderedDict()
-        for i in range(1, 13):
-            month_name = calendar.month_abbr[i]
-            month_map[month_name] = {"invoiced": 0, "paid": 0}
-
-        for inv in invoices:
-            month = calendar.month_abbr[inv["month"].month]
-            month_map[month]["invoiced"] = inv["total_invoiced"]
+        try:
+            start = parse_period(request.query_params.get("start"), (current_year, 1))
+            end = parse_period(request.query_params.get("end"), (current_year, 12), end=True)
+        except ValueError:
+            return Response({"error": "start and end must be YYYY or YYYY-MM"}, status=status.HTTP_400_BAD_REQUEST)
 
-        for pay in payments:
-            month = calendar.month_abbr[pay["month"].month]
-            month_map[month]["paid"] = pay["total_paid"]
+        periods = get_fee_trend(start, end, by="month", **get_rollup_filters(request))
 
-        # Prepare response
         data = [
             {
-                "month": month,
-                "invoiced": float(values["invoiced"]),
-                "paid": float(values["paid"]),
+                "year": year,
+                "month": calendar.month_abbr[month],
+                "invoiced": float(totals["invoiced"]),
+                "paid": float(totals["received"]),
             }
-            for month, values in month_map.items()
+            for (year, month), totals in periods.items()
         ]
 
         return Response(data)
@@ -1410,125 +1437,23 @@ def equity_payment_callback(request):
     """
     This receives payment notifications from Equity Bank
     """
-    data = request.data
     try:
-        amount = float(data.get("amount"))
-        reference = data.get("reference")  # e.g., ADM00123
-        sender = data.get("sender_name")
-        transaction_id = data.get("transaction_id")
-        msisdn = data.get("sender_account")
-
-        student = Student.objects.filter(regno=reference).first()
-        if not student:
-            return Response({"error": "Student not found"}, status=400)
-
-        wallet = Wallet.objects.filter(name__contains = "Equity").first()
-
-        if PaymentAttempt.objects.filter(ref_id=transaction_id).exists():
+        callback, created = receive_callback("equity", request.data)
+        if not created:
             return JsonResponse({"ResultCode": 0, "ResultDesc": "Duplicate transaction"})
 
-        attempt = PaymentAttempt.objects.create(
-            wallet = wallet,
-            status="Success",
-            account_number=msisdn,
-            payer_name=sender,
-            ref_id=transaction_id,
-            merchant_request_id=transaction_id,
-            checkout_request_id=transaction_id,
-            student=student,
-            amount=amount,
-            response_payload=json.dumps(data)
-        )
-
-        rcpt = create_receipt(attempt.id)
-        Thread(target=process_fee_allocation, args=(rcpt.id,)).start()
-
         return Response({"status": "success"}, status=200)
 
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
     
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def predict_fee_payments(request):
-    current_year = datetime.now().year
-    next_year = current_year + 1
-
-    # Retrive Enrollment Prediction
-    app_request = request._request  # low-level Django request
-    app_prediction_response = predict_applications(app_request)  # Call existing function
-    app_data = json.loads(app_prediction_response.content)  # Get JSON response
-
-    course_dict = app_data.get("by_course", {})
-
-    # Extract predicted students per course
-    predicted_enrollment = {}
-    for course_id in course_dict:
-        predicted_enrollment[course_id] = course_dict[course_id]
-    
-    total_students = 0
-    total_invoice = 0
-    total_receipt = 0
-    department_data = {}
-
-    # Get historical average payment rate per course
-    course_payment_rates = get_historical_payment_rates()
-    
-    for course_id, student_count in predicted_enrollment.items():
-        try:
-            course = Course.objects.get(id = course_id)
-            department = course.department
-        except Course.DoesNotExist:
-            continue
-
-        fee_per_student = get_course_fee(course)
-        invoice_total = fee_per_student * student_count
-        payment_rate = course_payment_rates.get(course_id, 0.9)  # Fallback: 90%
-        receipt_total = invoice_total * Decimal(str(payment_rate))
-        balance = invoice_total - receipt_total
-
-        total_students += student_count
-        total_invoice += invoice_total
-        total_receipt += receipt_total
-
-        dept_id = department.id
-        if dept_id not in department_data:
-            department_data[dept_id] = {
-                "id": dept_id,
-                "name": department.name,
-                "abbr": department.abbr,
-                "students": 0,
-                "invoice": 0,
-                "receipt": 0,
-                "balance": 0,
-                "courses": []
-            }
-
-        department_data[dept_id]["students"] += student_count
-        department_data[dept_id]["invoice"] += invoice_total
-        department_data[dept_id]["receipt"] += receipt_total
-        department_data[dept_id]["balance"] += balance
-
-        department_data[dept_id]["courses"].append({
-            "id": course.id,
-            "abbr": course.abbr,
-            "name": course.name,
-            "students": student_count,
-            "invoice": invoice_total,
-            "receipt": receipt_total,
-            "balance": balance
-        })
-
-    # Final response
-    response = {
-        "total_students": total_students,
-        "total_invoice": int(total_invoice),
-        "total_receipt": int(total_receipt),
-        "total_balance": int(total_invoice - total_receipt),
-        "departments": list(department_data.values())
-    }
-
-    return Response(response)
+    forecast, _ = get_fee_forecast()
+    return Response(forecast)
 
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
@@ -1551,9 +1476,9 @@ def check_fee_structure(request):
             return Response({"error": "No course found"}, status=status.HTTP_400_BAD_REQUEST)
         
         # Get Fee Particulars by Module
-        fee_particulars = FeeParticular.objects.filter(course=course.course, term=term, module=course.module, target="Course")
+        fee_structure = get_structure(course.course_id, course.module_id, term.id)
         
-        if not fee_particulars.exists():
+        if not fee_structure.course_items:
             return Response({"feeCheckError": True}, status=status.HTTP_200_OK)
 
         return Response({"feeCheckSuccess":True}, status=status.HTTP_200_OK)
@@ -1580,70 +1505,64 @@ def check_invoice_match_feestructure(request):
         
         results = []
 
+        # One lookup for every allocation, structure and invoice instead of one per student
+        allocations = Allocate_Student.objects.select_related("studentno").in_bulk(student_ids)
+        structures = get_structures({
+            (allocation.studentno.course_id, allocation.module_id, term.id)
+            for allocation in allocations.values()
+            if allocation.studentno.course_id and allocation.module_id
+        })
+        invoice_fee_ids = defaultdict(list)
+        invoices = Invoice.objects.filter(
+            student_id__in={allocation.studentno_id for allocation in allocations.values()},
+            term=term
+        ).prefetch_related("narration").order_by("id")
+        for invoice in invoices:
+            invoice_fee_ids[invoice.student_id].append({item.id for item in invoice.narration.all()})
+
         for student_id in student_ids:
-            try:
-                student_alloc = Allocate_Student.objects.get(id=student_id)
-
-                course_id = getattr(getattr(student_alloc.studentno, "course", None), "id", None)
-                module_id = getattr(getattr(student_alloc, "module", None), "id", None)
-
-                if not course_id or not module_id:
-                    results.append({
-                        "student_id": student_id,
-                        "student_name": str(student_alloc),
-                        "match": False,
-                        "reason": "Missing course/module"
-                    })
-                    continue
-
-                # ✅ Check fee structure
-                fee_structure_qs = FeeParticular.objects.filter(
-                    course_id=course_id,
-                    module_id=module_id,
-                    term=term
-                )
-                print(f"[STUDENT]: ", student_alloc.studentno.get_full_name())
-                print(f"[FEE STRUCTURE]: ", fee_structure_qs)
-
-                if not fee_structure_qs.exists():
-                    results.append({
-                        "student_id": student_id,
-                        "student_name": str(student_alloc),
-                        "match": False,
-                        "reason": "No matching fee structure"
-                    })
-                    continue
-
-                # ✅ Check if voteheads are in fee structure
-                fee_structure_ids = set(fee_structure_qs.values_list('id', flat=True))
-                invoice_qs = Invoice.objects.filter(
-                    student=student_alloc.studentno,
-                    term=term
-                ).distinct()
-                print(f"[INVOICES]: ", invoice_qs)
-
-                invoice_match = False
-                for invoice in invoice_qs:
-                    invoice_fee_ids = set(invoice.narration.values_list('id', flat=True))
-                    if invoice_fee_ids == fee_structure_ids:
-                        invoice_match = True
-                        break
-                print(f"[INVOICE MATCH]: ", invoice_match)
+            student_alloc = allocations.get(int(student_id))
+            if not student_alloc:
+                results.append({
+                    "student_id": student_id,
+                    "match": False,
+                    "reason": "Student not found"
+                })
+                continue
+
+            course_id = student_alloc.studentno.course_id
+            module_id = student_alloc.module_id
 
+            if not course_id or not module_id:
                 results.append({
                     "student_id": student_id,
-                    "student_name": str(student_alloc.studentno.get_full_name()),
-                    "match": invoice_match,
-                    "reason": "Match found" if invoice_match else "No matching invoice"
+                    "student_name": str(student_alloc),
+                    "match": False,
+                    "reason": "Missing course/module"
                 })
-                print("\n")
- 
-            except Allocate_Student.DoesNotExist:
+                continue
+
+            # ✅ Check fee structure
+            fee_structure = structures[(course_id, module_id, term.id)]
+
+            if not fee_structure.items:
                 results.append({
                     "student_id": student_id,
+                    "student_name": str(student_alloc),
                     "match": False,
-                    "reason": "Student not found"
+                    "reason": "No matching fee structure"
                 })
+                continue
+
+            # ✅ Check if voteheads are in fee structure
+            invoice_match = fee_structure.ids in invoice_fee_ids[student_alloc.studentno_id]
+
+            results.append({
+                "student_id": student_id,
+                "student_name": str(student_alloc.studentno.get_full_name()),
+                "match": invoice_match,
+                "reason": "Match found" if invoice_match else "No matching invoice"
+            })
 
         print(results)
         return Response({"results": results}, status=status.HTTP_200_OK)
@@ -1753,30 +1672,16 @@ def create_invoice_course_overide(request):
             # Create New One
             response = create_feestructure(course_duration.course.id, passed_registry)
             # Apply to all students
-            students = Allocate_Student.objects.filter(term = term, module = course_duration.module, Class__course = course_duration.course)
-            print(f"[STUDENTS]: {students}")
-            for student in students:
-                print(f"Student: {student}")
-                print(f"Fee Narration: {response['feenarration']}")
-                inv_response = create_new_invoice(student.studentno.regno, term.id, response["feenarration"])
-                print(f"Invoice: {inv_response}")
+            students = Allocate_Student.objects.filter(term = term, module = course_duration.module, Class__course = course_duration.course).select_related("studentno")
+            create_new_invoices(students, term, response["feenarration"])
 
         # Counter check whether all the students have fee structure
         students_in_course = Allocate_Student.objects.filter(
             term=term,
             module=course_duration.module,
             Class__course=course_duration.course
-        )
-
-        for student in students_in_course:
-            has_invoice = Invoice.objects.filter(
-                student=student.studentno,  # assuming studentno FK to Student model
-                term=term
-            ).exists()
-
-            if not has_invoice:
-                # Create an invoice with the fee structure
-                invoice = create_newterm_invoice(student.studentno.regno, term.id)
+        ).select_related("studentno")
+        create_newterm_invoices(students_in_course, term)
     
         return Response({
             "success": success,
@@ -1833,9 +1738,8 @@ def create_invoice_course_append(request):
             # Create New One
             response = create_feestructure(course_duration.course.id, passed_registry)
             # Apply to all students
-            students = Allocate_Student.objects.filter(term = term, module = course_duration.module, Class__course = course_duration.course)
-            for student in students:
-                inv_response = create_new_invoice(student.studentno.regno, term.id, response["feenarration"])
+            students = Allocate_Student.objects.filter(term = term, module = course_duration.module, Class__course = course_duration.course).select_related("studentno")
+            create_new_invoices(students, term, response["feenarration"])
 
         
         # Counter check whether all the students have fee structure
@@ -1843,20 +1747,8 @@ def create_invoice_course_append(request):
             term=term,
             module=course_duration.module,
             Class__course=course_duration.course
-        )
-
-        for student in students_in_course:
-            has_invoice = Invoice.objects.filter(
-                student=student.studentno,  # assuming studentno FK to Student model
-                term=term
-            ).exists()
-
-            if not has_invoice:
-                # Create an invoice with the fee structure
-                invoice = create_newterm_invoice(student.studentno.regno, term.id)
-
-            # Create a New Invoice with the new addition
-            result = create_invoice(student.id, voteheads, "Course")
+        ).select_related("studentno")
+        create_newterm_invoices(students_in_course, term)
 
         return Response({
             "success": success,
@@ -1917,4 +1809,9 @@ def create_invoice_course_new(request):
             "error": True,
             "errMessage": f"{e}"
         })
-    
\ No newline at end of file
+    
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def gateway_metrics(request):
+    return Response(daraja.stats())
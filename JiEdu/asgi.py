@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application #type: ignore
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'JiEdu.settings')
 
-application = get_asgi_application()
+# Load the apps before importing any consumers
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter #type: ignore
+from channels.security.websocket import AllowedHostsOriginValidator #type: ignore
+
+from Finance.routing import websocket_urlpatterns as finance_websocket_urlpatterns
+from .channels_auth import JWTAuthMiddleware
+
+application = ProtocolTypeRouter({
+    "http": django_asgi_app,
+    "websocket": AllowedHostsOriginValidator(
+        JWTAuthMiddleware(URLRouter(finance_websocket_urlpatterns))
+    ),
+})
@@ -0,0 +1,28 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async #type: ignore
+from channels.middleware import BaseMiddleware #type: ignore
+from django.contrib.auth.models import AnonymousUser #type: ignore
+from rest_framework.exceptions import AuthenticationFailed #type: ignore
+from rest_framework_simplejwt.authentication import JWTAuthentication #type: ignore
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError #type: ignore
+
+@database_sync_to_async
+def get_token_user(raw_token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return AnonymousUser()
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Sets scope["user"] from the access token in the `token` query parameter
+    (ws/...?token=<access>), as browsers cannot send an Authorization header on a websocket.
+    """
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        token = query.get("token", [None])[0]
+        scope = dict(scope, user=await get_token_user(token) if token else AnonymousUser())
+        return await super().__call__(scope, receive, send)
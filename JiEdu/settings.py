@@ -143,6 +143,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Payment callbacks, invoicing and the job workers write concurrently; wait for the lock
+        # instead of failing, and take it when the transaction starts so it never has to be upgraded
+        'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+        # Tests run against a file too: the in-memory test database locks out concurrent writers
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -228,12 +233,53 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",  # for dev/testing
-        # or Redis:
-        # "BACKEND": "channels_redis.core.RedisChannelLayer",
-        # "CONFIG": {"hosts": [("127.0.0.1", 6379)]},
-    },
+# Payment results are broadcast by whichever process handles the M-Pesa callback to the one
+# holding the payer's websocket, so anything beyond a single dev server needs Redis
+REDIS_URL = config("REDIS_URL", default="")
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",  # for dev/testing, one process only
+        },
+    }
+
+# Cached fee structures are invalidated by whichever process edits them, so the web and
+# worker processes must share the cache: Redis when available, else the database
+# (python manage.py createcachetable)
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "jiedu_cache",
+        },
+    }
+
+
+# Face matching index used by recognition: "exact" compares every known face, "ivf" searches
+# the nearest clusters only (faster for institution-wide enrolment, may miss a few matches)
+FACE_INDEX = {
+    "BACKEND": "exact",
+    "OPTIONS": {},  # e.g. {"nlist": 316, "nprobe": 16} for "ivf"
 }
 
+# How KnownFace encodings are stored (Biometrics/face_encoding.py). "float32" halves the old
+# float64 rows; "float16" and "int8" are smaller still, check them with convert_face_encodings
+FACE_ENCODING = {
+    "DTYPE": "float32",
+    "MODEL": "dlib_face_recognition_resnet_model_v1",
+}
@@ -9,6 +9,7 @@ import string
 import random
 
 from Core.application import generate_password, generate_username
+from Core.jobs import enqueue
 from Core.models import UserProfile, User, CourseDuration, Institution, Term
 
 from Finance.application import create_newterm_invoice
@@ -61,12 +62,12 @@ def approve_application(application_id):
                         )
         newCode.save()
 
-        # Send Email/ SMS Logic
+        # Send Email/ SMS Logic (delivered by the job queue)
         try:
             message = f"{application.fname} {application.mname}'s application have been approved. The student has been assigned temporary number: {temp_regno}"
-            send_mail("COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,], key=f"application-approved:{application.id}:admin")
             message = f"Dear {application.fname} {application.mname}, \nYour application have been approved. \nKindly click on the link below to enroll for your course.\n {settings.DOMAIN_NAME}/application/enroll/{temp_regno[11:]}"
-            send_mail("COURSE APPLICATION", message, None, [application.email, ])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [application.email, ], key=f"application-approved:{application.id}:applicant")
         except Exception as e:
             print(f"[ERROR]: {e}")
 
@@ -144,11 +145,11 @@ def enroll_student(reg_no):
         invoice = create_newterm_invoice(new_perm_regno, Term.objects.get(name = Institution.objects.first().current_intake, year = Institution.objects.first().current_year).id)
 
         try:
-            # Send Email/ SMS
+            # Send Email/ SMS (delivered by the job queue; the credentials payload is cleared once sent)
             message = f"{applicant.fname} {applicant.sname} have joined the school. The student has been assigned a permanent registration number: {new_perm_regno}"
-            send_mail("COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,], key=f"enrolment:{applicant.id}:admin")
             message = f"Dear {applicant.fname} {applicant.mname}, \nYour have successfuly joined our school. \n\nYour Login Credential: \nUsername: {username}\nPassword: {password}"
-            send_mail("COURSE APPLICATION", message, None, [applicant.email, ])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [applicant.email, ], key=f"enrolment:{applicant.id}:student", sensitive=True)
         except Exception as e:
             print(f"[ERROR]: {e}")
         return {'message': f"Student fully registered Username: {username} Password: {password}"}
@@ -167,12 +168,12 @@ def decline_application(application_id):
         application.state = 'Declined'
         application.save()
          
-        # Send Email/ SMS Logic
+        # Send Email/ SMS Logic (delivered by the job queue)
         try:
             message = f"{application.fname} {application.mname}'s application have been declined."
-            send_mail("COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [settings.ADMIN_EMAIL,], key=f"application-declined:{application.id}:admin")
             message = f"Dear {application.fname} {application.mname}, \nWe regret to inform you that your application have been declined."
-            send_mail("COURSE APPLICATION", message, None, [application.email, ])
+            enqueue(send_mail, "COURSE APPLICATION", message, None, [application.email, ], key=f"application-declined:{application.id}:applicant")
         except Exception as e:
             print(f"[ERROR]: {e}")
 
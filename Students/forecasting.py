@@ -0,0 +1,120 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Hashable, List, Tuple
+
+import numpy as np #type: ignore
+from django.db.models import Count, Max #type: ignore
+from django.db.models.functions import ExtractYear #type: ignore
+
+from Core.forecasts import get_forecast, store_forecast
+
+from .models import Application
+
+def fit_trends(series: Dict[Hashable, List[Tuple[int, int]]]) -> Dict[Hashable, Tuple[float, float, int]]:
+    """
+    Least-squares line through each series of (year, total) points, all series in one NumPy
+    pass. Gives the same fit as a LinearRegression per series.
+
+    Returns:
+        {key: (slope, intercept, points)}
+    """
+    keys = list(series)
+    if not keys:
+        return {}
+
+    sizes = np.array([len(series[key]) for key in keys])
+    groups = np.repeat(np.arange(len(keys)), sizes)
+    points = np.array([point for key in keys for point in series[key]], dtype=np.float64)
+    x, y = points[:, 0], points[:, 1]
+
+    # Centre the years per series so the sums stay well conditioned
+    x_mean = np.bincount(groups, weights=x) / sizes
+    y_mean = np.bincount(groups, weights=y) / sizes
+    dx, dy = x - x_mean[groups], y - y_mean[groups]
+    sxx = np.bincount(groups, weights=dx * dx)
+    sxy = np.bincount(groups, weights=dx * dy)
+
+    slope = np.divide(sxy, sxx, out=np.zeros_like(sxy), where=sxx > 0)
+    intercept = y_mean - slope * x_mean
+
+    return {key: (float(slope[i]), float(intercept[i]), int(sizes[i])) for i, key in enumerate(keys)}
+
+def predict_trend(params: Tuple[float, float, int], year: int, fallback: int) -> int:
+    slope, intercept, points = params
+    if points > 1:
+        return int(slope * year + intercept)
+    return fallback
+
+FORECAST_NAME = "applications"
+
+def get_applications_version() -> str:
+    """
+    Changes whenever an application is added, edited or removed, and at the turn of the year.
+    """
+    stats = Application.objects.aggregate(count=Count("id"), last=Max("id"), edited=Max("updated_at"))
+    return f"applications:{datetime.now().year}:{stats['count']}:{stats['last']}:{stats['edited']}"
+
+def forecast_applications() -> dict:
+    """
+    Next year's applications in total and by course, gender, grade and age group, from the
+    yearly application counts. Every trend is fitted in one batch.
+
+    Returns:
+        The `predict_applications` response, plus the fitted `params`
+        ({"course:<id>": [slope, intercept, points], ...}).
+    """
+    current_year = datetime.now().year
+    next_year = current_year + 1
+    data = Application.objects.filter(doa__isnull=False).annotate(year_applied=ExtractYear("doa"))
+
+    series = defaultdict(list)
+    for row in data.values("year_applied").annotate(total=Count("id")).order_by("year_applied"):
+        series[("total", None)].append((int(row["year_applied"]), row["total"]))
+    for field, name in (("course__id", "course"), ("gender", "gender"), ("examgrade", "grade")):
+        for row in data.values("year_applied", field).annotate(total=Count("id")).order_by(field, "year_applied"):
+            series[(name, row[field])].append((row["year_applied"], row["total"]))
+
+    params = fit_trends(series)
+
+    total_pred = predict_trend(params[("total", None)], next_year, series[("total", None)][0][1]) if ("total", None) in params else 0
+    predictions = {"course": {}, "gender": {}, "grade": {}}
+    for (name, value), fitted in params.items():
+        if name != "total":
+            predictions[name][value] = predict_trend(fitted, next_year, series[(name, value)][0][1])
+
+    # Age groups of this year's applicants, scaled to the predicted total
+    age_groups = {"<18": 0, "18-24": 0, ">24": 0}
+    today = datetime.now().date()
+    for dob in data.filter(year_applied=current_year).values_list("dob", flat=True):
+        age = (today - dob.date()).days // 365
+        if age < 18:
+            age_groups["<18"] += 1
+        elif age <= 24:
+            age_groups["18-24"] += 1
+        else:
+            age_groups[">24"] += 1
+
+    applicants = sum(age_groups.values())
+    age_predictions = {k: int(v * (total_pred / applicants)) if applicants else 0 for k, v in age_groups.items()}
+
+    return {
+        "year": next_year,
+        "total_predicted": total_pred,
+        "by_course": predictions["course"],
+        "by_gender": predictions["gender"],
+        "by_age": age_predictions,
+        "by_grade": predictions["grade"],
+        "params": {f"{name}:{value}": list(fitted) for (name, value), fitted in params.items()},
+    }
+
+def refresh_applications_forecast() -> dict:
+    """
+    Job: recomputes the stored applications forecast.
+    """
+    return store_forecast(FORECAST_NAME, get_applications_version(), forecast_applications)
+
+def get_applications_forecast():
+    """
+    Returns (forecast, is_current). See `Core.forecasts.get_forecast`.
+    """
+    return get_forecast(FORECAST_NAME, get_applications_version(), forecast_applications, refresh=refresh_applications_forecast)
@@ -107,6 +107,7 @@ class Application(models.Model):
     intake = models.ForeignKey(Intake, on_delete=models.CASCADE)
     doa = models.DateTimeField(verbose_name='Date of Application', blank=True, null=True, default=utils.timezone.now) #date of application
     state = models.CharField(choices=APPLICATION_CHOICES, max_length=40, blank=True, null=True, default="Pending")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True) #last edit, versions the applications forecast
 
     def __str__(self):
         return self.fname +"'s Application"
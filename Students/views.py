@@ -7,8 +7,6 @@ from django.views.decorators.csrf import csrf_exempt #type: ignore
 from django.http import JsonResponse #type: ignore
 from django.db.models import Count, F, IntegerField, Value #type: ignore
 from django.db.models.functions import ExtractYear, Now #type: ignore
-from sklearn.linear_model import LinearRegression #type: ignore
-import numpy as np #type: ignore
 from datetime import datetime
 from collections import defaultdict, OrderedDict
 from django.utils.timezone import now  #type: ignore
@@ -23,6 +21,7 @@ from .models import *
 from .serializers import *
 from .filters import *
 from .application import *
+from .forecasting import get_applications_forecast
 
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
@@ -876,87 +875,8 @@ def student_gender_trend(request):
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])
 def predict_applications(request):
-    current_year = datetime.now().year
-    data = Application.objects.annotate(year_applied=ExtractYear("doa"))
-
-    # 1. Total Applications Per Year
-    yearly_data = data.values("year_applied").annotate(total=Count("id")).order_by("year_applied")
-    years = [int(row["year_applied"]) for row in yearly_data]
-    totals = [row["total"] for row in yearly_data]
-
-    # Predict total applications next year
-    reg = LinearRegression()
-    reg.fit(np.array(years).reshape(-1, 1), totals)
-    next_year = current_year + 1
-    total_pred = int(reg.predict([[next_year]])[0])
-
-    # 2. Per Course Prediction
-    course_data = data.values("year_applied", "course__id").annotate(total=Count("id"))
-    course_trends = defaultdict(list)
-    for row in course_data:
-        course_trends[row["course__id"]].append((row["year_applied"], row["total"]))
-
-    course_predictions = {}
-    for course, vals in course_trends.items():
-        ys, ts = zip(*vals)
-        if len(ys) > 1:
-            model = LinearRegression().fit(np.array(ys).reshape(-1, 1), ts)
-            course_predictions[course] = int(model.predict([[next_year]])[0])
-        else:
-            course_predictions[course] = ts[0]  # fallback
-
-    # 3. Gender Prediction
-    gender_data = data.values("year_applied", "gender").annotate(total=Count("id"))
-    gender_trends = defaultdict(list)
-    for row in gender_data:
-        gender_trends[row["gender"]].append((row["year_applied"], row["total"]))
-
-    gender_predictions = {}
-    for gender, vals in gender_trends.items():
-        ys, ts = zip(*vals)
-        if len(ys) > 1:
-            model = LinearRegression().fit(np.array(ys).reshape(-1, 1), ts)
-            gender_predictions[gender] = int(model.predict([[next_year]])[0])
-        else:
-            gender_predictions[gender] = ts[0]
-
-    # 4. Age Groups
-    age_groups = {"<18": 0, "18-24": 0, ">24": 0}
-    for app in data.filter(year_applied=current_year):
-        age = (datetime.now().date() - app.dob.date()).days // 365
-        if age < 18:
-            age_groups["<18"] += 1
-        elif age <= 24:
-            age_groups["18-24"] += 1
-        else:
-            age_groups[">24"] += 1
-
-    # Assume next year follows similar proportion trend
-    age_predictions = {k: int(v * (total_pred / sum(age_groups.values()))) for k, v in age_groups.items()}
-
-    # 5. Gradewise Predictions
-    grade_data = data.values("year_applied", "examgrade").annotate(total=Count("id"))
-    grade_trends = defaultdict(list)
-    for row in grade_data:
-        grade_trends[row["examgrade"]].append((row["year_applied"], row["total"]))
-
-    grade_predictions = {}
-    for grade, vals in grade_trends.items():
-        ys, ts = zip(*vals)
-        if len(ys) > 1:
-            model = LinearRegression().fit(np.array(ys).reshape(-1, 1), ts)
-            grade_predictions[grade] = int(model.predict([[next_year]])[0])
-        else:
-            grade_predictions[grade] = ts[0]
-
-    return JsonResponse({
-        "year": next_year,
-        "total_predicted": total_pred,
-        "by_course": course_predictions,
-        "by_gender": gender_predictions,
-        "by_age": age_predictions,
-        "by_grade": grade_predictions,
-    })
+    forecast, _ = get_applications_forecast()
+    return JsonResponse({key: value for key, value in forecast.items() if key != "params"})
 
 @api_view(["GET"])
 @permission_classes([permissions.IsAuthenticated])       